@@ -1,12 +1,70 @@
+import sys
 import socket
 
+from array import array
+from typing import Sequence
+
 serverIP = "127.0.0.1"
 serverPort = 9008
-msg_bytes = (300).to_bytes(4, byteorder='little')
+# ints of one datagram, the most that fit in the largest UDP payload
+MAX_BATCH = 65507 // 4
+timeout = 1.0
+
+
+def pack_ints(ints: Sequence[int]) -> bytes:
+    # array packs the whole batch in one C loop; 'i' is 4 bytes on every platform Python runs on
+    packed = array('i', ints)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_ints(buff: bytes) -> array:
+    ints = array('i')
+    ints.frombytes(buff[:len(buff) - len(buff) % ints.itemsize])
+    if sys.byteorder == 'big':
+        ints.byteswap()
+    return ints
+
+
+def incremented(value: int) -> int:
+    # what the server answers, Java ints wrap around
+    return (value + 1 + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+def echo_ints(client: socket.socket, ints: Sequence[int]) -> array:
+    # one round trip per MAX_BATCH ints; a lost datagram or reply is sent again after the timeout
+    replies = array('i')
+    for start in range(0, len(ints), MAX_BATCH):
+        batch = ints[start:start + MAX_BATCH]
+        request = pack_ints(batch)
+        client.sendto(request, (serverIP, serverPort))
+        while True:
+            try:
+                buff, address = client.recvfrom(len(request))
+            except socket.timeout:
+                client.sendto(request, (serverIP, serverPort))
+                continue
+            # the protocol has no request ids, a late reply to an earlier batch is told apart by its ends
+            reply = unpack_ints(buff)
+            if len(reply) == len(batch) and reply[0] == incremented(batch[0]) and reply[-1] == incremented(batch[-1]):
+                break
+        replies.extend(reply)
+    return replies
+
+
+if __name__ == '__main__':
+    print('PYTHON UDP CLIENT')
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-print('PYTHON UDP CLIENT')
-client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-client.sendto(msg_bytes, (serverIP, serverPort))
+    # with ints on the command line they go to the server in one batch
+    if len(sys.argv) > 1:
+        client.settimeout(timeout)
+        replies = echo_ints(client, [int(arg) for arg in sys.argv[1:]])
+        print(f"python udp server received msgs: {' '.join(map(str, replies))}")
+    else:
+        msg_bytes = (300).to_bytes(4, byteorder='little')
+        client.sendto(msg_bytes, (serverIP, serverPort))
 
-buff, address = client.recvfrom(1024)
-print(f"python udp server received msg: {int.from_bytes(buff, byteorder='little')}")
+        buff, address = client.recvfrom(1024)
+        print(f"python udp server received msg: {int.from_bytes(buff, byteorder='little')}")
@@ -0,0 +1,44 @@
+import time
+import socket
+import argparse
+
+from PythonUdpClient import echo_ints, serverIP, serverPort, timeout
+
+
+def per_int(client: socket.socket, ints: range) -> None:
+    # the original protocol, one datagram and one round trip per int
+    for value in ints:
+        client.sendto(value.to_bytes(4, byteorder='little', signed=True), (serverIP, serverPort))
+        buff, address = client.recvfrom(1024)
+        int.from_bytes(buff, byteorder='little', signed=True)
+
+
+def batched(client: socket.socket, ints: range, batch_size: int) -> None:
+    for start in range(0, len(ints), batch_size):
+        echo_ints(client, ints[start:start + batch_size])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ints per second through the server, one per datagram and batched")
+    parser.add_argument("--count", type=int, default=20000, help="ints sent in every run")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 256, 4096, 16376])
+    args = parser.parse_args()
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(timeout)
+    ints = range(args.count)
+
+    print(f"{'mode':>12} {'round trips':>12} {'ints/s':>12}")
+    start = time.perf_counter()
+    per_int(client, ints)
+    elapsed = time.perf_counter() - start
+    print(f"{'per-int':>12} {args.count:>12} {args.count / elapsed:>12.0f}")
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        batched(client, ints, batch_size)
+        elapsed = time.perf_counter() - start
+        print(f"{f'batch {batch_size}':>12} {-(-args.count // batch_size):>12} {args.count / elapsed:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,45 @@
 import java.net.DatagramPacket;
 import java.net.DatagramSocket;
-import java.net.InetAddress;
 import java.nio.ByteBuffer;
 import java.nio.ByteOrder;
-import java.nio.charset.StandardCharsets;
-import java.util.Arrays;
+import java.nio.IntBuffer;
 
 public class JavaUdpServer {
+    // the largest UDP payload; a datagram carries as many little-endian ints as fit in it, one int is the old protocol
+    static final int MAX_DATAGRAM_SIZE = 65507;
+
     public static void main(String[] args) {
         System.out.println("JAVA UDP SERVER");
 
         int portNumber = 9008;
         try (DatagramSocket socket = new DatagramSocket(portNumber)) {
-            byte[] receiveBuffer = new byte[1024];
+            byte[] receiveBuffer = new byte[MAX_DATAGRAM_SIZE];
+            byte[] sendBuffer = new byte[MAX_DATAGRAM_SIZE];
 
             while (true) {
-                Arrays.fill(receiveBuffer, (byte) 0);
                 DatagramPacket receivePacket = new DatagramPacket(receiveBuffer, receiveBuffer.length);
                 socket.receive(receivePacket);
 
-                int nb = ByteBuffer.wrap(receivePacket.getData()).order(ByteOrder.LITTLE_ENDIAN).getInt();
-                System.out.println("received msg: " + nb);
+                int count = receivePacket.getLength() / Integer.BYTES;
+                if (count == 0) {
+                    System.out.println("received a datagram without ints");
+                    continue;
+                }
+                IntBuffer received = ByteBuffer.wrap(receiveBuffer, 0, count * Integer.BYTES)
+                        .order(ByteOrder.LITTLE_ENDIAN).asIntBuffer();
+                IntBuffer reply = ByteBuffer.wrap(sendBuffer).order(ByteOrder.LITTLE_ENDIAN).asIntBuffer();
+                if (count == 1) {
+                    System.out.println("received msg: " + received.get(0));
+                } else {
+                    System.out.println("received " + count + " ints");
+                }
 
-                ++nb;
-                var buff = ByteBuffer.allocate(4).order(ByteOrder.LITTLE_ENDIAN).putInt(nb).array();
-                InetAddress address = InetAddress.getByName("localhost");
-                DatagramPacket sendPacket = new DatagramPacket(buff, buff.length, address, receivePacket.getPort());
+                // the whole batch is answered in one datagram, in the order it came
+                for (int i = 0; i < count; i++) {
+                    reply.put(i, received.get(i) + 1);
+                }
+                DatagramPacket sendPacket = new DatagramPacket(
+                        sendBuffer, count * Integer.BYTES, receivePacket.getSocketAddress());
                 socket.send(sendPacket);
             }
         } catch (Exception e) {
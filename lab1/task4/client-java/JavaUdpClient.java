@@ -1,6 +1,7 @@
 import java.net.DatagramPacket;
 import java.net.DatagramSocket;
 import java.net.InetAddress;
+import java.net.SocketTimeoutException;
 import java.util.Arrays;
 
 public class JavaUdpClient {
@@ -8,19 +9,46 @@ public class JavaUdpClient {
         System.out.println("JAVA UDP CLIENT");
 
         int portNumber = 9008;
+        // with a count the client pings that many times and prints the round trips, a lost ping times out
+        int count = args.length > 0 ? Integer.parseInt(args[0]) : 1;
         try (DatagramSocket socket = new DatagramSocket()) {
+            socket.setSoTimeout(1000);
             InetAddress address = InetAddress.getByName("localhost");
             byte[] sendBuffer = "JAVA: Ping".getBytes();
+            byte[] receiveBuffer = new byte[1024];
+            long[] rtts = new long[count];
+            int received = 0;
 
-            DatagramPacket sendPacket = new DatagramPacket(sendBuffer, sendBuffer.length, address, portNumber);
-            socket.send(sendPacket);
+            for (int i = 0; i < count; i++) {
+                long start = System.nanoTime();
+                DatagramPacket sendPacket = new DatagramPacket(sendBuffer, sendBuffer.length, address, portNumber);
+                socket.send(sendPacket);
 
-            byte[] receiveBuffer = new byte[1024];
-            Arrays.fill(receiveBuffer, (byte) 0);
-            DatagramPacket receivePacket = new DatagramPacket(receiveBuffer, receiveBuffer.length);
-            socket.receive(receivePacket);
-            String msg = new String(receivePacket.getData());
-            System.out.println("received msg: " + msg);
+                Arrays.fill(receiveBuffer, (byte) 0);
+                DatagramPacket receivePacket = new DatagramPacket(receiveBuffer, receiveBuffer.length);
+                try {
+                    socket.receive(receivePacket);
+                } catch (SocketTimeoutException e) {
+                    continue;
+                }
+                rtts[received++] = System.nanoTime() - start;
+                if (i == 0) {
+                    String msg = new String(receivePacket.getData(), 0, receivePacket.getLength());
+                    System.out.println("received msg: " + msg);
+                }
+            }
+
+            if (count > 1) {
+                String summary = "pings: " + count + " lost: " + (count - received);
+                if (received > 0) {
+                    long[] sorted = Arrays.copyOf(rtts, received);
+                    Arrays.sort(sorted);
+                    double avg = Arrays.stream(sorted).average().orElse(0) / 1e6;
+                    summary += String.format(" rtt ms avg: %.3f p50: %.3f p99: %.3f", avg,
+                            sorted[received / 2] / 1e6, sorted[received * 99 / 100] / 1e6);
+                }
+                System.out.println(summary);
+            }
         } catch (Exception e) {
             e.printStackTrace();
         }
@@ -1,12 +1,34 @@
+import sys
+import time
 import socket
 
 serverIP = "127.0.0.1"
 serverPort = 9008
 msg = "PYTHON: Ping"
+# with a count the client pings that many times and prints the round trips, a lost ping times out
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+timeout = 1.0
 
 print('PYTHON UDP CLIENT')
 client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-client.sendto(bytes(msg, 'utf8'), (serverIP, serverPort))
+client.settimeout(timeout)
 
-buff, address = client.recvfrom(1024)
-print("received msg: " + str(buff, 'cp1250'))
+rtts = []
+for i in range(count):
+    start = time.perf_counter()
+    client.sendto(bytes(msg, 'utf8'), (serverIP, serverPort))
+    try:
+        buff, address = client.recvfrom(1024)
+    except socket.timeout:
+        continue
+    rtts.append(time.perf_counter() - start)
+    if i == 0:
+        print("received msg: " + str(buff, 'cp1250'))
+
+if count > 1:
+    rtts.sort()
+    print(
+        f"pings: {count} lost: {count - len(rtts)}"
+        + (f" rtt ms avg: {sum(rtts) / len(rtts) * 1e3:.3f} p50: {rtts[len(rtts) // 2] * 1e3:.3f}"
+           f" p99: {rtts[len(rtts) * 99 // 100] * 1e3:.3f}" if rtts else "")
+    )
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import struct
+import argparse
+import tempfile
+import selectors
+import subprocess
+
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+TASK_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_CLIENT = os.path.join(TASK_DIR, "client-python", "PythonUdpClient.py")
+JAVA_CLIENT = os.path.join(TASK_DIR, "client-java", "JavaUdpClient.java")
+
+# the same as in the server, the harness does not import it so that it can drive any server on the port
+BINARY_PING = struct.pack("!BB", 0, 1)
+BINARY_TOKEN = struct.Struct("!Q")
+
+LOAD_PYTHON = "python"
+LOAD_JAVA = "java"
+LOAD_BINARY = "binary"
+LOAD_PINGS = {LOAD_PYTHON: b"PYTHON: Ping", LOAD_JAVA: b"JAVA: Ping"}
+LOAD_KINDS = (LOAD_PYTHON, LOAD_JAVA, LOAD_BINARY)
+PING_TIMEOUT = 1.0
+
+
+def compile_java_client(classes: str) -> Optional[List[str]]:
+    if shutil.which("javac") is None or shutil.which("java") is None:
+        return None
+    subprocess.run(["javac", "-d", classes, JAVA_CLIENT], check=True)
+    return ["java", "-cp", classes, "JavaUdpClient"]
+
+
+def run_clients(count: int) -> None:
+    # the real clients, side by side, each pinging one at a time and timing its own round trips
+    with tempfile.TemporaryDirectory() as classes:
+        commands: Dict[str, Optional[List[str]]] = {
+            "python client": [sys.executable, PYTHON_CLIENT, str(count)],
+            "java client": compile_java_client(classes),
+        }
+        processes = {
+            name: subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+            for name, command in commands.items() if command
+        }
+        for name, command in commands.items():
+            if not command:
+                print(f"{name:>14}: skipped, no javac/java on PATH")
+                continue
+            output, _ = processes[name].communicate()
+            summary = output.strip().splitlines()[-1] if output.strip() else f"exited with {processes[name].returncode}"
+            print(f"{name:>14}: {summary}")
+
+
+def load(kind: str, address: tuple, sockets: int, window: int, duration: float) -> None:
+    # every socket keeps window pings in flight; text pings carry nothing to match replies by, their round trips
+    # are taken in send order, which is the order of a loopback that drops nothing
+    selector = selectors.DefaultSelector()
+    in_flight: Dict[socket.socket, Deque[float]] = {}
+    for _ in range(sockets):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.connect(address)
+        selector.register(sock, selectors.EVENT_READ)
+        in_flight[sock] = deque()
+
+    def ping(sock: socket.socket) -> None:
+        now = time.perf_counter()
+        data = BINARY_PING + BINARY_TOKEN.pack(time.perf_counter_ns()) if kind == LOAD_BINARY else LOAD_PINGS[kind]
+        try:
+            sock.send(data)
+        except (BlockingIOError, ConnectionRefusedError):
+            pass
+        in_flight[sock].append(now)
+
+    rtts: List[float] = []
+    lost = 0
+    start = time.perf_counter()
+    for sock in in_flight:
+        for _ in range(window):
+            ping(sock)
+    while time.perf_counter() - start < duration:
+        for key, _ in selector.select(0.05):
+            sock = key.fileobj
+            while True:
+                try:
+                    data = sock.recv(1024)
+                except (BlockingIOError, ConnectionRefusedError):
+                    break
+                if not in_flight[sock]:
+                    continue
+                sent = in_flight[sock].popleft()
+                if kind == LOAD_BINARY and len(data) == 2 + BINARY_TOKEN.size:
+                    rtts.append((time.perf_counter_ns() - BINARY_TOKEN.unpack_from(data, 2)[0]) / 1e9)
+                else:
+                    rtts.append(time.perf_counter() - sent)
+                ping(sock)
+        # lost pings are given up, so that the window does not shrink
+        now = time.perf_counter()
+        for sock, sent_times in in_flight.items():
+            while sent_times and now - sent_times[0] > PING_TIMEOUT:
+                sent_times.popleft()
+                lost += 1
+                ping(sock)
+    elapsed = time.perf_counter() - start
+    for sock in in_flight:
+        selector.unregister(sock)
+        sock.close()
+
+    rtts.sort()
+    print(
+        f"{kind:>14}: {len(rtts) / elapsed:>10.0f} pings/s lost {lost:>6}"
+        + (f" rtt ms p50 {rtts[len(rtts) // 2] * 1e3:.3f} p99 {rtts[len(rtts) * 99 // 100] * 1e3:.3f}"
+           if rtts else "")
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="latency and throughput of a running ping server, from the Python and Java clients and a load "
+                    "generator"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9008, help="the clients always ping 9008")
+    parser.add_argument("--count", type=int, default=1000, help="pings of each client, one at a time")
+    parser.add_argument("--load", nargs="*", choices=LOAD_KINDS, default=list(LOAD_KINDS))
+    parser.add_argument("--sockets", type=int, default=8)
+    parser.add_argument("--window", type=int, default=32, help="pings in flight per socket")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds of every load run")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.count:
+        run_clients(args.count)
+    for kind in args.load:
+        load(kind, (args.host, args.port), args.sockets, args.window, args.duration)
+
+
+if __name__ == '__main__':
+    main()
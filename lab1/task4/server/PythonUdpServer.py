@@ -1,18 +1,195 @@
+import sys
+import time
 import socket
+import struct
+import argparse
+
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
 serverPort = 9008
-serverSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-serverSocket.bind(('', serverPort))
-buff = []
-
-print('PYTHON UDP SERVER')
-
-while True:
-    buff, address = serverSocket.recvfrom(1024)
-    buff = str(buff, 'cp1250')
-    if msg := buff.partition("JAVA: ")[2]:
-        serverSocket.sendto(bytes("Pong Java", 'cp1250'), address)
-    elif msg := buff.partition("PYTHON: ")[2]:
-        serverSocket.sendto(bytes("Pong Python", 'cp1250'), address)
+ENCODING = 'cp1250'
+MAX_BUF_SIZE = 1024
+
+# a binary ping is: zero byte, kind, 8 bytes the client picks (a sequence number or a timestamp); the reply is the
+# same datagram with the pong kind, so nothing has to be parsed or encoded on either side
+BINARY_HEADER = struct.Struct("!BB")
+BINARY_PING = 1
+BINARY_PONG = 2
+BINARY_TOKEN_SIZE = 8
+
+Address = Tuple[str, int]
+# a handler gets the datagram without its prefix and returns the reply, None for a malformed message; the sender
+# of a UDP datagram can be spoofed, so a malformed one is only counted and never answered, the server must not
+# reflect anything to a third party
+Handler = Callable[[bytes], Optional[bytes]]
+
+
+def pong(reply: str) -> Handler:
+    reply_bytes = bytes(reply, ENCODING)
+    return lambda message: reply_bytes if message else None
+
+
+def echo(message: bytes) -> Optional[bytes]:
+    return message if message else None
+
+
+def binary_pong(message: bytes) -> Optional[bytes]:
+    if len(message) != BINARY_TOKEN_SIZE:
+        return None
+    return BINARY_HEADER.pack(0, BINARY_PONG) + message
+
+
+# the prefixes are ASCII, which every client encoding (cp1250, utf8, Java's default) writes the same way, so
+# datagrams are routed by their bytes and never decoded; a handler is only cached when its reply depends on
+# nothing but the datagram
+HANDLERS: Dict[bytes, Tuple[Handler, bool]] = {
+    b"JAVA: ": (pong("Pong Java"), True),
+    b"PYTHON: ": (pong("Pong Python"), True),
+    b"ECHO: ": (echo, True),
+    # every binary ping carries its own token, caching them would only evict the text pings
+    BINARY_HEADER.pack(0, BINARY_PING): (binary_pong, False),
+}
+PREFIX_LENGTHS = sorted({len(prefix) for prefix in HANDLERS})
+
+stats: Dict[str, int] = dict.fromkeys(
+    ("received", "replied", "malformed", "errors", "resets", "cache_hits", "batches"), 0
+)
+
+
+# the replies of the last size distinct cacheable datagrams, least recently used ones go first; size 0 turns it off
+class ReplyCache:
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.replies: "OrderedDict[bytes, Optional[bytes]]" = OrderedDict()
+
+    def get(self, datagram: bytes) -> Tuple[bool, Optional[bytes]]:
+        if datagram not in self.replies:
+            return False, None
+        self.replies.move_to_end(datagram)
+        return True, self.replies[datagram]
+
+    def put(self, datagram: bytes, reply: Optional[bytes]) -> None:
+        if not self.size:
+            return
+        self.replies[datagram] = reply
+        if len(self.replies) > self.size:
+            self.replies.popitem(last=False)
+
+
+def dispatch(datagram: bytes) -> Tuple[Optional[Handler], bool, bytes]:
+    for length in PREFIX_LENGTHS:
+        if (entry := HANDLERS.get(datagram[:length])) is not None:
+            handler, cacheable = entry
+            return handler, cacheable, datagram[length:]
+    return None, False, b""
+
+
+def reply_to(datagram: bytes, cache: ReplyCache) -> Optional[bytes]:
+    hit, reply = cache.get(datagram)
+    if hit:
+        stats["cache_hits"] += 1
     else:
-        raise ValueError("Wrong message structure; should be: <JAVA>/<PYTHON>: <message>")
+        handler, cacheable, message = dispatch(datagram)
+        reply = handler(message) if handler is not None else None
+        if cacheable:
+            cache.put(datagram, reply)
+    if reply is None:
+        stats["malformed"] += 1
+    return reply
+
+
+
+def receive(serverSocket: socket.socket) -> Optional[Tuple[bytes, Address]]:
+    # Windows reports the ICMP port unreachable of an earlier reply as a reset of a later receive, it only means
+    # that one client has gone away
+    try:
+        return serverSocket.recvfrom(MAX_BUF_SIZE)
+    except ConnectionResetError:
+        stats["resets"] += 1
+        return None
+
+
+def receive_batch(serverSocket: socket.socket, batch_size: int) -> List[Tuple[bytes, Address]]:
+    # blocks for the first datagram only and then takes whatever else is already queued, one wakeup serves
+    # the whole batch
+    serverSocket.setblocking(True)
+    while (first := receive(serverSocket)) is None:
+        pass
+    batch = [first]
+    serverSocket.setblocking(False)
+    while len(batch) < batch_size:
+        try:
+            datagram = receive(serverSocket)
+        except BlockingIOError:
+            break
+        if datagram is not None:
+            batch.append(datagram)
+    return batch
+
+
+def serve_batch(serverSocket: socket.socket, batch: List[Tuple[bytes, Address]], cache: ReplyCache) -> None:
+    replies = []
+    for buff, address in batch:
+        # a broken packet or handler costs that packet's reply, never the server
+        try:
+            reply = reply_to(buff, cache)
+        except Exception as e:
+            stats["errors"] += 1
+            print(f"Error handling a datagram from {address}: {e!r}", file=sys.stderr)
+            continue
+        if reply is not None:
+            replies.append((reply, address))
+    # the socket is still non-blocking, a reply that does not fit in the send buffer is dropped like on the wire
+    for reply, address in replies:
+        try:
+            serverSocket.sendto(reply, address)
+        except OSError:
+            continue
+        stats["replied"] += 1
+
+
+def print_stats() -> None:
+    print(" ".join(f"{name}={value}" for name, value in stats.items()), flush=True)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="UDP ping/echo server")
+    parser.add_argument("--port", type=int, default=serverPort)
+    parser.add_argument("--batch-size", type=int, default=64, help="datagrams received and answered per wakeup")
+    parser.add_argument(
+        "--cache-size", type=int, default=1024, help="replies to identical requests kept, 0 turns the cache off"
+    )
+    parser.add_argument(
+        "--stats-interval", type=float, default=0.0, help="print the counters every this many seconds, 0 never"
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    serverSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    serverSocket.bind(('', args.port))
+    cache = ReplyCache(args.cache_size)
+
+    print('PYTHON UDP SERVER', flush=True)
+
+    last_stats = time.monotonic()
+    try:
+        while True:
+            batch = receive_batch(serverSocket, max(args.batch_size, 1))
+            stats["received"] += len(batch)
+            stats["batches"] += 1
+            serve_batch(serverSocket, batch, cache)
+            if args.stats_interval and time.monotonic() - last_stats >= args.stats_interval:
+                last_stats = time.monotonic()
+                print_stats()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print_stats()
+        serverSocket.close()
+
+
+if __name__ == '__main__':
+    main()
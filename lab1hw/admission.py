@@ -0,0 +1,106 @@
+import time
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+from constants import RATE_LIMIT_BURST, RATE_LIMIT_MAX_ADDRESSES
+from metrics import tcp_connections_rejected, messages_rate_limited
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, now: float) -> None:
+        self.rate = rate
+        self.burst = max(rate * RATE_LIMIT_BURST, 1.0)
+        self.tokens = self.burst
+        self.updated = now
+
+    def refill(self, now: float) -> bool:
+        # refilled lazily, by the time since the last check; tells whether a token can be taken
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= 1.0
+
+    def take(self, now: float) -> bool:
+        if not self.refill(now):
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+# token buckets per IP address, the least recently seen addresses are forgotten first; a forgotten address
+# starts again with a full bucket, which is all it would have had after a pause anyway
+class AddressBuckets:
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def get(self, address: str, now: float) -> TokenBucket:
+        if (bucket := self.buckets.get(address)) is None:
+            bucket = self.buckets[address] = TokenBucket(self.rate, now)
+            if len(self.buckets) > RATE_LIMIT_MAX_ADDRESSES:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(address)
+        return bucket
+
+    def take(self, address: str, now: float) -> bool:
+        return self.get(address, now).take(now)
+
+
+# overload protection of the TCP listener: connections over max_connections or over an address's connection
+# rate are closed right after accept, messages over the client's, the address's or the server's rate are dropped;
+# every check is a few dict and float operations, a rate of 0 turns its limit off
+class AdmissionControl:
+    def __init__(self, max_connections: int, connection_rate: float, client_rate: float, ip_rate: float,
+                 global_rate: float) -> None:
+        self.max_connections = max_connections
+        self.client_rate = client_rate
+        # the shared buckets are taken under one lock, the per-client ones only by their own reader
+        self.lock = Lock()
+        self.connections = 0
+        self.connection_buckets = AddressBuckets(connection_rate) if connection_rate else None
+        self.ip_buckets = AddressBuckets(ip_rate) if ip_rate else None
+        self.global_bucket = TokenBucket(global_rate, time.monotonic()) if global_rate else None
+
+    def admit(self, address: str) -> bool:
+        # a connection that is admitted has to be released when it closes
+        with self.lock:
+            if self.max_connections and self.connections >= self.max_connections:
+                reason = "capacity"
+            elif self.connection_buckets and not self.connection_buckets.take(address, time.monotonic()):
+                reason = "rate"
+            else:
+                self.connections += 1
+                return True
+        tcp_connections_rejected[reason].inc()
+        return False
+
+    def release(self) -> None:
+        with self.lock:
+            self.connections -= 1
+
+    def client_bucket(self) -> Optional[TokenBucket]:
+        return TokenBucket(self.client_rate, time.monotonic()) if self.client_rate else None
+
+    def allow_message(self, address: str, bucket: Optional[TokenBucket]) -> bool:
+        # every applicable bucket is checked before any is charged, a message dropped by one limit costs nothing
+        # from the others; /join commands count like chat messages, hopping rooms is throttled like flooding one
+        now = time.monotonic()
+        if not (self.ip_buckets or self.global_bucket):
+            if not bucket or bucket.take(now):
+                return True
+            scope = "client"
+        else:
+            with self.lock:
+                ip_bucket = self.ip_buckets.get(address, now) if self.ip_buckets else None
+                limits = [(scope, limit) for scope, limit in
+                          (("client", bucket), ("ip", ip_bucket), ("global", self.global_bucket)) if limit]
+                if (scope := next((scope for scope, limit in limits if not limit.refill(now)), None)) is None:
+                    for _, limit in limits:
+                        limit.take(now)
+                    return True
+        messages_rate_limited[scope].inc()
+        return False
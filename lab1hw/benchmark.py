@@ -0,0 +1,706 @@
+import os
+import sys
+import time
+import random
+import socket
+import struct
+import asyncio
+import argparse
+import selectors
+import subprocess
+import zlib
+import tracemalloc
+import multiprocessing
+
+from statistics import median
+from threading import Thread, Event, active_count
+from typing import Callable, List, Optional, Tuple
+
+import server
+from constants import (
+    IP, PORT, MESSAGE, ENCODING, INIT_MSG, SERVING_MODE_THREADS, SERVING_MODE_EVENT_LOOP, FRAME_CHAT,
+    FRAME_LEAVE, JOIN_COMMAND, DEFAULT_ROOM, OVERFLOW_DROP_OLDEST, MAX_BUF_SIZE, ASCII_ART, COMPRESSION_LEVEL,
+    FRAME_COMPRESSED
+)
+from chat_client import ChatClient
+from chunking import ChunkChannel
+from compression import WBITS, decode_compressed_frame, encode_compressed_frame
+from logs import log
+from outbound import OutboundQueue
+from framing import FrameDecoder, encode_frame, encode_frames, encode_init_frame
+from loadgen import add_load_arguments, print_report_header, raise_open_files_limit, run_load
+from multicast import ReliableMulticast, multicast_stats
+from udp_batch import UdpFanOut
+
+BENCHMARK_MULTICAST_ADDRESS = "224.1.1.1"
+BENCHMARK_MULTICAST_PORT = 5007
+
+UDP_RELAY_SOCKET_PER_PEER = "socket-per-peer"
+UDP_RELAY_SENDTO = "sendto"
+UDP_RELAY_SENDMMSG = "sendmmsg"
+UDP_RELAY_METHODS = (UDP_RELAY_SOCKET_PER_PEER, UDP_RELAY_SENDTO, UDP_RELAY_SENDMMSG)
+
+TCP_RELAY_DECODE = "decode"
+TCP_RELAY_RAW = "raw"
+TCP_RELAY_METHODS = (TCP_RELAY_DECODE, TCP_RELAY_RAW)
+
+MULTICAST_PLAIN = "plain"
+MULTICAST_RELIABLE = "reliable"
+MULTICAST_MODES = (MULTICAST_PLAIN, MULTICAST_RELIABLE)
+
+COMPRESSION_PLAIN = "plain"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_DICTIONARY = "zlib-dict"
+COMPRESSION_BATCH = "zlib-dict-batch"
+COMPRESSION_METHODS = (COMPRESSION_PLAIN, COMPRESSION_ZLIB, COMPRESSION_DICTIONARY, COMPRESSION_BATCH)
+# words of everyday chat, not taken from the preset dictionary so that it is not measured against itself
+CHAT_WORDS = (
+    "so", "we", "meet", "at", "five", "tomorrow", "sounds", "good", "anyone", "seen", "my", "keys", "lunch",
+    "today", "the", "lab", "is", "open", "again", "did", "you", "finish", "homework", "yes", "no", "maybe",
+    "great", "idea", "later", "thanks", "server", "works", "now", "ok", "cool", "see", "you", "lol"
+)
+
+
+def start_server(max_num_of_clients: int, *server_args: str) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "server.py", str(max_num_of_clients), BENCHMARK_MULTICAST_ADDRESS,
+         str(BENCHMARK_MULTICAST_PORT), *server_args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL
+    )
+    # wait until the server accepts connections
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((IP, PORT), timeout=0.1):
+                return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("Server did not start.")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    # SIGTERM lets a --workers parent stop its worker processes
+    server.terminate()
+    try:
+        server.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def server_threads(server: subprocess.Popen) -> Optional[int]:
+    try:
+        with open(f"/proc/{server.pid}/status") as status:
+            for line in status:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def wait_for_fan_out(selector: selectors.BaseSelector, received: List[int], receivers: List[int],
+                     expected: int, timeout: float) -> float:
+    # returns the moment the last receiver got all the expected bytes
+    deadline = time.monotonic() + timeout
+    pending = {i for i in receivers if received[i] < expected}
+    last_arrival = time.monotonic()
+    while pending and (remaining := deadline - time.monotonic()) > 0:
+        for key, _ in selector.select(remaining):
+            i = key.data
+            try:
+                chunk = key.fileobj.recv(1 << 16)
+            except BlockingIOError:
+                continue
+            received[i] += len(chunk)
+            if i in pending and received[i] >= expected:
+                pending.discard(i)
+                last_arrival = time.monotonic()
+    return last_arrival
+
+
+def fan_out(mode: str, num_of_clients: int, max_num_of_clients: int, rounds: int, message_size: int,
+            settle: float, timeout: float) -> None:
+    server = start_server(max_num_of_clients, "--mode", mode)
+    selector = selectors.DefaultSelector()
+    clients: List[socket.socket] = []
+    try:
+        for i in range(num_of_clients):
+            client = socket.create_connection((IP, PORT))
+            client.sendall(bytes(INIT_MSG, ENCODING))
+            client.setblocking(False)
+            if i:
+                selector.register(client, selectors.EVENT_READ, i)
+            clients.append(client)
+        # let the server register every INIT before the first chat message arrives
+        time.sleep(settle)
+
+        sender = clients[0]
+        sender.setblocking(True)
+        message = bytes(f"bench:{'x' * (message_size - len('bench:'))}", ENCODING)
+        received = [0] * num_of_clients
+        receivers = list(range(1, num_of_clients))
+        latencies: List[float] = []
+        for r in range(1, rounds + 1):
+            start = time.monotonic()
+            sender.sendall(message)
+            end = wait_for_fan_out(selector, received, receivers, r * message_size, timeout)
+            if r == 1:
+                # clients that missed the first broadcast were never served
+                receivers = [i for i in receivers if received[i] >= message_size]
+            latencies.append(end - start)
+
+        served = len(receivers) + 1
+        print(
+            f"{mode:>10} {num_of_clients:>8} {served:>8} {server_threads(server) or '-':>8} "
+            f"{median(latencies) * 1000:>12.2f} {max(latencies) * 1000:>12.2f}"
+        )
+    finally:
+        for client in clients:
+            client.close()
+        selector.close()
+        stop_server(server)
+
+
+def run_fan_out(args: argparse.Namespace) -> None:
+    print(f"{'mode':>10} {'clients':>8} {'served':>8} {'threads':>8} {'p50 ms':>12} {'max ms':>12}")
+    for num_of_clients in args.clients:
+        for mode in args.modes:
+            fan_out(
+                mode, num_of_clients, args.max_num_of_clients or num_of_clients, args.rounds,
+                args.message_size, args.settle, args.timeout
+            )
+
+
+def relay_socket_per_peer(server_socket: socket.socket, peers: List[Tuple[str, int]], data: bytes) -> None:
+    # how receive_udp_messages used to relay: a fresh socket for every recipient of every datagram
+    for peer in peers:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client_socket:
+            client_socket.sendto(data, peer)
+
+
+def udp_relay(method: str, num_of_clients: int, message_size: int, duration: float) -> None:
+    receivers = []
+    for _ in range(num_of_clients):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receivers.append(receiver)
+    peers = [receiver.getsockname() for receiver in receivers]
+    fan_out = UdpFanOut(use_sendmmsg=method == UDP_RELAY_SENDMMSG, min_peers=0)
+    for peer in peers:
+        fan_out.add(peer)
+    data = bytes("x" * message_size, ENCODING)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server_socket:
+        server_socket.bind(("127.0.0.1", 0))
+        relays = 0
+        start = time.perf_counter()
+        while (elapsed := time.perf_counter() - start) < duration:
+            if method == UDP_RELAY_SOCKET_PER_PEER:
+                relay_socket_per_peer(server_socket, peers, data)
+            else:
+                fan_out.send(server_socket, data)
+            relays += 1
+    for receiver in receivers:
+        receiver.close()
+    print(
+        f"{method:>16} {num_of_clients:>8} {relays / elapsed:>14.0f} {relays * num_of_clients / elapsed:>16.0f}"
+    )
+
+
+def run_udp_relay(args: argparse.Namespace) -> None:
+    print(f"{'method':>16} {'clients':>8} {'relays/s':>14} {'datagrams/s':>16}")
+    for num_of_clients in args.clients:
+        for method in args.methods:
+            udp_relay(method, num_of_clients, args.message_size, args.duration)
+
+
+def connect_framed() -> socket.socket:
+    client = socket.create_connection((IP, PORT))
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    client.sendall(encode_init_frame())
+    # the INIT acknowledgement means the server has registered the client
+    ack = encode_init_frame()
+    received = b""
+    while len(received) < len(ack):
+        if not (chunk := client.recv(len(ack) - len(received))):
+            raise ConnectionError("Server closed the connection.")
+        received += chunk
+    return client
+
+
+def receive_frames(client: socket.socket, decoder: FrameDecoder, count: int) -> None:
+    received = 0
+    while received < count:
+        if not (chunk := client.recv(1 << 16)):
+            raise ConnectionError("Server closed the connection.")
+        received += sum(frame_type == FRAME_CHAT for frame_type, _ in decoder.feed(chunk))
+
+
+def workers_load(room: str, clients_per_room: int, message_size: int, duration: float, settle: float,
+                 results: multiprocessing.Queue) -> None:
+    # one load process per room: first opens and closes connections as fast as it can,
+    # then one client sends to the others of the room and waits for every copy before the next message
+    connections = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < duration:
+        with connect_framed() as client:
+            client.sendall(encode_frame(FRAME_LEAVE))
+        connections += 1
+    connections_per_second = connections / elapsed
+
+    clients = [connect_framed() for _ in range(clients_per_room)]
+    try:
+        for client in clients:
+            client.sendall(encode_frame(FRAME_CHAT, bytes(f"bench:{JOIN_COMMAND}{room}", ENCODING)))
+        time.sleep(settle)
+
+        sender, receivers = clients[0], clients[1:]
+        decoders = [FrameDecoder() for _ in receivers]
+        message = encode_frame(FRAME_CHAT, bytes(f"bench:{'x' * (message_size - len('bench:'))}", ENCODING))
+        burst = 16
+        delivered = 0
+        start = time.perf_counter()
+        while (elapsed := time.perf_counter() - start) < duration:
+            sender.sendall(message * burst)
+            for receiver, decoder in zip(receivers, decoders):
+                receive_frames(receiver, decoder, burst)
+            delivered += burst * len(receivers)
+        results.put((connections_per_second, delivered / elapsed))
+    finally:
+        for client in clients:
+            client.close()
+
+
+def workers(num_of_workers: int, mode: str, rooms: int, clients_per_room: int, message_size: int,
+            duration: float, settle: float) -> None:
+    server_args = ["--mode", mode]
+    if num_of_workers > 1:
+        server_args += ["--workers", str(num_of_workers)]
+    server = start_server(rooms * (clients_per_room + 1), *server_args)
+    # every worker has to be listening before the load starts, otherwise the first one takes all connections
+    time.sleep(settle)
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    load = [
+        multiprocessing.Process(
+            target=workers_load, args=(f"bench-{i}", clients_per_room, message_size, duration, settle, results)
+        )
+        for i in range(rooms)
+    ]
+    try:
+        for process in load:
+            process.start()
+        totals = [results.get(timeout=2 * duration + settle + 10) for _ in load]
+        for process in load:
+            process.join()
+    finally:
+        for process in load:
+            if process.is_alive():
+                process.kill()
+        stop_server(server)
+    print(
+        f"{num_of_workers:>8} {mode:>10} {sum(c for c, _ in totals):>14.0f} {sum(m for _, m in totals):>14.0f}"
+    )
+
+
+def run_workers(args: argparse.Namespace) -> None:
+    print(f"{os.cpu_count()} CPUs, {args.rooms} rooms of {args.clients_per_room} clients")
+    print(f"{'workers':>8} {'mode':>10} {'connections/s':>14} {'messages/s':>14}")
+    for num_of_workers in args.workers:
+        for mode in args.modes:
+            workers(
+                num_of_workers, mode, args.rooms, args.clients_per_room, args.message_size, args.duration,
+                args.settle
+            )
+
+
+def run_load_modes(args: argparse.Namespace) -> None:
+    # the same fixed-rate load against a fresh server in every mode, so runs can be compared
+    args.multicast_address, args.multicast_port = BENCHMARK_MULTICAST_ADDRESS, BENCHMARK_MULTICAST_PORT
+    print_report_header()
+    for mode in args.modes:
+        for log_sample in args.log_samples:
+            server = start_server(args.tcp_clients + 1, "--mode", mode, "--log-sample", str(log_sample))
+            try:
+                run_load(args, label=f"{mode} {log_sample}" if len(args.log_samples) > 1 else mode)
+            finally:
+                stop_server(server)
+
+
+def relay_decoded(sender: server.TcpClient, message: bytes) -> None:
+    # how relay_tcp_message used to build the relayed message: decode, split, format and encode again
+    nick, _, payload = message.decode(ENCODING).partition(":")
+    with server.tcp_clients_lock:
+        room = server.tcp_clients.room_of(sender) or DEFAULT_ROOM
+        recipients = [c for c in server.tcp_clients.members(room) if c is not sender]
+    data = bytes(MESSAGE.format(nick=nick, message=payload), ENCODING)
+    server.deliver_tcp_message(recipients, data)
+
+
+def tcp_relay_allocations(method: str, num_of_recipients: int, message_size: int, messages: int) -> None:
+    relay: Callable[[server.TcpClient, bytes], None] = (
+        relay_decoded if method == TCP_RELAY_DECODE else server.relay_tcp_message
+    )
+    # the relay never touches the recipients' sockets, only their outbound queues
+    with socket.socket() as dummy:
+        clients = [
+            server.TcpClient(dummy, OutboundQueue(messages + 1, OVERFLOW_DROP_OLDEST), framed=bool(i % 2))
+            for i in range(num_of_recipients + 1)
+        ]
+        for client in clients:
+            server.tcp_clients.join(client, DEFAULT_ROOM)
+        sender = clients[0]
+        message = bytes(f"bench:{'x' * (message_size - len('bench:'))}", ENCODING)
+
+        allocated = 0
+        start = time.perf_counter()
+        tracemalloc.start()
+        for _ in range(messages):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            relay(sender, message)
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        elapsed = time.perf_counter() - start
+        for client in clients:
+            server.tcp_clients.leave(client)
+
+    print(
+        f"{method:>8} {num_of_recipients:>10} {allocated / messages:>16.0f} {elapsed / messages * 1e6:>12.2f}"
+    )
+
+
+def run_tcp_relay_allocations(args: argparse.Namespace) -> None:
+    # per-message lines would allocate the most of all
+    log.sample = 0
+    print(f"{'method':>8} {'recipients':>10} {'peak bytes/msg':>16} {'us/msg':>12}")
+    for num_of_recipients in args.recipients:
+        for method in args.methods:
+            tcp_relay_allocations(method, num_of_recipients, args.message_size, args.messages)
+
+
+def join_benchmark_group(reliable: bool, deliver: Callable) -> Tuple[socket.socket, ReliableMulticast]:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((BENCHMARK_MULTICAST_ADDRESS, BENCHMARK_MULTICAST_PORT))
+    mreq = struct.pack("4sl", socket.inet_aton(BENCHMARK_MULTICAST_ADDRESS), socket.INADDR_ANY)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    sock.settimeout(0.1)
+    multicast = ReliableMulticast(
+        ChunkChannel(sock, False), (BENCHMARK_MULTICAST_ADDRESS, BENCHMARK_MULTICAST_PORT), reliable, deliver
+    )
+    multicast.start()
+    return sock, multicast
+
+
+def receive_lossy(sock: socket.socket, multicast: ReliableMulticast, loss: float, stop: Event) -> None:
+    # every datagram, retransmissions included, is lost with the given probability before the receiver sees it
+    while not stop.is_set():
+        try:
+            data, address = sock.recvfrom(MAX_BUF_SIZE)
+        except socket.timeout:
+            continue
+        except OSError:
+            return
+        if random.random() >= loss:
+            multicast.receive(data, address)
+
+
+def multicast_repair(mode: str, num_of_receivers: int, messages: int, rate: float, loss: float,
+                     message_size: int, drain: float) -> None:
+    reliable = mode == MULTICAST_RELIABLE
+    delivered: List[List[int]] = [[] for _ in range(num_of_receivers)]
+    stop = Event()
+    before = multicast_stats()
+    members = [
+        join_benchmark_group(reliable, lambda message, received=received: received.append(
+            int(bytes(message).split(b":", 2)[1])
+        ))
+        for received in delivered
+    ]
+    threads = [Thread(target=receive_lossy, args=(sock, multicast, loss, stop), daemon=True)
+               for sock, multicast in members]
+    # the sender hears the NACKs without loss, it never delivers its own messages
+    sender_socket, sender = join_benchmark_group(reliable, lambda message: None)
+    threads.append(Thread(target=receive_lossy, args=(sender_socket, sender, 0.0, stop), daemon=True))
+    try:
+        for thread in threads:
+            thread.start()
+        start = time.monotonic()
+        for i in range(messages):
+            message = bytes(f"bench:{i}:", ENCODING)
+            sender.send(message + b"x" * max(message_size - len(message), 0))
+            if (delay := start + (i + 1) / rate - time.monotonic()) > 0:
+                time.sleep(delay)
+        time.sleep(drain)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for sock, _ in members + [(sender_socket, sender)]:
+            sock.close()
+
+    stats = {event: count - before[event] for event, count in multicast_stats().items()}
+    received = sum(map(len, delivered))
+    in_order = sum(received == sorted(received) for received in delivered)
+    overhead = stats["nack_sent"] + stats["retransmitted"] + stats["session_sent"]
+    print(
+        f"{mode:>9} {loss * 100:>6.1f} {received / (messages * num_of_receivers) * 100:>11.2f} "
+        f"{in_order:>4}/{num_of_receivers:<4} {stats['duplicate']:>10} {stats['lost']:>6} {stats['nack_sent']:>6} "
+        f"{stats['retransmitted']:>8} {overhead / messages * 100:>10.2f}"
+    )
+
+
+def run_multicast_repair(args: argparse.Namespace) -> None:
+    print(
+        f"{'mode':>9} {'loss %':>6} {'delivered %':>11} {'in order':>9} {'duplicates':>10} {'lost':>6} "
+        f"{'nacks':>6} {'repairs':>8} {'overhead %':>10}"
+    )
+    for loss in args.loss:
+        for mode in args.modes:
+            multicast_repair(
+                mode, args.receivers, args.messages, args.rate, loss / 100, args.message_size, args.drain
+            )
+
+
+def resident_memory() -> int:
+    # bytes, only where /proc tells
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+async def first_message(client: ChatClient) -> None:
+    async for _ in client:
+        return
+
+
+async def async_clients(num_of_clients: int, room_size: int, connect_batch: int, settle: float,
+                        timeout: float) -> None:
+    memory = resident_memory()
+    start = time.monotonic()
+    clients: List[ChatClient] = []
+    try:
+        # connecting in batches keeps the server's accept queue from overflowing
+        for first in range(0, num_of_clients, connect_batch):
+            batch = [ChatClient(f"bench-{i}") for i in range(first, min(first + connect_batch, num_of_clients))]
+            clients += batch
+            await asyncio.gather(*(client.connect() for client in batch))
+        for i, client in enumerate(clients):
+            await client.join(f"bench-{i // room_size}")
+        connect_time = time.monotonic() - start
+        await asyncio.sleep(settle)
+        memory = resident_memory() - memory
+
+        # the first client of every room sends one message, all the others wait for it
+        receivers = [asyncio.create_task(first_message(client)) for i, client in enumerate(clients) if i % room_size]
+        start = time.monotonic()
+        for client in clients[::room_size]:
+            await client.send("hello")
+        done, pending = await asyncio.wait(receivers, timeout=timeout)
+        delivery_time = time.monotonic() - start
+        for task in pending:
+            task.cancel()
+        print(
+            f"{num_of_clients:>8} {active_count():>8} {connect_time:>10.2f} {memory / num_of_clients / 1024:>12.1f} "
+            f"{len(done):>9}/{len(receivers):<9} {delivery_time * 1000:>12.1f}"
+        )
+    finally:
+        for client in clients:
+            await client.close()
+
+
+def run_async_clients(args: argparse.Namespace) -> None:
+    print(
+        f"{'clients':>8} {'threads':>8} {'connect s':>10} {'KiB/client':>12} {'delivered':>19} {'delivery ms':>12}"
+    )
+    # every client has a TCP and a UDP socket
+    raise_open_files_limit(2 * max(args.clients) + 64)
+    for num_of_clients in args.clients:
+        server = start_server(num_of_clients, "--mode", SERVING_MODE_EVENT_LOOP, "--log-sample", "0")
+        try:
+            asyncio.run(async_clients(num_of_clients, args.room_size, args.connect_batch, args.settle, args.timeout))
+        finally:
+            stop_server(server)
+
+
+def chat_corpus(messages: int, art_share: float) -> List[bytes]:
+    rng = random.Random(0)
+    corpus = []
+    for _ in range(messages):
+        nick = f"user{rng.randrange(50)}"
+        text = ASCII_ART if rng.random() < art_share else " ".join(rng.choices(CHAT_WORDS, k=rng.randint(2, 14)))
+        corpus.append(bytes(f"{nick}:{text}", ENCODING))
+    return corpus
+
+
+def compress_without_dictionary(frames: bytes) -> bytes:
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, WBITS)
+    return encode_frame(0, compressor.compress(frames) + compressor.flush())
+
+
+def compression(method: str, corpus: List[bytes], batch_size: int) -> None:
+    frames = [encode_frame(FRAME_CHAT, message) for message in corpus]
+    if method == COMPRESSION_BATCH:
+        frames = [encode_frames((FRAME_CHAT, m) for m in corpus[i:i + batch_size])
+                  for i in range(0, len(corpus), batch_size)]
+
+    start = time.process_time()
+    if method == COMPRESSION_PLAIN:
+        wire = frames
+    elif method == COMPRESSION_ZLIB:
+        wire = [compress_without_dictionary(frame) for frame in frames]
+    else:
+        wire = [encode_compressed_frame(frame) for frame in frames]
+    compress_time = time.process_time() - start
+
+    # what the receivers do, decoding plain frames costs the same in every method
+    decoder = FrameDecoder()
+    start = time.process_time()
+    for data in wire:
+        for frame_type, payload in decoder.feed(data):
+            if frame_type == FRAME_COMPRESSED:
+                decode_compressed_frame(payload)
+            elif method == COMPRESSION_ZLIB:
+                zlib.decompressobj(WBITS).decompress(payload)
+    decompress_time = time.process_time() - start
+
+    plain_bytes = sum(map(len, frames))
+    wire_bytes = sum(map(len, wire))
+    print(
+        f"{method:>16} {wire_bytes / len(corpus):>10.1f} {wire_bytes / plain_bytes * 100:>8.1f} "
+        f"{compress_time / len(corpus) * 1e6:>14.2f} {decompress_time / len(corpus) * 1e6:>16.2f}"
+    )
+
+
+def run_compression(args: argparse.Namespace) -> None:
+    corpus = chat_corpus(args.messages, args.art_share)
+    print(f"{'method':>16} {'bytes/msg':>10} {'% plain':>8} {'compress us/msg':>14} {'decompress us/msg':>16}")
+    for method in args.methods:
+        compression(method, corpus, args.batch_size)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for the lab1hw chat server.")
+    subparsers = parser.add_subparsers(required=True)
+
+    fan_out_parser = subparsers.add_parser(
+        "fan-out", help="connection count and TCP fan-out latency of the serving modes"
+    )
+    fan_out_parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 1000])
+    fan_out_parser.add_argument(
+        "--modes", nargs="+", choices=(SERVING_MODE_THREADS, SERVING_MODE_EVENT_LOOP),
+        default=[SERVING_MODE_THREADS, SERVING_MODE_EVENT_LOOP]
+    )
+    fan_out_parser.add_argument(
+        "--max-num-of-clients", type=int,
+        help="server's max_num_of_clients, defaults to the number of connected clients"
+    )
+    fan_out_parser.add_argument("--rounds", type=int, default=20)
+    fan_out_parser.add_argument("--message-size", type=int, default=64)
+    fan_out_parser.add_argument("--settle", type=float, default=1.0)
+    fan_out_parser.add_argument("--timeout", type=float, default=2.0)
+    fan_out_parser.set_defaults(run=run_fan_out)
+
+    udp_relay_parser = subparsers.add_parser(
+        "udp-relay", help="datagrams relayed per second against the number of registered UDP clients"
+    )
+    udp_relay_parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100, 1000])
+    udp_relay_parser.add_argument(
+        "--methods", nargs="+", choices=UDP_RELAY_METHODS, default=list(UDP_RELAY_METHODS)
+    )
+    udp_relay_parser.add_argument("--message-size", type=int, default=128)
+    udp_relay_parser.add_argument("--duration", type=float, default=1.0)
+    udp_relay_parser.set_defaults(run=run_udp_relay)
+
+    workers_parser = subparsers.add_parser(
+        "workers", help="TCP connections and messages per second against the number of server worker processes"
+    )
+    workers_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    workers_parser.add_argument(
+        "--modes", nargs="+", choices=(SERVING_MODE_THREADS, SERVING_MODE_EVENT_LOOP),
+        default=[SERVING_MODE_EVENT_LOOP]
+    )
+    workers_parser.add_argument("--rooms", type=int, default=4, help="load processes, one room each")
+    workers_parser.add_argument("--clients-per-room", type=int, default=8)
+    workers_parser.add_argument("--message-size", type=int, default=64)
+    workers_parser.add_argument("--duration", type=float, default=2.0)
+    workers_parser.add_argument("--settle", type=float, default=0.5)
+    workers_parser.set_defaults(run=run_workers)
+
+    load_parser = subparsers.add_parser(
+        "load", help="delivery latency percentiles, throughput and loss per transport under a fixed-rate load"
+    )
+    load_parser.add_argument(
+        "--modes", nargs="+", choices=(SERVING_MODE_THREADS, SERVING_MODE_EVENT_LOOP),
+        default=[SERVING_MODE_THREADS, SERVING_MODE_EVENT_LOOP]
+    )
+    load_parser.add_argument(
+        "--log-samples", type=int, nargs="+", default=[1],
+        help="server --log-sample values to compare, 0 turns per-message logging off"
+    )
+    add_load_arguments(load_parser)
+    load_parser.set_defaults(run=run_load_modes)
+
+    tcp_relay_parser = subparsers.add_parser(
+        "tcp-relay", help="memory allocated per relayed TCP message, decoding it or relaying the raw bytes"
+    )
+    tcp_relay_parser.add_argument("--recipients", type=int, nargs="+", default=[1, 10, 100, 1000])
+    tcp_relay_parser.add_argument(
+        "--methods", nargs="+", choices=TCP_RELAY_METHODS, default=list(TCP_RELAY_METHODS)
+    )
+    tcp_relay_parser.add_argument("--message-size", type=int, default=1000)
+    tcp_relay_parser.add_argument("--messages", type=int, default=1000)
+    tcp_relay_parser.set_defaults(run=run_tcp_relay_allocations)
+
+    multicast_parser = subparsers.add_parser(
+        "multicast", help="delivered rate and repair overhead of reliable multicast on a lossy loopback group"
+    )
+    multicast_parser.add_argument("--modes", nargs="+", choices=MULTICAST_MODES, default=list(MULTICAST_MODES))
+    multicast_parser.add_argument(
+        "--loss", type=float, nargs="+", default=[0.0, 1.0, 5.0, 20.0],
+        help="percentage of datagrams every receiver drops"
+    )
+    multicast_parser.add_argument("--receivers", type=int, default=4)
+    multicast_parser.add_argument("--messages", type=int, default=2000)
+    multicast_parser.add_argument("--rate", type=float, default=2000.0, help="messages per second")
+    multicast_parser.add_argument("--message-size", type=int, default=128)
+    multicast_parser.add_argument("--drain", type=float, default=1.5)
+    multicast_parser.set_defaults(run=run_multicast_repair)
+
+    async_clients_parser = subparsers.add_parser(
+        "async-clients", help="memory and threads of many asyncio chat clients hosted by a single process"
+    )
+    async_clients_parser.add_argument("--clients", type=int, nargs="+", default=[100, 1000, 5000])
+    async_clients_parser.add_argument("--room-size", type=int, default=10)
+    async_clients_parser.add_argument("--connect-batch", type=int, default=100)
+    async_clients_parser.add_argument("--settle", type=float, default=1.0)
+    async_clients_parser.add_argument("--timeout", type=float, default=10.0)
+    async_clients_parser.set_defaults(run=run_async_clients)
+
+    compression_parser = subparsers.add_parser(
+        "compression", help="bytes on the wire and CPU per TCP chat message with and without compression"
+    )
+    compression_parser.add_argument(
+        "--methods", nargs="+", choices=COMPRESSION_METHODS, default=list(COMPRESSION_METHODS)
+    )
+    compression_parser.add_argument("--messages", type=int, default=20000)
+    compression_parser.add_argument(
+        "--art-share", type=float, default=0.2, help="share of the messages that are the ASCII art"
+    )
+    compression_parser.add_argument(
+        "--batch-size", type=int, default=16, help="frames compressed together, like a history replay"
+    )
+    compression_parser.set_defaults(run=run_compression)
+
+    args = parser.parse_args()
+    args.run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
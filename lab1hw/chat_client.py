@@ -0,0 +1,297 @@
+import socket
+import struct
+import asyncio
+
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Tuple
+
+from constants import (
+    IP, PORT, MESSAGE, ENCODING, INIT_MSG, NEGOTIATION_TIMEOUT, FRAME_INIT, FRAME_CHAT, FRAME_LEAVE,
+    FRAME_HEARTBEAT, HEARTBEAT_INTERVAL, JOIN_COMMAND, CLIENT_INBOX_SIZE, FRAME_COMPRESSED, INIT_FLAG_COMPRESSION
+)
+from compression import decode_compressed_frame, encode_compressed_frame
+from chunking import EXPIRY_INTERVAL, HEARTBEAT_DATAGRAM, Buffer, ChunkChannel
+from framing import Frame, FrameDecoder, encode_frame, encode_init_frame, init_flags
+from multicast import TICK_INTERVAL, ReliableMulticast
+from udp_batch import Address
+
+TRANSPORT_TCP = "tcp"
+TRANSPORT_UDP = "udp"
+TRANSPORT_MULTICAST = "multicast"
+
+
+class NegotiationError(ConnectionError):
+    pass
+
+
+@dataclass(frozen=True)
+class ChatMessage:
+    transport: str
+    data: bytes
+
+    @property
+    def nick(self) -> str:
+        return str(self.data.partition(b":")[0], ENCODING, "replace")
+
+    @property
+    def text(self) -> str:
+        return str(self.data.partition(b":")[2], ENCODING, "replace")
+
+
+class TcpProtocol(asyncio.Protocol):
+    def __init__(self, client: "ChatClient") -> None:
+        self.client = client
+        self.decoder = FrameDecoder()
+        # set while the transport's write buffer is above its high-water mark
+        self.writable: Optional[asyncio.Future] = None
+
+    def data_received(self, data: bytes) -> None:
+        if not self.client.framed:
+            # the text protocol has no boundaries, every read is taken for one message like before
+            self.client.received(TRANSPORT_TCP, data)
+            return
+        try:
+            self.handle_frames(self.decoder.feed(data))
+        except ValueError:
+            self.client.tcp.close()
+
+    def handle_frames(self, frames: List[Frame]) -> None:
+        for frame_type, payload in frames:
+            if frame_type == FRAME_INIT:
+                if not self.client.acknowledged.done():
+                    self.client.acknowledged.set_result(init_flags(payload))
+            elif frame_type == FRAME_CHAT:
+                self.client.received(TRANSPORT_TCP, payload)
+            elif frame_type == FRAME_COMPRESSED:
+                self.handle_frames(decode_compressed_frame(payload))
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        # a server over capacity closes the connection before it acknowledges anything
+        if self.client.framed and self.client.acknowledged and not self.client.acknowledged.done():
+            self.client.acknowledged.set_exception(ConnectionRefusedError("Server closed the connection."))
+        self.client.closed()
+
+    def pause_writing(self) -> None:
+        self.writable = asyncio.get_running_loop().create_future()
+
+    def resume_writing(self) -> None:
+        if self.writable and not self.writable.done():
+            self.writable.set_result(None)
+        self.writable = None
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client: "ChatClient", transport_name: str) -> None:
+        self.client = client
+        self.transport_name = transport_name
+
+    def datagram_received(self, data: bytes, address: Address) -> None:
+        self.client.datagram_received(self.transport_name, data, address)
+
+    def error_received(self, exc: Exception) -> None:
+        # an ICMP error for an earlier datagram, UDP has nothing to recover
+        pass
+
+
+def create_multicast_socket(multicast_address: str, multicast_port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((multicast_address, multicast_port))
+    mreq = struct.pack("4sl", socket.inet_aton(multicast_address), socket.INADDR_ANY)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    sock.setblocking(False)
+    return sock
+
+
+# a chat client on an asyncio event loop: the TCP connection, the UDP socket and the multicast group are served
+# by protocol callbacks and a few timers instead of a thread each, so thousands of clients fit in one process;
+# received messages of every transport come out of recv() in arrival order, without multicast_address the client
+# does not join the group at all; with tcp or udp off the client does without that transport, e.g. a load
+# generator's UDP-only or multicast-only clients
+class ChatClient:
+    def __init__(self, nick: str, multicast_address: Optional[str] = None, multicast_port: int = 0,
+                 framed: bool = True, udp_retransmit: bool = False, reliable_multicast: bool = False,
+                 compression: bool = False, inbox_size: int = CLIENT_INBOX_SIZE, tcp: bool = True,
+                 udp: bool = True) -> None:
+        self.nick = nick
+        self.multicast_group: Optional[Address] = (multicast_address, multicast_port) if multicast_address else None
+        self.with_tcp = tcp
+        self.with_udp = udp
+        self.framed = framed
+        self.udp_retransmit = udp_retransmit
+        self.reliable_multicast = reliable_multicast
+        # asked for in the INIT frame, on once the server acknowledges it
+        self.compression = compression
+        self.compressed = False
+        # a client nobody reads from drops the newest messages instead of growing without bound
+        self.inbox: "asyncio.Queue[Optional[ChatMessage]]" = asyncio.Queue(inbox_size)
+        self.dropped = 0
+        self.tcp: Optional[asyncio.Transport] = None
+        self.tcp_protocol: Optional[TcpProtocol] = None
+        self.udp_socket: Optional[socket.socket] = None
+        self.udp_transport: Optional[asyncio.DatagramTransport] = None
+        self.udp_chunks: Optional[ChunkChannel] = None
+        self.udp_expiry: Optional[asyncio.TimerHandle] = None
+        self.multicast_transport: Optional[asyncio.DatagramTransport] = None
+        self.multicast: Optional[ReliableMulticast] = None
+        self.timers: Tuple[asyncio.Task, ...] = ()
+        self.acknowledged: Optional[asyncio.Future] = None
+        self.is_closed = False
+
+    async def connect(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.with_tcp:
+            await self.connect_tcp()
+
+        if self.with_udp:
+            # the chunk channels send with the sockets themselves, the transports only read
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind(("", 0))
+            self.udp_socket.setblocking(False)
+            self.udp_chunks = ChunkChannel(self.udp_socket, self.udp_retransmit)
+            self.udp_transport, _ = await loop.create_datagram_endpoint(
+                lambda: DatagramProtocol(self, TRANSPORT_UDP), sock=self.udp_socket
+            )
+            self.udp_socket.sendto(bytes(INIT_MSG, ENCODING), (IP, PORT))
+
+        timers = [loop.create_task(self.send_heartbeats())]
+        if self.multicast_group:
+            multicast_socket = create_multicast_socket(*self.multicast_group)
+            self.multicast = ReliableMulticast(
+                ChunkChannel(multicast_socket, self.udp_retransmit, self.multicast_group), self.multicast_group,
+                self.reliable_multicast, self.multicast_delivered
+            )
+            self.multicast_transport, _ = await loop.create_datagram_endpoint(
+                lambda: DatagramProtocol(self, TRANSPORT_MULTICAST), sock=multicast_socket
+            )
+            timers.append(loop.create_task(self.tick_multicast()))
+        self.timers = tuple(timers)
+
+    async def connect_tcp(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.acknowledged = loop.create_future()
+        # a refusal that nobody waits for any more, after a timeout or a cancelled connect, is not logged as lost
+        self.acknowledged.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self.tcp, self.tcp_protocol = await loop.create_connection(lambda: TcpProtocol(self), IP, PORT)
+        if not self.framed:
+            self.tcp.write(bytes(INIT_MSG, ENCODING))
+            return
+        self.tcp.write(encode_init_frame(INIT_FLAG_COMPRESSION if self.compression else 0))
+        # the server answers the INIT frame with its own one when it supports framing
+        try:
+            flags = await asyncio.wait_for(asyncio.shield(self.acknowledged), NEGOTIATION_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.tcp.close()
+            raise NegotiationError("Server did not accept the framed protocol.") from None
+        self.compressed = bool(flags & INIT_FLAG_COMPRESSION)
+
+    def received(self, transport_name: str, data: Buffer) -> None:
+        try:
+            self.inbox.put_nowait(ChatMessage(transport_name, bytes(data)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def datagram_received(self, transport_name: str, data: bytes, address: Address) -> None:
+        if transport_name == TRANSPORT_MULTICAST:
+            self.multicast.receive(data, address)
+            return
+        if (message := self.udp_chunks.receive(data, address)) is not None:
+            self.received(TRANSPORT_UDP, message)
+        elif self.udp_chunks.partial and not self.udp_expiry:
+            # partial messages are only checked while there are some, an idle client sets no timer
+            self.udp_expiry = asyncio.get_running_loop().call_later(EXPIRY_INTERVAL, self.expire_udp_chunks)
+
+    def expire_udp_chunks(self) -> None:
+        self.udp_chunks.expire()
+        self.udp_expiry = None
+        if self.udp_chunks.partial and not self.is_closed:
+            self.udp_expiry = asyncio.get_running_loop().call_later(EXPIRY_INTERVAL, self.expire_udp_chunks)
+
+    def multicast_delivered(self, message: Buffer) -> None:
+        # multicast loops back to the sender, its own messages are not received
+        if bytes(message[:len(self.nick) + 1]) != bytes(f"{self.nick}:", ENCODING):
+            self.received(TRANSPORT_MULTICAST, message)
+
+    async def send_heartbeats(self) -> None:
+        # the server evicts clients it has not heard from for a while; the text protocol has no room for
+        # heartbeats, only a dead connection takes such a client off the server
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if self.framed and self.tcp:
+                self.tcp.write(encode_frame(FRAME_HEARTBEAT))
+            if self.udp_socket:
+                try:
+                    self.udp_socket.sendto(HEARTBEAT_DATAGRAM, (IP, PORT))
+                except OSError:
+                    pass
+
+    async def tick_multicast(self) -> None:
+        while True:
+            await asyncio.sleep(TICK_INTERVAL)
+            self.multicast.tick()
+            self.multicast.chunks.expire()
+
+    async def send(self, message: str) -> None:
+        if not self.tcp:
+            raise RuntimeError("The client has no TCP connection.")
+        data = bytes(MESSAGE.format(nick=self.nick, message=message), ENCODING)
+        if not self.framed:
+            self.tcp.write(data)
+        elif self.compressed:
+            self.tcp.write(encode_compressed_frame(encode_frame(FRAME_CHAT, data)))
+        else:
+            self.tcp.write(encode_frame(FRAME_CHAT, data))
+        # waits while the server reads slower than the client writes
+        if self.tcp_protocol.writable:
+            await self.tcp_protocol.writable
+
+    async def send_udp(self, message: str) -> None:
+        if not self.udp_chunks:
+            raise RuntimeError("The client has no UDP socket.")
+        self.udp_chunks.send(bytes(MESSAGE.format(nick=self.nick, message=message), ENCODING), (IP, PORT))
+
+    async def send_multicast(self, message: str) -> None:
+        if not self.multicast:
+            raise RuntimeError("The client has not joined a multicast group.")
+        self.multicast.send(bytes(MESSAGE.format(nick=self.nick, message=message), ENCODING))
+
+    async def join(self, room: str) -> None:
+        # both transports follow the client into the room
+        if self.tcp:
+            await self.send(f"{JOIN_COMMAND}{room}")
+        if self.udp_socket:
+            self.udp_socket.sendto(
+                bytes(MESSAGE.format(nick=self.nick, message=f"{JOIN_COMMAND}{room}"), ENCODING), (IP, PORT)
+            )
+
+    async def recv(self) -> AsyncIterator[ChatMessage]:
+        # every received message until the client is closed or the server closes the connection
+        while (message := await self.inbox.get()) is not None:
+            yield message
+
+    def __aiter__(self) -> AsyncIterator[ChatMessage]:
+        return self.recv()
+
+    def closed(self) -> None:
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for timer in self.timers:
+            timer.cancel()
+        if self.udp_expiry:
+            self.udp_expiry.cancel()
+        for transport in (self.udp_transport, self.multicast_transport):
+            if transport:
+                transport.close()
+        # the end of recv() gets through even to a full inbox
+        while self.inbox.full():
+            self.inbox.get_nowait()
+            self.dropped += 1
+        self.inbox.put_nowait(None)
+
+    async def close(self) -> None:
+        if self.tcp and not self.tcp.is_closing():
+            if self.framed:
+                self.tcp.write(encode_frame(FRAME_LEAVE))
+            self.tcp.close()
+        self.closed()
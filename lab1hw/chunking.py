@@ -0,0 +1,185 @@
+import time
+import random
+import socket
+import struct
+
+from collections import OrderedDict
+from threading import Thread, Lock
+from typing import List, Optional, Tuple, Union
+
+from constants import (
+    MAX_BUF_SIZE, MAX_UDP_MESSAGE_SIZE, UDP_REASSEMBLY_TIMEOUT, UDP_REASSEMBLY_WINDOW, UDP_NACK_DELAY,
+    UDP_MAX_NACKS, UDP_RETRANSMIT_WINDOW
+)
+from metrics import registry
+from udp_batch import Address
+
+# a chunk is: zero byte, kind, message id, chunk index, chunk count, payload; a legacy datagram starts with a
+# nick or INIT and never with a zero byte, so both kinds of datagrams share the sockets
+CHUNK_HEADER: struct.Struct = struct.Struct("!BBIHH")
+CHUNK_DATA = 1
+# a NACK carries the message id and the chunk count of the header, then the missing chunk indexes
+CHUNK_NACK = 2
+NACK_INDEX: struct.Struct = struct.Struct("!H")
+# a heartbeat only tells the server that the peer is still there, receivers ignore it
+CHUNK_HEARTBEAT = 3
+HEARTBEAT_DATAGRAM = CHUNK_HEADER.pack(0, CHUNK_HEARTBEAT, 0, 0, 0)
+
+# every chunk fits in the receivers' MAX_BUF_SIZE buffers and in one Ethernet frame, never IP fragments
+CHUNK_PAYLOAD_SIZE = MAX_BUF_SIZE - CHUNK_HEADER.size
+# a longer count could only announce a message over MAX_UDP_MESSAGE_SIZE, its chunks are dropped
+MAX_CHUNK_COUNT = -(-MAX_UDP_MESSAGE_SIZE // CHUNK_PAYLOAD_SIZE)
+MAX_NACK_INDEXES = (MAX_BUF_SIZE - CHUNK_HEADER.size) // NACK_INDEX.size
+# how often partial messages are checked for timeouts and missing chunks
+EXPIRY_INTERVAL = 0.05
+
+Buffer = Union[bytes, memoryview]
+
+chunk_events = {
+    event: registry.counter("lab1hw_udp_chunk_events_total", "UDP chunking and reassembly events", event=event)
+    for event in ("reassembled", "evicted", "duplicate", "nack_sent", "retransmitted")
+}
+
+
+def is_chunk(datagram: Buffer) -> bool:
+    return len(datagram) >= CHUNK_HEADER.size and datagram[0] == 0
+
+
+class PartialMessage:
+    def __init__(self, count: int) -> None:
+        self.chunks: List[Optional[bytes]] = [None] * count
+        self.missing = count
+        self.last_progress = time.monotonic()
+        self.nacks = 0
+
+
+# splits messages longer than one datagram into numbered chunks and puts them back together on the other side;
+# with retransmit on, receivers NACK the chunks still missing after UDP_NACK_DELAY and senders answer from
+# the chunks of their last UDP_RETRANSMIT_WINDOW messages; partial messages are dropped after
+# UDP_REASSEMBLY_TIMEOUT without progress, or when more than UDP_REASSEMBLY_WINDOW of them are pending
+class ChunkChannel:
+    def __init__(self, sock: socket.socket, retransmit: bool, nack_address: Optional[Address] = None) -> None:
+        self.sock = sock
+        self.retransmit = retransmit
+        # multicast receivers NACK to the group, the sender is one of its members
+        self.nack_address = nack_address
+        self.lock = Lock()
+        # random start, so that message ids of different senders behind one address hardly ever collide
+        self.next_id = random.getrandbits(32)
+        self.sent: "OrderedDict[int, List[bytes]]" = OrderedDict()
+        self.partial: "OrderedDict[Tuple[Address, int], PartialMessage]" = OrderedDict()
+        # recently completed messages, their retransmitted chunks are duplicates
+        self.completed: "OrderedDict[Tuple[Address, int], None]" = OrderedDict()
+
+    def start(self) -> None:
+        Thread(target=self.expire_forever, daemon=True).start()
+
+    def chunks(self, message: Buffer) -> List[bytes]:
+        if len(message) > MAX_UDP_MESSAGE_SIZE:
+            raise ValueError(
+                f"UDP message of {len(message)} bytes exceeds the limit of {MAX_UDP_MESSAGE_SIZE} bytes"
+            )
+        count = -(-len(message) // CHUNK_PAYLOAD_SIZE)
+        with self.lock:
+            message_id = self.next_id
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        chunks = [
+            CHUNK_HEADER.pack(0, CHUNK_DATA, message_id, i, count)
+            + message[i * CHUNK_PAYLOAD_SIZE:(i + 1) * CHUNK_PAYLOAD_SIZE]
+            for i in range(count)
+        ]
+        if self.retransmit:
+            with self.lock:
+                self.sent[message_id] = chunks
+                if len(self.sent) > UDP_RETRANSMIT_WINDOW:
+                    self.sent.popitem(last=False)
+        return chunks
+
+    def datagrams(self, message: Buffer) -> List[Buffer]:
+        # a message that fits in one datagram goes out as it is, legacy receivers understand it
+        if len(message) <= MAX_BUF_SIZE and not is_chunk(message):
+            return [message]
+        return self.chunks(message)
+
+    def send(self, message: Buffer, address: Address) -> None:
+        for datagram in self.datagrams(message):
+            self.sock.sendto(datagram, address)
+
+    def receive(self, datagram: Buffer, address: Address) -> Optional[Buffer]:
+        # returns a whole message, the datagram itself unless it is a chunk, None while a message is incomplete
+        if not is_chunk(datagram):
+            return datagram
+        _, kind, message_id, index, count = CHUNK_HEADER.unpack_from(datagram)
+        if kind == CHUNK_NACK:
+            self.answer_nack(datagram, message_id, address)
+            return None
+        if kind != CHUNK_DATA or not count or count > MAX_CHUNK_COUNT or index >= count:
+            return None
+
+        key = (address, message_id)
+        with self.lock:
+            if key in self.completed:
+                chunk_events["duplicate"].inc()
+                return None
+            if (partial := self.partial.get(key)) is None:
+                partial = self.partial[key] = PartialMessage(count)
+                if len(self.partial) > UDP_REASSEMBLY_WINDOW:
+                    self.partial.popitem(last=False)
+                    chunk_events["evicted"].inc()
+            if len(partial.chunks) != count or partial.chunks[index] is not None:
+                chunk_events["duplicate"].inc()
+                return None
+            # the receive buffer is reused, the chunk has to be copied
+            partial.chunks[index] = bytes(datagram[CHUNK_HEADER.size:])
+            partial.missing -= 1
+            partial.last_progress = time.monotonic()
+            if partial.missing:
+                return None
+            del self.partial[key]
+            self.completed[key] = None
+            if len(self.completed) > UDP_REASSEMBLY_WINDOW:
+                self.completed.popitem(last=False)
+        chunk_events["reassembled"].inc()
+        return b"".join(partial.chunks)
+
+    def answer_nack(self, nack: Buffer, message_id: int, address: Address) -> None:
+        with self.lock:
+            chunks = self.sent.get(message_id)
+        if chunks is None:
+            return
+        target = self.nack_address or address
+        for offset in range(CHUNK_HEADER.size, len(nack) - NACK_INDEX.size + 1, NACK_INDEX.size):
+            index, = NACK_INDEX.unpack_from(nack, offset)
+            if index < len(chunks):
+                try:
+                    self.sock.sendto(chunks[index], target)
+                except OSError:
+                    return
+                chunk_events["retransmitted"].inc()
+
+    def expire(self) -> None:
+        now = time.monotonic()
+        nacks: List[Tuple[Address, bytes]] = []
+        with self.lock:
+            for key, partial in list(self.partial.items()):
+                if now - partial.last_progress > UDP_REASSEMBLY_TIMEOUT:
+                    del self.partial[key]
+                    chunk_events["evicted"].inc()
+                elif self.retransmit and partial.nacks < UDP_MAX_NACKS and \
+                        now - partial.last_progress > UDP_NACK_DELAY * (partial.nacks + 1):
+                    partial.nacks += 1
+                    address, message_id = key
+                    missing = [i for i, chunk in enumerate(partial.chunks) if chunk is None][:MAX_NACK_INDEXES]
+                    nacks.append((address, CHUNK_HEADER.pack(0, CHUNK_NACK, message_id, 0, len(partial.chunks))
+                                  + b"".join(NACK_INDEX.pack(i) for i in missing)))
+        for address, nack in nacks:
+            try:
+                self.sock.sendto(nack, self.nack_address or address)
+            except OSError:
+                continue
+            chunk_events["nack_sent"].inc()
+
+    def expire_forever(self) -> None:
+        while True:
+            time.sleep(EXPIRY_INTERVAL)
+            self.expire()
@@ -1,140 +1,161 @@
-import socket
-import signal
 import sys
-import struct
+import signal
+import asyncio
+import argparse
 
-from threading import Thread
+from typing import Optional
 
 from constants import (
-    IP, PORT, MAX_BUF_SIZE, MESSAGE, ENCODING, INIT_MSG, UDP_UNICAST_MSG, UDP_MULTICAST_MSG,
-    ASCII_ART
+    MAX_BUF_SIZE, ENCODING, INIT_MSG, UDP_UNICAST_MSG, UDP_MULTICAST_MSG, ASCII_ART, MAX_UDP_MESSAGE_SIZE,
+    PROTOCOL_TEXT, PROTOCOL_FRAMED, MAX_FRAME_SIZE, JOIN_COMMAND, UDP_FILE_COMMAND, MULTICAST_FILE_COMMAND,
+    MULTICAST_STATS_COMMAND
 )
+from chat_client import ChatClient, NegotiationError
+from logs import log
+from multicast import multicast_stats
 
 
-def signal_handler(sig, frame):
-    print("\nClient finished.")
-    sys.exit(0)
-
-
-def set_up_client(nick: str, multicast_address: str, multicast_port: int) -> None:
-    # create sockets
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
-        client_socket.connect((IP, PORT))
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_unicast_socket:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as\
-                    udp_multicast_socket:
-                # send INIT messages
-                send_tcp_message(client_socket, nick, INIT_MSG, True)
-                send_udp_message_to_server(nick, udp_unicast_socket, True)
-                print(
-                    """You're connected to the server. You can now send and receive messages.
-                    - Type U to send a UDP datagram with an ASCII Art.
-                    - Type M to send a UDP multicast datagram with an ASCII Art.
-                    """
-                )
-
-                # setup receivers
-                tcp_message_receiver = Thread(
-                    target=receive_tcp_message_from_server,
-                    args=(client_socket,),
-                    daemon=True
-                )
-                udp_server_receiver = Thread(
-                    target=receive_udp_message_from_server,
-                    args=(udp_unicast_socket,),
-                    daemon=True
-                )
-                udp_multicast_receiver = Thread(
-                    target=receive_udp_multicast_message,
-                    args=(nick, udp_multicast_socket, multicast_address, multicast_port),
-                    daemon=True
-                )
-
-                tcp_message_receiver.start()
-                udp_server_receiver.start()
-                udp_multicast_receiver.start()
-
-                # message input and sending
-                max_msg_len = MAX_BUF_SIZE - len(nick) - 1
-                while True:
-                    message = input()
-                    if len(message) > max_msg_len:
-                        print(f"Message too long, maximum {max_msg_len} characters.")
-                    elif message == INIT_MSG:
-                        print("This message is reserved for initializing.")
-                    elif message == UDP_UNICAST_MSG:
-                        send_udp_message_to_server(nick, udp_unicast_socket, False)
-                    elif message == UDP_MULTICAST_MSG:
-                        send_udp_multicast_message(
-                            nick, udp_multicast_socket, multicast_address, multicast_port
-                        )
-                    else:
-                        send_tcp_message(client_socket, nick, message, False)
-
-
-def send_tcp_message(client_socket: socket.socket, nick: str, message: str, init: bool) -> None:
-    if init:
-        client_socket.sendall(bytes(INIT_MSG, ENCODING))
-    else:
-        client_socket.sendall(bytes(MESSAGE.format(nick=nick, message=message), ENCODING))
-
-
-def receive_tcp_message_from_server(client: socket.socket) -> None:
-    buf: bytes
-    while buf := client.recv(MAX_BUF_SIZE):
-        sender_nick, _, message = buf.decode(ENCODING).partition(":")
-        print(f"Message from {sender_nick}: {message}")
+async def open_stdin() -> Optional[asyncio.StreamReader]:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    except ValueError:
+        # a regular file cannot be watched by the event loop, its lines are read in the executor instead
+        return None
+    return reader
 
 
-def send_udp_message_to_server(nick: str, udp_unicast_socket: socket.socket, init: bool) -> None:
-    if init:
-        udp_unicast_socket.sendto(bytes(INIT_MSG, ENCODING), (IP, PORT))
+async def read_line(stdin: Optional[asyncio.StreamReader]) -> Optional[str]:
+    if stdin is None:
+        line = await asyncio.get_running_loop().run_in_executor(None, sys.stdin.readline)
     else:
-        udp_unicast_socket.sendto(bytes(f"{nick}:{ASCII_ART}", ENCODING), (IP, PORT))
+        line = str(await stdin.readline(), ENCODING, "replace")
+    return line.rstrip("\n") if line else None
 
 
-def receive_udp_message_from_server(udp_unicast_socket: socket.socket) -> None:
-    while True:
-        buf, _ = udp_unicast_socket.recvfrom(MAX_BUF_SIZE)
-        sender_nick, _, payload = buf.decode(ENCODING).partition(":")
-        print(f"Message from {sender_nick}: {payload}")
+async def run_client(args: argparse.Namespace) -> None:
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, asyncio.current_task().cancel)
+    stdin = await open_stdin()
 
-
-def send_udp_multicast_message(nick: str, udp_multicast_socket: socket.socket,
-                               multicast_address: str, multicast_port: int) -> None:
-    udp_multicast_socket.sendto(
-        bytes(f"{nick}:{ASCII_ART}", ENCODING), (multicast_address, multicast_port)
+    print("Your nick: ", end="", flush=True)
+    if (nick := await read_line(stdin)) is None:
+        return
+    client = ChatClient(
+        nick, args.multicast_address, args.multicast_port, args.protocol == PROTOCOL_FRAMED, args.udp_retransmit,
+        args.reliable_multicast, args.compression
+    )
+    try:
+        await client.connect()
+    except NegotiationError:
+        print(f"Server did not accept the framed protocol, use --protocol {PROTOCOL_TEXT}.")
+        return
+    except ConnectionRefusedError:
+        # the server is down, or over its connection limit or rate
+        print("Server refused the connection, try again later.")
+        return
+    print(
+        """You're connected to the server. You can now send and receive messages.
+        - Type U to send a UDP datagram with an ASCII Art.
+        - Type M to send a UDP multicast datagram with an ASCII Art.
+        - Type /udp <file> or /multicast <file> to send the ASCII Art from a file, of any size.
+        - Type /join <room> to move to another room, everyone starts in the lobby.
+        - Type /stats to see how many multicast messages were delivered, lost and repaired.
+        """
     )
 
-
-def receive_udp_multicast_message(nick: str, udp_multicast_socket: socket.socket,
-                                  multicast_address: str, multicast_port: int) -> None:
-    udp_multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    udp_multicast_socket.bind((multicast_address, multicast_port))
-
-    mreq = struct.pack("4sl", socket.inet_aton(multicast_address), socket.INADDR_ANY)
-
-    udp_multicast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-
-    while True:
-        buf, _ = udp_multicast_socket.recvfrom(MAX_BUF_SIZE)
-        sender_nick, _, payload = buf.decode(ENCODING).partition(":")
-        if sender_nick != nick:
-            print(f"Message from {sender_nick}: {payload}")
+    receiver = loop.create_task(show_messages(client))
+    try:
+        await read_commands(client, stdin)
+    finally:
+        receiver.cancel()
+        await client.close()
+
+
+async def show_messages(client: ChatClient) -> None:
+    # received messages are printed by the log writer, the event loop never waits for the terminal
+    async for message in client:
+        log.event(f"Message from {message.nick}: {message.text}")
+
+
+async def read_commands(client: ChatClient, stdin: Optional[asyncio.StreamReader]) -> None:
+    # frames carry their own length, text messages have to fit in a single server recv
+    max_msg_len = (MAX_FRAME_SIZE if client.framed else MAX_BUF_SIZE) - len(client.nick) - 1
+    while (message := await read_line(stdin)) is not None:
+        if client.is_closed:
+            print("Server closed the connection.")
+            return
+        if len(message) > max_msg_len:
+            print(f"Message too long, maximum {max_msg_len} characters.")
+        elif message == INIT_MSG:
+            print("This message is reserved for initializing.")
+        elif message == UDP_UNICAST_MSG:
+            await client.send_udp(ASCII_ART)
+        elif message == UDP_MULTICAST_MSG:
+            await client.send_multicast(ASCII_ART)
+        elif message.startswith(UDP_FILE_COMMAND):
+            if (art := read_art(message[len(UDP_FILE_COMMAND):])) is not None:
+                await client.send_udp(art)
+        elif message.startswith(MULTICAST_FILE_COMMAND):
+            if (art := read_art(message[len(MULTICAST_FILE_COMMAND):])) is not None:
+                await client.send_multicast(art)
+        elif message == MULTICAST_STATS_COMMAND:
+            print(", ".join(f"{event}: {count}" for event, count in multicast_stats().items()))
+        elif message.startswith(JOIN_COMMAND):
+            await client.join(message[len(JOIN_COMMAND):])
+        else:
+            await client.send(message)
+
+
+def read_art(path: str) -> Optional[str]:
+    try:
+        with open(path.strip(), encoding=ENCODING) as art_file:
+            art = art_file.read()
+    except (OSError, ValueError) as e:
+        print(f"Cannot read {path.strip()}: {e}")
+        return None
+    if len(bytes(art, ENCODING)) > MAX_UDP_MESSAGE_SIZE - MAX_BUF_SIZE:
+        print(f"File too long, maximum {MAX_UDP_MESSAGE_SIZE - MAX_BUF_SIZE} bytes.")
+        return None
+    return art
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("multicast_address")
+    parser.add_argument("multicast_port", type=int)
+    parser.add_argument(
+        "--protocol", choices=(PROTOCOL_TEXT, PROTOCOL_FRAMED), default=PROTOCOL_FRAMED,
+        help="length-prefixed framed TCP protocol or the legacy one message per recv text protocol"
+    )
+    parser.add_argument(
+        "--udp-retransmit", action="store_true",
+        help="NACK missing chunks of long UDP messages and retransmit the chunks others NACK"
+    )
+    parser.add_argument(
+        "--reliable-multicast", action="store_true",
+        help="number multicast messages, deliver them in order and repair lost ones with NACKs"
+    )
+    parser.add_argument(
+        "--compression", action="store_true",
+        help="ask the server to compress framed TCP messages with zlib and a preset dictionary"
+    )
+    parser.add_argument("--log-file", help="append received messages to this file instead of printing them")
+    return parser.parse_args()
 
 
 def main() -> int:
-    signal.signal(signal.SIGINT, signal_handler)
-
-    if len(sys.argv) != 3:
-        print(f"Usage: python3 {sys.argv[0]} <multicast_address> <multicast_port>")
-        sys.exit(0)
-
-    multicast_address, multicast_port = sys.argv[1], int(sys.argv[2])
-
-    nick = input("Your nick: ")
-
-    set_up_client(nick, multicast_address, multicast_port)
+    args = parse_args()
+    log.start(1, args.log_file)
+
+    # the TCP connection, both UDP sockets and stdin are all served by one event loop
+    try:
+        asyncio.run(run_client(args))
+    except asyncio.CancelledError:
+        pass
+    log.flush()
+    print("\nClient finished.")
 
     return 0
 
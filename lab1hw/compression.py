@@ -0,0 +1,77 @@
+import zlib
+
+from typing import List
+
+from constants import (
+    ENCODING, ASCII_ART, JOIN_COMMAND, DEFAULT_ROOM, MAX_FRAME_SIZE, FRAME_COMPRESSED, COMPRESSION_LEVEL,
+    COMPRESSION_MIN_SIZE
+)
+from framing import FRAME_HEADER, Frame, encode_frame
+from metrics import registry
+
+# a chat message alone is too short for deflate to find repetitions in, a preset dictionary of typical traffic
+# gives it the ASCII art, commands and common words to refer back to; deflate finds the end of the dictionary
+# the cheapest, so the most common content comes last
+COMPRESSION_DICTIONARY: bytes = bytes(
+    "http://https://www..com .org :) :( :D haha lol ok okay yes no thanks thank you hi hello hey bye "
+    "what when where why how who which would could should about there their they them then than "
+    "this that with have from your you are not but for and the is it to of in on at "
+    f"Message from {JOIN_COMMAND}{DEFAULT_ROOM} {ASCII_ART}",
+    ENCODING
+)
+# raw deflate, a zlib header and checksum would cost every message 6 bytes
+WBITS = -15
+
+compression_bytes = {
+    stage: registry.counter(
+        "lab1hw_compression_bytes_total", "frame bytes before and after compression", stage=stage
+    )
+    for stage in ("before", "after")
+}
+
+
+def compress(data: bytes) -> bytes:
+    # a fresh compressor every time, a compressed frame does not depend on any earlier one and can be
+    # shared by every recipient
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, WBITS, zdict=COMPRESSION_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data: bytes, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj(WBITS, zdict=COMPRESSION_DICTIONARY)
+    try:
+        decompressed = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise ValueError(f"Corrupt compressed frame: {e}") from None
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"Compressed frame expands beyond {max_size} bytes")
+    return decompressed
+
+
+def encode_compressed_frame(frames: bytes) -> bytes:
+    # one frame or a batch of them in a single compressed frame, left as they are when compression
+    # would not make them shorter
+    if not COMPRESSION_MIN_SIZE <= len(frames) <= MAX_FRAME_SIZE:
+        return frames
+    compressed = compress(frames)
+    if len(compressed) + FRAME_HEADER.size >= len(frames):
+        return frames
+    compression_bytes["before"].inc(len(frames))
+    compression_bytes["after"].inc(len(compressed) + FRAME_HEADER.size)
+    return encode_frame(FRAME_COMPRESSED, compressed)
+
+
+def decode_compressed_frame(payload: bytes) -> List[Frame]:
+    data = decompress(payload, MAX_FRAME_SIZE)
+    frames: List[Frame] = []
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < FRAME_HEADER.size:
+            raise ValueError("Truncated frame in a compressed frame")
+        length, frame_type = FRAME_HEADER.unpack_from(data, offset)
+        end = offset + FRAME_HEADER.size + length
+        if end > len(data) or frame_type == FRAME_COMPRESSED:
+            raise ValueError("Truncated or nested frame in a compressed frame")
+        frames.append((frame_type, data[offset + FRAME_HEADER.size:end]))
+        offset = end
+    return frames
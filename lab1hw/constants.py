@@ -9,8 +9,84 @@ MESSAGE: Final[str] = "{nick}:{message}"
 ENCODING: Final[str] = "utf-8"
 INIT_MSG: Final[str] = "INIT"
 
+# length-prefixed binary framing, negotiated by sending an INIT frame instead of INIT_MSG
+PROTOCOL_TEXT: Final[str] = "text"
+PROTOCOL_FRAMED: Final[str] = "framed"
+FRAMING_VERSION: Final[int] = 1
+FRAME_INIT: Final[int] = 1
+FRAME_CHAT: Final[int] = 2
+FRAME_LEAVE: Final[int] = 3
+FRAME_HEARTBEAT: Final[int] = 4
+# one or more frames compressed together, only sent to peers that asked for it in their INIT frame
+FRAME_COMPRESSED: Final[int] = 5
+INIT_FLAG_COMPRESSION: Final[int] = 1
+COMPRESSION_LEVEL: Final[int] = 6
+# shorter frames hardly ever get shorter
+COMPRESSION_MIN_SIZE: Final[int] = 32
+MAX_FRAME_SIZE: Final[int] = 1 << 20
+RECV_BUF_SIZE: Final[int] = 1 << 16
+NEGOTIATION_TIMEOUT: Final[float] = 2.0
+# messages an asyncio client keeps for its reader, newer ones are dropped while it is full
+CLIENT_INBOX_SIZE: Final[int] = 1000
+
+SERVING_MODE_THREADS: Final[str] = "threads"
+SERVING_MODE_EVENT_LOOP: Final[str] = "event-loop"
+
+DEFAULT_OUTBOUND_QUEUE_SIZE: Final[int] = 256
+OVERFLOW_DROP_OLDEST: Final[str] = "drop-oldest"
+OVERFLOW_DISCONNECT: Final[str] = "disconnect"
+OVERFLOW_BACKPRESSURE: Final[str] = "backpressure"
+
+UDP_RECV_BATCH_SIZE: Final[int] = 64
+
+# UDP messages longer than MAX_BUF_SIZE travel as numbered chunks and are reassembled by the receiver
+MAX_UDP_MESSAGE_SIZE: Final[int] = 1 << 20
+UDP_REASSEMBLY_TIMEOUT: Final[float] = 2.0
+UDP_REASSEMBLY_WINDOW: Final[int] = 64
+UDP_NACK_DELAY: Final[float] = 0.1
+UDP_MAX_NACKS: Final[int] = 5
+UDP_RETRANSMIT_WINDOW: Final[int] = 64
+
+# optional reliable multicast: per-sender sequence numbers, in-order delivery and NACK repair of the gaps
+MULTICAST_RETRANSMIT_WINDOW: Final[int] = 1024
+MULTICAST_REORDER_WINDOW: Final[int] = 1024
+MULTICAST_NACK_DELAY: Final[float] = 0.05
+MULTICAST_MAX_NACKS: Final[int] = 5
+MULTICAST_REPAIR_TIMEOUT: Final[float] = 1.0
+MULTICAST_SESSION_INTERVAL: Final[float] = 0.1
+MULTICAST_SESSION_REPEATS: Final[int] = 5
+MULTICAST_SENDER_TIMEOUT: Final[float] = 60.0
+
+# clients send a heartbeat every HEARTBEAT_INTERVAL, the server evicts framed TCP and UDP peers it has not heard
+# from for PEER_TIMEOUT; idle peers are found with a timer wheel of TIMER_WHEEL_RESOLUTION slots
+HEARTBEAT_INTERVAL: Final[float] = 5.0
+PEER_TIMEOUT: Final[float] = 30.0
+TIMER_WHEEL_RESOLUTION: Final[float] = 1.0
+# how long a metrics scrape waits for the event loop to read the gauges only it may touch
+METRICS_LOOP_TIMEOUT: Final[float] = 1.0
+
+# token buckets of TCP admission control hold RATE_LIMIT_BURST seconds worth of their rate, per-IP buckets are
+# kept for the RATE_LIMIT_MAX_ADDRESSES most recently seen addresses
+RATE_LIMIT_BURST: Final[float] = 2.0
+RATE_LIMIT_MAX_ADDRESSES: Final[int] = 1 << 16
+
+# rooms, every client starts in DEFAULT_ROOM and moves with "/join <room>"
+DEFAULT_ROOM: Final[str] = "lobby"
+JOIN_COMMAND: Final[str] = "/join "
+# longer room names are not joined, the command is relayed as a plain message
+MAX_ROOM_NAME_SIZE: Final[int] = 255
+
+# the last messages of every room, replayed to framed TCP clients when they enter it
+DEFAULT_HISTORY_SIZE: Final[int] = 50
+DEFAULT_HISTORY_SLOT_SIZE: Final[int] = MAX_BUF_SIZE
+DEFAULT_HISTORY_MEMORY: Final[int] = 64 << 20
+
 UDP_UNICAST_MSG: Final[str] = "U"
 UDP_MULTICAST_MSG: Final[str] = "M"
+# send a file (a bigger ASCII art) instead of the built-in one
+UDP_FILE_COMMAND: Final[str] = "/udp "
+MULTICAST_FILE_COMMAND: Final[str] = "/multicast "
+MULTICAST_STATS_COMMAND: Final[str] = "/stats"
 
 ASCII_ART: Final[str] = """
  |\\__/,|   (`\\
@@ -0,0 +1,348 @@
+import time
+import socket
+import selectors
+
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Deque, List, Optional, Set, Tuple
+
+from constants import (
+    IP, PORT, MAX_BUF_SIZE, RECV_BUF_SIZE, OVERFLOW_BACKPRESSURE,
+    FRAME_INIT, FRAME_CHAT, FRAME_LEAVE, DEFAULT_ROOM, TIMER_WHEEL_RESOLUTION, FRAME_COMPRESSED,
+    INIT_FLAG_COMPRESSION
+)
+from admission import AdmissionControl, TokenBucket
+from compression import decode_compressed_frame, encode_compressed_frame
+from framing import Frame, FrameDecoder, is_framed, encode_frame, encode_init_frame, init_flags
+from history import HistoryStore
+from logs import log
+from metrics import (
+    tcp_connections_accepted, bytes_received, bytes_sent, messages_relayed, fan_out_duration, peers_evicted
+)
+from outbound import OutboundQueue
+from messages import INIT_MSG_BYTES, parse_join_command, relayed_message, split_message
+from rooms import RoomIndex
+from shards import ShardBus, BUS_TCP_MESSAGE, bind_reuse_port
+from timer_wheel import TimerWheel
+
+
+@dataclass(eq=False)
+class TcpConnection:
+    sock: socket.socket
+    outbound_queue: OutboundQueue
+    out_buf: bytearray = field(default_factory=bytearray)
+    # unknown until the first bytes arrive
+    framed: Optional[bool] = None
+    # negotiated in the INIT frame
+    compressed: bool = False
+    # the peer's IP address and the client's own message rate limit
+    address: str = ""
+    bucket: Optional[TokenBucket] = None
+    decoder: FrameDecoder = field(default_factory=FrameDecoder)
+    # recipients whose full queues keep this connection from being read (backpressure)
+    paused_by: Set["TcpConnection"] = field(default_factory=set)
+    # senders paused because of this connection's full queue
+    paused_senders: Set["TcpConnection"] = field(default_factory=set)
+
+
+# serves every TCP client from a single selectors loop instead of a thread per client
+class EventLoopTcpServer:
+    def __init__(self, backlog: int, outbound_queue_size: int, overflow_policy: str, reuse_port: bool,
+                 history: HistoryStore, peer_timeout: float, compression: bool,
+                 admission: AdmissionControl) -> None:
+        self.backlog = backlog
+        self.outbound_queue_size = outbound_queue_size
+        self.overflow_policy = overflow_policy
+        self.reuse_port = reuse_port
+        self.history = history
+        # whether framed clients asking for compression get it
+        self.compression = compression
+        self.admission = admission
+        self.selector = selectors.DefaultSelector()
+        self.tcp_clients: RoomIndex[TcpConnection, Set[TcpConnection]] = RoomIndex(set)
+        # framed connections by the time they were last heard from, text protocol ones send no heartbeats
+        self.tcp_peers: TimerWheel[TcpConnection] = TimerWheel(peer_timeout, TIMER_WHEEL_RESOLUTION)
+        # set when the server runs as one of several shards sharing the port
+        self.shard_bus: Optional[ShardBus] = None
+        # room messages handed over by other threads, the wakeup socket interrupts select
+        self.inbox: Deque[Tuple[str, bytes]] = deque()
+        # functions other threads run on the loop, for state only the loop may read
+        self.calls: Deque[Tuple[Callable[[], object], Future]] = deque()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+
+    def serve_forever(self) -> None:
+        # create an INET, STREAMing socket
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+            # allow restarting the server while old connections linger in TIME_WAIT
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                bind_reuse_port(server_socket)
+            # bind the socket to the localhost and a port
+            server_socket.bind((IP, PORT))
+            # become a non-blocking server socket
+            server_socket.listen(self.backlog)
+            server_socket.setblocking(False)
+            self.selector.register(server_socket, selectors.EVENT_READ)
+            self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+
+            # without peers to evict, select only wakes up for events
+            select_timeout = TIMER_WHEEL_RESOLUTION if self.tcp_peers.timeout else None
+            while True:
+                for key, events in self.selector.select(select_timeout):
+                    if key.fileobj is server_socket:
+                        self.accept(server_socket)
+                        continue
+                    if key.fileobj is self.wakeup_receiver:
+                        self.deliver_inbox()
+                        continue
+                    connection: TcpConnection = key.data
+                    # the connection may have been closed by an earlier event of this batch
+                    if events & selectors.EVENT_READ and connection.sock.fileno() != -1:
+                        self.read(connection)
+                    if events & selectors.EVENT_WRITE and connection.sock.fileno() != -1:
+                        self.flush(connection)
+                if self.tcp_peers.timeout:
+                    self.evict_stale_connections()
+
+    def accept(self, server_socket: socket.socket) -> None:
+        # drain the whole accept queue on every wakeup
+        while True:
+            try:
+                client_socket, (address, _) = server_socket.accept()
+            except BlockingIOError:
+                return
+            # relayed frames are already batched by flush, Nagle would only hold them back
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            tcp_connections_accepted.inc()
+            if not self.admission.admit(address):
+                client_socket.close()
+                continue
+            client_socket.setblocking(False)
+            connection = TcpConnection(
+                client_socket, OutboundQueue(self.outbound_queue_size, self.overflow_policy), address=address,
+                bucket=self.admission.client_bucket()
+            )
+            self.selector.register(client_socket, selectors.EVENT_READ, connection)
+
+    def read(self, connection: TcpConnection) -> None:
+        try:
+            buf = connection.sock.recv(RECV_BUF_SIZE if connection.framed else MAX_BUF_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            buf = b""
+        if not buf:
+            self.close(connection)
+            return
+        bytes_received["tcp"].inc(len(buf))
+
+        if connection.framed is None:
+            # the first bytes tell whether the client speaks the framed or the legacy text protocol
+            connection.framed = is_framed(buf)
+        try:
+            if not connection.framed:
+                if buf == INIT_MSG_BYTES:
+                    self.register(connection)
+                else:
+                    self.relay(connection, buf)
+            else:
+                # every frame counts as a heartbeat, heartbeat frames themselves need no handling
+                self.tcp_peers.touch(connection)
+                self.handle_frames(connection, connection.decoder.feed(buf))
+        except (OSError, ValueError):
+            # malformed frame or text, or a socket error while handling it, drop the client instead of the whole loop
+            self.close(connection)
+
+    def handle_frames(self, connection: TcpConnection, frames: List[Frame]) -> None:
+        for frame_type, payload in frames:
+            if frame_type == FRAME_INIT:
+                self.register(connection, init_flags(payload))
+            elif frame_type == FRAME_CHAT:
+                self.relay(connection, payload)
+            elif frame_type == FRAME_COMPRESSED:
+                self.handle_frames(connection, decode_compressed_frame(payload))
+                if connection.sock.fileno() == -1:
+                    return
+            elif frame_type == FRAME_LEAVE:
+                log.event("TCP client has left.")
+                self.close(connection)
+                return
+
+    def register(self, connection: TcpConnection, flags: int = 0) -> None:
+        log.event("New TCP client has connected.")
+        connection.compressed = self.compression and bool(flags & INIT_FLAG_COMPRESSION)
+        self.tcp_clients.join(connection, DEFAULT_ROOM)
+        if connection.framed:
+            # the acknowledgement and the room's history go out with one write
+            ack = encode_init_frame(INIT_FLAG_COMPRESSION if connection.compressed else 0)
+            self.send(connection, ack + self.replay_frames(connection, DEFAULT_ROOM))
+
+    def replay_frames(self, connection: TcpConnection, room: str) -> bytes:
+        # the whole history is compressed as one batch
+        replay = self.history.replay(room)
+        return encode_compressed_frame(replay) if connection.compressed else replay
+
+    def relay(self, sender: TcpConnection, message: bytes) -> None:
+        # over its rate a message is dropped, the client stays connected
+        if not self.admission.allow_message(sender.address, sender.bucket):
+            return
+        if (room := parse_join_command(message)) is not None:
+            self.tcp_clients.join(sender, room)
+            if sender.framed and (replay := self.replay_frames(sender, room)):
+                self.send(sender, replay)
+            log.event(f"TCP client has joined room {room}.")
+            return
+
+        if log.sampled():
+            log.event("TCP message from {}: {}\nSending to other clients...".format(*split_message(message)))
+
+        # the sender's bytes go to every recipient as they are, one frame header for the whole room
+        data = relayed_message(message)
+        room = self.tcp_clients.room_of(sender) or DEFAULT_ROOM
+        start = time.perf_counter()
+        self.deliver(room, data, sender)
+        fan_out_duration["tcp"].observe(time.perf_counter() - start)
+        messages_relayed["tcp"].inc()
+        if self.shard_bus:
+            try:
+                self.shard_bus.publish(BUS_TCP_MESSAGE, room, data)
+            except OSError as e:
+                # the local members have it already, only the other shards miss the message
+                log.event(f"Dropped TCP message for the other shards: {e}")
+
+    def deliver(self, room: str, data: bytes, sender: Optional[TcpConnection] = None) -> None:
+        self.history.append(room, data)
+        frame = encode_frame(FRAME_CHAT, data)
+        # compressed once for all the recipients that asked for it
+        compressed_frame = None
+        for c in tuple(self.tcp_clients.members(room)):
+            if c is sender:
+                continue
+            if c.compressed and compressed_frame is None:
+                compressed_frame = encode_compressed_frame(frame)
+            self.send(c, (compressed_frame if c.compressed else frame) if c.framed else data, sender)
+
+    def deliver_threadsafe(self, room: str, data: bytes) -> None:
+        # called from other threads, the loop delivers the message on its next iteration
+        self.inbox.append((room, data))
+        self.wake_up()
+
+    def call_threadsafe(self, function: Callable[[], object]) -> Future:
+        # called from other threads, the loop runs function on its next iteration
+        future: Future = Future()
+        self.calls.append((function, future))
+        self.wake_up()
+        return future
+
+    def wake_up(self) -> None:
+        try:
+            self.wakeup_sender.send(b"\0")
+        except BlockingIOError:
+            # the loop has plenty of wakeups pending already
+            pass
+
+    def deliver_inbox(self) -> None:
+        try:
+            while self.wakeup_receiver.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.inbox:
+            self.deliver(*self.inbox.popleft())
+        while self.calls:
+            function, future = self.calls.popleft()
+            # a failing call is the caller's error, the loop goes on
+            try:
+                future.set_result(function())
+            except Exception as e:
+                future.set_exception(e)
+
+    def outbound_queue_lengths(self) -> List[int]:
+        return [len(c.outbound_queue) for c in self.tcp_clients.member_rooms]
+
+    def send(self, connection: TcpConnection, data: bytes, sender: Optional[TcpConnection] = None) -> None:
+        if not connection.outbound_queue.put(data, block=False):
+            # the overflow policy says disconnect
+            self.close(connection)
+            return
+        if sender and self.overflow_policy == OVERFLOW_BACKPRESSURE and connection.outbound_queue.full():
+            self.pause(sender, connection)
+        if not connection.out_buf:
+            # try to write straight away, only wait for EVENT_WRITE if the kernel buffer is full
+            self.flush(connection)
+
+    def flush(self, connection: TcpConnection) -> None:
+        if not connection.out_buf:
+            # write the whole backlog of queued messages with a single send
+            connection.out_buf += connection.outbound_queue.get_nowait()
+            self.resume_senders(connection)
+        if connection.out_buf:
+            try:
+                sent = connection.sock.send(connection.out_buf)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.close(connection)
+                return
+            del connection.out_buf[:sent]
+            bytes_sent["tcp"].inc(sent)
+        self.update_events(connection)
+
+    def update_events(self, connection: TcpConnection) -> None:
+        events = 0 if connection.paused_by else selectors.EVENT_READ
+        if connection.out_buf:
+            events |= selectors.EVENT_WRITE
+        try:
+            registered = self.selector.get_key(connection.sock).events
+        except KeyError:
+            registered = 0
+        if events == registered:
+            return
+        if not events:
+            # a paused connection with nothing left to write is not watched at all
+            self.selector.unregister(connection.sock)
+        elif not registered:
+            self.selector.register(connection.sock, events, connection)
+        else:
+            self.selector.modify(connection.sock, events, connection)
+
+    def pause(self, sender: TcpConnection, recipient: TcpConnection) -> None:
+        # stop reading from the sender until the recipient's queue drains
+        sender.paused_by.add(recipient)
+        recipient.paused_senders.add(sender)
+        self.update_events(sender)
+
+    def resume_senders(self, connection: TcpConnection) -> None:
+        for sender in connection.paused_senders:
+            sender.paused_by.discard(connection)
+            if not sender.paused_by and sender.sock.fileno() != -1:
+                self.update_events(sender)
+        connection.paused_senders.clear()
+
+    def evict_stale_connections(self) -> None:
+        if stale_connections := self.tcp_peers.expire():
+            for connection in stale_connections:
+                self.close(connection)
+            peers_evicted["tcp"].inc(len(stale_connections))
+            log.event(f"Evicted {len(stale_connections)} TCP clients without heartbeats.")
+
+    def close(self, connection: TcpConnection) -> None:
+        if connection.sock.fileno() == -1:
+            return
+        self.tcp_peers.discard(connection)
+        try:
+            self.selector.unregister(connection.sock)
+        except KeyError:
+            pass
+        connection.sock.close()
+        self.admission.release()
+        connection.outbound_queue.close()
+        self.tcp_clients.leave(connection)
+        self.resume_senders(connection)
+        for recipient in connection.paused_by:
+            recipient.paused_senders.discard(connection)
+        connection.paused_by.clear()
+
@@ -0,0 +1,57 @@
+import struct
+
+from typing import Iterable, List, Tuple
+
+from constants import MAX_FRAME_SIZE, FRAME_INIT, FRAMING_VERSION
+
+# every frame is: 4-byte big-endian payload length, 1-byte frame type, payload
+FRAME_HEADER: struct.Struct = struct.Struct("!IB")
+
+Frame = Tuple[int, bytes]
+
+
+def is_framed(first_chunk: bytes) -> bool:
+    # frames are far smaller than 16 MiB, so a framed stream always starts with a zero byte,
+    # which never starts the legacy text protocol
+    return first_chunk[:1] == b"\x00"
+
+
+def encode_frame(frame_type: int, payload: bytes = b"") -> bytes:
+    return FRAME_HEADER.pack(len(payload), frame_type) + payload
+
+
+def encode_frames(frames: Iterable[Frame]) -> bytes:
+    # many frames in one buffer, so that a single sendall writes all of them
+    return b"".join(encode_frame(frame_type, payload) for frame_type, payload in frames)
+
+
+def encode_init_frame(flags: int = 0) -> bytes:
+    # the flags ask for, or acknowledge, optional features; peers without any send the version alone,
+    # like the first version of the protocol did
+    return encode_frame(FRAME_INIT, bytes((FRAMING_VERSION, flags)) if flags else bytes((FRAMING_VERSION,)))
+
+
+def init_flags(payload: bytes) -> int:
+    return payload[1] if len(payload) > 1 else 0
+
+
+# streaming decoder, accepts arbitrary chunks of the TCP stream and returns every complete frame
+class FrameDecoder:
+    def __init__(self) -> None:
+        self.buf = bytearray()
+
+    def feed(self, data: bytes) -> List[Frame]:
+        self.buf += data
+        frames: List[Frame] = []
+        offset = 0
+        while len(self.buf) - offset >= FRAME_HEADER.size:
+            length, frame_type = FRAME_HEADER.unpack_from(self.buf, offset)
+            if length > MAX_FRAME_SIZE:
+                raise ValueError(f"Frame of {length} bytes exceeds the limit of {MAX_FRAME_SIZE} bytes")
+            end = offset + FRAME_HEADER.size + length
+            if len(self.buf) < end:
+                break
+            frames.append((frame_type, bytes(self.buf[offset + FRAME_HEADER.size:end])))
+            offset = end
+        del self.buf[:offset]
+        return frames
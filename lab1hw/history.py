@@ -0,0 +1,95 @@
+from array import array
+from collections import OrderedDict
+
+from constants import FRAME_CHAT
+from framing import FRAME_HEADER
+from metrics import registry
+
+history_skipped = registry.counter(
+    "lab1hw_history_skipped_messages_total", "messages too long for a history slot, left out of the history"
+)
+
+
+# the last messages of one room in a ring of fixed-size slots, all of them in a single bytearray
+# allocated up front; storing a message copies it into its slot, no Python object is kept per message
+class RoomHistory:
+    def __init__(self, slots: int, slot_size: int) -> None:
+        self.slots = slots
+        self.slot_size = slot_size
+        self.buffer = bytearray(slots * slot_size)
+        self.view = memoryview(self.buffer)
+        self.lengths = array("I", [0]) * slots
+        # the slot the next message goes to, and how many slots hold a message
+        self.next = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def clear(self) -> None:
+        self.next = 0
+        self.count = 0
+
+    def append(self, message) -> None:
+        if len(message) > self.slot_size:
+            history_skipped.inc()
+            return
+        start = self.next * self.slot_size
+        self.view[start:start + len(message)] = message
+        self.lengths[self.next] = len(message)
+        self.next = (self.next + 1) % self.slots
+        self.count = min(self.count + 1, self.slots)
+
+    def replay(self) -> bytearray:
+        # every stored message as a chat frame, oldest first, in one buffer for a single write
+        first = (self.next - self.count) % self.slots
+        order = [(first + i) % self.slots for i in range(self.count)]
+        frames = bytearray(sum(self.lengths[slot] for slot in order) + FRAME_HEADER.size * self.count)
+        offset = 0
+        for slot in order:
+            length = self.lengths[slot]
+            FRAME_HEADER.pack_into(frames, offset, length, FRAME_CHAT)
+            offset += FRAME_HEADER.size
+            frames[offset:offset + length] = self.view[slot * self.slot_size:slot * self.slot_size + length]
+            offset += length
+        return frames
+
+
+def room_history_memory(slots: int, slot_size: int) -> int:
+    return slots * slot_size + array("I").itemsize * slots
+
+
+# per-room histories under a memory cap: at most memory_cap // room buffer size rooms keep a history,
+# a room that needs one beyond that takes over the buffer of the room that was written to the longest ago
+class HistoryStore:
+    def __init__(self, slots: int, slot_size: int, memory_cap: int) -> None:
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_rooms = memory_cap // room_history_memory(slots, slot_size) if slots else 0
+        self.rooms: "OrderedDict[str, RoomHistory]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def append(self, room: str, message) -> None:
+        if not self.max_rooms:
+            return
+        if (history := self.rooms.get(room)) is None:
+            if len(self.rooms) < self.max_rooms:
+                history = RoomHistory(self.slots, self.slot_size)
+            else:
+                _, history = self.rooms.popitem(last=False)
+                history.clear()
+            self.rooms[room] = history
+        else:
+            self.rooms.move_to_end(room)
+        history.append(message)
+
+    def replay(self, room: str) -> bytearray:
+        if (history := self.rooms.get(room)) is None:
+            return bytearray()
+        return history.replay()
+
+    def memory(self) -> int:
+        # every room's history has the same size, so this is safe to read from another thread
+        return len(self.rooms) * room_history_memory(self.slots, self.slot_size)
@@ -0,0 +1,327 @@
+import sys
+import time
+import asyncio
+import argparse
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from constants import MAX_BUF_SIZE, ENCODING
+from chat_client import TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORT_MULTICAST, ChatClient
+
+TRANSPORTS = (TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORT_MULTICAST)
+
+# every load message is "<nick>:<sequence number> <scheduled send time in ns> <padding>"
+LOAD_NICK_PREFIX = "load"
+# histogram buckets below 2 ** SUB_BUCKET_BITS ns are exact, above that they keep SUB_BUCKET_BITS - 1 significant bits
+SUB_BUCKET_BITS = 7
+TCP_CONNECT_BATCH_SIZE = 100
+UDP_SETUP_BATCH_SIZE = 32
+UDP_SETUP_PAUSE = 0.005
+# how often the drain checks whether every expected delivery has arrived
+DRAIN_CHECK_INTERVAL = 0.01
+
+
+# log-linear latency histogram, constant memory no matter how many samples it holds and ~1.5% relative error
+class LatencyHistogram:
+    def __init__(self) -> None:
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.max = 0
+
+    @staticmethod
+    def bucket(value: int) -> int:
+        if value < 1 << SUB_BUCKET_BITS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+    @staticmethod
+    def bucket_value(bucket: int) -> int:
+        # the highest value that falls into the bucket
+        if bucket < 1 << SUB_BUCKET_BITS:
+            return bucket
+        shift = (bucket >> (SUB_BUCKET_BITS - 1)) - 1
+        return ((bucket - (shift << (SUB_BUCKET_BITS - 1)) + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        value = max(value, 0)
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, percentile: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * percentile / 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.bucket_value(bucket), self.max)
+        return self.max
+
+
+@dataclass
+class TransportStats:
+    sent: int = 0
+    # deliveries the room sizes call for, every message should reach every other member of the sender's room
+    expected: int = 0
+    delivered: int = 0
+    errors: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    def loss(self) -> float:
+        return 1 - self.delivered / self.expected if self.expected else 0.0
+
+
+@dataclass(eq=False)
+class LoadClient:
+    transport: str
+    client: ChatClient
+    room: str
+    receiver: Optional[asyncio.Task] = None
+
+
+# headless chat clients built on ChatClient, the same client API client.py and bots use, all of them on one
+# event loop; a TCP load client has only its TCP connection, a UDP one only its UDP socket and a multicast one
+# only the group; each transport sends at its own fixed rate from its clients in turn, the schedule does not
+# depend on how fast the server answers, so a slow server shows up as latency instead of as a lower send rate
+class LoadGenerator:
+    def __init__(self, multicast_address: str, multicast_port: int, room_size: int, message_size: int) -> None:
+        self.multicast_address = multicast_address
+        self.multicast_port = multicast_port
+        self.room_size = room_size
+        self.message_size = message_size
+        self.clients: Dict[str, List[LoadClient]] = {transport: [] for transport in TRANSPORTS}
+        self.room_members: Dict[str, Dict[str, int]] = {transport: {} for transport in TRANSPORTS}
+        self.stats: Dict[str, TransportStats] = {transport: TransportStats() for transport in TRANSPORTS}
+        self.rooms_by_nick: Dict[bytes, str] = {}
+        self.measuring = False
+        self.closing = False
+        # set when the server drops a client, the run stops with it
+        self.error: Optional[Exception] = None
+
+    async def connect(self, tcp_clients: int, udp_clients: int, multicast_clients: int, timeout: float) -> None:
+        for i in range(tcp_clients):
+            self.add_client(TRANSPORT_TCP, i, ChatClient(f"{LOAD_NICK_PREFIX}-tcp-{i}", udp=False))
+        for i in range(udp_clients):
+            self.add_client(TRANSPORT_UDP, i, ChatClient(f"{LOAD_NICK_PREFIX}-udp-{i}", tcp=False))
+        for i in range(multicast_clients):
+            self.add_client(TRANSPORT_MULTICAST, i, ChatClient(
+                f"{LOAD_NICK_PREFIX}-multicast-{i}", self.multicast_address, self.multicast_port, tcp=False, udp=False
+            ))
+        # the server acknowledges every framed INIT, UDP and multicast have no handshake
+        try:
+            await asyncio.wait_for(self.connect_clients(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Server did not acknowledge every TCP client.") from None
+        for clients in self.clients.values():
+            for load_client in clients:
+                load_client.receiver = asyncio.create_task(self.receive(load_client))
+
+    async def connect_clients(self) -> None:
+        tcp_clients = self.clients[TRANSPORT_TCP]
+        # connecting in batches keeps the server's accept queue from overflowing
+        for first in range(0, len(tcp_clients), TCP_CONNECT_BATCH_SIZE):
+            await asyncio.gather(*(c.client.connect() for c in tcp_clients[first:first + TCP_CONNECT_BATCH_SIZE]))
+        for load_client in tcp_clients:
+            await load_client.client.join(load_client.room)
+        for i, load_client in enumerate(self.clients[TRANSPORT_UDP]):
+            await load_client.client.connect()
+            await load_client.client.join(load_client.room)
+            # a lost INIT or join datagram would leave the client out of its room, so the server gets
+            # time to take them from its socket buffer
+            if i % UDP_SETUP_BATCH_SIZE == UDP_SETUP_BATCH_SIZE - 1:
+                await asyncio.sleep(UDP_SETUP_PAUSE)
+        for load_client in self.clients[TRANSPORT_MULTICAST]:
+            await load_client.client.connect()
+
+    def add_client(self, transport: str, i: int, client: ChatClient) -> None:
+        # the whole multicast group is one room, there is no server in between
+        room = self.multicast_address if transport == TRANSPORT_MULTICAST else \
+            f"{LOAD_NICK_PREFIX}-{transport}-{i // self.room_size}"
+        members = self.room_members[transport]
+        members[room] = members.get(room, 0) + 1
+        self.clients[transport].append(LoadClient(transport, client, room))
+        self.rooms_by_nick[bytes(client.nick, ENCODING)] = room
+
+    async def run(self, rates: Dict[str, float], duration: float, drain: float) -> None:
+        senders = {transport: 0 for transport in TRANSPORTS}
+        sequences = {transport: 0 for transport in TRANSPORTS}
+        active = [t for t in TRANSPORTS if rates.get(t, 0) > 0 and self.clients[t]]
+        self.measuring = True
+        start = time.perf_counter_ns()
+        end = start + int(duration * 1e9)
+        # the clients send their own heartbeats, a long run does not get its idle receivers evicted
+        while (now := time.perf_counter_ns()) < end:
+            if self.error:
+                raise self.error
+            next_send = end
+            for transport in active:
+                interval = int(1e9 / rates[transport])
+                # messages that are already due go out now, stamped with the time they were due
+                while (scheduled := start + sequences[transport] * interval) <= now:
+                    clients = self.clients[transport]
+                    await self.send_message(clients[senders[transport]], sequences[transport], scheduled)
+                    senders[transport] = (senders[transport] + 1) % len(clients)
+                    sequences[transport] += 1
+                next_send = min(next_send, start + sequences[transport] * interval)
+            await asyncio.sleep(max(0, next_send - time.perf_counter_ns()) / 1e9)
+
+        deadline = time.monotonic() + drain
+        while (remaining := deadline - time.monotonic()) > 0 and any(
+                stats.delivered < stats.expected for stats in self.stats.values()):
+            await asyncio.sleep(min(remaining, DRAIN_CHECK_INTERVAL))
+        self.measuring = False
+
+    async def send_message(self, load_client: LoadClient, sequence: int, scheduled: int) -> None:
+        stats = self.stats[load_client.transport]
+        client = load_client.client
+        text = f"{sequence} {scheduled} "
+        text += "x" * max(0, self.message_size - len(client.nick) - 1 - len(text))
+        stats.sent += 1
+        stats.expected += self.room_members[load_client.transport][load_client.room] - 1
+        try:
+            # a TCP send only waits while the server reads slower than the generator writes, the later messages
+            # keep the times they were due at
+            if load_client.transport == TRANSPORT_TCP:
+                await client.send(text)
+            elif load_client.transport == TRANSPORT_UDP:
+                await client.send_udp(text)
+            else:
+                await client.send_multicast(text)
+        except OSError:
+            stats.errors += 1
+
+    async def receive(self, load_client: LoadClient) -> None:
+        async for message in load_client.client:
+            self.record(load_client, message.data)
+        if not self.closing and load_client.transport == TRANSPORT_TCP:
+            self.error = ConnectionError(f"Server closed the connection of {load_client.client.nick}.")
+
+    def record(self, load_client: LoadClient, message: bytes) -> None:
+        now = time.perf_counter_ns()
+        nick, _, payload = message.partition(b":")
+        # ChatClient already skips its own multicast messages, one from another room does not count either
+        if not self.measuring or self.rooms_by_nick.get(nick) != load_client.room:
+            return
+        try:
+            _, scheduled, _ = payload.split(b" ", 2)
+            latency = now - int(scheduled)
+        except ValueError:
+            return
+        stats = self.stats[load_client.transport]
+        stats.delivered += 1
+        stats.latency.record(latency)
+
+    async def close(self) -> None:
+        self.closing = True
+        for clients in self.clients.values():
+            for load_client in clients:
+                await load_client.client.close()
+        await asyncio.gather(*(c.receiver for clients in self.clients.values() for c in clients if c.receiver))
+
+
+def print_report(stats: Dict[str, TransportStats], duration: float, label: str = "") -> None:
+    for transport in TRANSPORTS:
+        transport_stats = stats[transport]
+        if not transport_stats.sent:
+            continue
+        latency = transport_stats.latency
+        print(
+            f"{label:>10} {transport:>10} {transport_stats.sent / duration:>10.0f} "
+            f"{transport_stats.delivered / duration:>12.0f} {transport_stats.loss() * 100:>7.2f} "
+            f"{latency.percentile(50) / 1e6:>9.3f} {latency.percentile(99) / 1e6:>9.3f} "
+            f"{latency.percentile(99.9) / 1e6:>9.3f} {latency.max / 1e6:>9.3f}"
+        )
+
+
+def print_report_header() -> None:
+    print(
+        f"{'':>10} {'transport':>10} {'sent/s':>10} {'delivered/s':>12} {'loss %':>7} "
+        f"{'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'max ms':>9}"
+    )
+
+
+def raise_open_files_limit(needed: int) -> None:
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def generate_load(generator: LoadGenerator, args: argparse.Namespace) -> None:
+    try:
+        await generator.connect(args.tcp_clients, args.udp_clients, args.multicast_clients, args.connect_timeout)
+        # let the server handle every join before the first message
+        await asyncio.sleep(args.settle)
+        await generator.run(
+            {TRANSPORT_TCP: args.tcp_rate, TRANSPORT_UDP: args.udp_rate, TRANSPORT_MULTICAST: args.multicast_rate},
+            args.duration, args.drain
+        )
+    finally:
+        await generator.close()
+
+
+def run_load(args: argparse.Namespace, label: str = "") -> Dict[str, TransportStats]:
+    raise_open_files_limit(args.tcp_clients + args.udp_clients + args.multicast_clients + 64)
+    generator = LoadGenerator(args.multicast_address, args.multicast_port, args.room_size, args.message_size)
+    asyncio.run(generate_load(generator, args))
+    print_report(generator.stats, args.duration, label=label)
+    return generator.stats
+
+
+def add_load_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--tcp-clients", type=int, default=1000)
+    parser.add_argument("--udp-clients", type=int, default=1000)
+    parser.add_argument("--multicast-clients", type=int, default=10)
+    parser.add_argument(
+        "--room-size", type=int, default=10, help="clients of a transport are split into rooms of this many"
+    )
+    parser.add_argument("--tcp-rate", type=float, default=1000, help="TCP messages sent per second")
+    parser.add_argument("--udp-rate", type=float, default=1000, help="UDP datagrams sent per second")
+    parser.add_argument("--multicast-rate", type=float, default=100, help="multicast datagrams sent per second")
+    parser.add_argument("--message-size", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--settle", type=float, default=1.0, help="pause between joining and the first message")
+    parser.add_argument("--drain", type=float, default=2.0, help="how long to wait for late deliveries")
+    parser.add_argument("--connect-timeout", type=float, default=10.0)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Headless load generator for a running lab1hw chat server, speaks the framed TCP protocol."
+    )
+    parser.add_argument("multicast_address")
+    parser.add_argument("multicast_port", type=int)
+    add_load_arguments(parser)
+    args = parser.parse_args()
+    if args.message_size > MAX_BUF_SIZE and (args.udp_rate or args.multicast_rate):
+        parser.error(f"datagrams cannot be longer than {MAX_BUF_SIZE} bytes, the server reads no more")
+    if args.room_size < 2:
+        parser.error("--room-size must be at least 2, a message has to reach somebody")
+    return args
+
+
+def main() -> int:
+    args = parse_args()
+    print_report_header()
+    try:
+        run_load(args)
+    except (OSError, TimeoutError) as e:
+        print(f"Load generator failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import sys
+
+from collections import deque
+from threading import Thread, Condition
+from typing import Deque, Optional, TextIO
+
+# keep one per-message line out of this many, 1 keeps all of them and 0 none
+DEFAULT_LOG_SAMPLE: int = 1
+# lines waiting for the writer, further lines are dropped and counted instead of growing the queue
+DEFAULT_LOG_QUEUE_SIZE: int = 10000
+
+
+# hot paths only append a line to a bounded queue, a background thread writes whatever has queued up
+# with a single write and flush; connection events are always logged, per-message lines are sampled
+# and formatted only when kept
+class MessageLog:
+    def __init__(self, sample: int = DEFAULT_LOG_SAMPLE, max_size: int = DEFAULT_LOG_QUEUE_SIZE) -> None:
+        self.sample = sample
+        self.max_size = max_size
+        self.output: TextIO = sys.stdout
+        self.lines: Deque[str] = deque()
+        self.condition = Condition()
+        self.seen = 0
+        self.writing = False
+        self.dropped = 0
+        self.reported_drops = 0
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def start(self, sample: int, path: Optional[str] = None, max_size: int = DEFAULT_LOG_QUEUE_SIZE) -> None:
+        # started by every process itself, a writer thread would not survive a fork
+        self.sample = sample
+        self.max_size = max_size
+        if path:
+            self.output = open(path, "a", buffering=1 << 16)
+        Thread(target=self.write_lines, daemon=True).start()
+
+    def event(self, line: str) -> None:
+        with self.condition:
+            if len(self.lines) >= self.max_size:
+                self.dropped += 1
+                return
+            self.lines.append(line)
+            if len(self.lines) == 1:
+                self.condition.notify_all()
+
+    def sampled(self) -> bool:
+        # whether the next per-message line is kept, callers build the line only when it is
+        if self.sample <= 1:
+            return self.sample == 1
+        with self.condition:
+            self.seen += 1
+            if self.seen < self.sample:
+                return False
+            self.seen = 0
+        return True
+
+    def message(self, line_format: str, *args) -> None:
+        if self.sampled():
+            self.event(line_format.format(*args))
+
+    def write_lines(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.lines)
+                lines = list(self.lines)
+                self.lines.clear()
+                self.writing = True
+                if self.dropped > self.reported_drops:
+                    lines.append(f"Dropped {self.dropped - self.reported_drops} log lines, {self.dropped} in total.")
+                    self.reported_drops = self.dropped
+            try:
+                self.output.write("\n".join(lines) + "\n")
+                self.output.flush()
+            except (OSError, ValueError):
+                # stdout is gone or closed, there is nobody left to log to
+                pass
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def flush(self, timeout: float = 1.0) -> None:
+        # waits until the writer has written everything queued so far, used before the process exits
+        with self.condition:
+            self.condition.wait_for(lambda: not self.lines and not self.writing, timeout)
+
+
+log = MessageLog()
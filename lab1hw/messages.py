@@ -0,0 +1,50 @@
+import re
+
+from typing import Optional, Tuple, Union
+
+from constants import ENCODING, INIT_MSG, JOIN_COMMAND, MAX_ROOM_NAME_SIZE
+
+# chat messages are "nick:payload" and are relayed as the sender's own bytes, never decoded on the way;
+# the parsers take bytes or memoryviews of a receive buffer alike and copy nothing unless they match
+Buffer = Union[bytes, bytearray, memoryview]
+
+INIT_MSG_BYTES = bytes(INIT_MSG, ENCODING)
+NICK_SEPARATOR = b":"
+NICK_SEPARATOR_PATTERN = re.compile(re.escape(NICK_SEPARATOR))
+# "nick:/join <room>" switches the sender to another room
+JOIN_COMMAND_PATTERN = re.compile(rb"[^:]*:" + re.escape(bytes(JOIN_COMMAND, ENCODING)) + rb"(.*)", re.DOTALL)
+
+
+def nick_end(message: Buffer) -> int:
+    # index of the separator after the nick, -1 when there is none
+    match = NICK_SEPARATOR_PATTERN.search(message)
+    return match.start() if match else -1
+
+
+def parse_join_command(message: Buffer) -> Optional[str]:
+    if (match := JOIN_COMMAND_PATTERN.match(message)) is None:
+        return None
+    room = match.group(1).strip()
+    if len(room) > MAX_ROOM_NAME_SIZE:
+        return None
+    try:
+        return room.decode(ENCODING) if room else None
+    except UnicodeDecodeError:
+        # not a room name, the message is relayed like any other
+        return None
+
+
+def relayed_message(message: Buffer) -> Buffer:
+    # what the recipients get, "nick:payload" is passed on as it is; a message without a nick
+    # is relayed as a nick with an empty payload, like it always was
+    if nick_end(message) < 0:
+        return bytes(message) + NICK_SEPARATOR
+    return message
+
+
+def split_message(message: Buffer) -> Tuple[str, str]:
+    # only for logging, a malformed sequence must not cost the relay its message
+    end = nick_end(message)
+    if end < 0:
+        return str(message, ENCODING, "replace"), ""
+    return str(message[:end], ENCODING, "replace"), str(message[end + 1:], ENCODING, "replace")
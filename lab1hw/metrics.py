@@ -0,0 +1,209 @@
+import time
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from typing import Callable, Dict, List, Tuple
+
+from constants import IP, ENCODING
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# seconds, from a microsecond lock wait to a multi-second stall
+DURATION_BUCKETS: Tuple[float, ...] = (
+    1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0
+)
+
+
+def format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, labels: Labels) -> None:
+        self.labels = labels
+        self.lock = Lock()
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name: str) -> List[str]:
+        return [f"{name}{format_labels(self.labels)} {self.value}"]
+
+
+# read when scraped, so keeping it up to date costs the hot path nothing
+class Gauge:
+    def __init__(self, labels: Labels, read: Callable[[], float]) -> None:
+        self.labels = labels
+        self.read = read
+
+    def samples(self, name: str) -> List[str]:
+        return [f"{name}{format_labels(self.labels)} {self.read()}"]
+
+
+class Histogram:
+    def __init__(self, labels: Labels, buckets: Tuple[float, ...]) -> None:
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = Lock()
+        # the last count is for observations above the highest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name: str) -> List[str]:
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples.append(f"{name}_bucket{format_labels(self.labels, (('le', le),))} {cumulative}")
+        samples.append(f"{name}_sum{format_labels(self.labels)} {total}")
+        samples.append(f"{name}_count{format_labels(self.labels)} {count}")
+        return samples
+
+
+# process-wide metrics, rendered in the Prometheus text format; a metric name may have several
+# label sets, every one of them is registered once and then updated without any lookup
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.metrics: Dict[str, Tuple[str, str, List]] = {}
+
+    def register(self, name: str, kind: str, help_text: str, metric):
+        with self.lock:
+            self.metrics.setdefault(name, (kind, help_text, []))[2].append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, **labels: str) -> Counter:
+        return self.register(name, "counter", help_text, Counter(tuple(labels.items())))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float], **labels: str) -> Gauge:
+        return self.register(name, "gauge", help_text, Gauge(tuple(labels.items()), read))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DURATION_BUCKETS,
+                  **labels: str) -> Histogram:
+        return self.register(name, "histogram", help_text, Histogram(tuple(labels.items()), buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = [(name, kind, help_text, list(members))
+                       for name, (kind, help_text, members) in self.metrics.items()]
+        lines = []
+        for name, kind, help_text, members in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in members:
+                lines.extend(metric.samples(name))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+# a lock that records how long every acquire had to wait
+class TimedLock:
+    def __init__(self, wait: Histogram) -> None:
+        self.lock = Lock()
+        self.wait = wait
+
+    def __enter__(self) -> "TimedLock":
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.wait.observe(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.lock.release()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = bytes(registry.render(), ENCODING)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # scrapes are not worth a line each
+        pass
+
+
+def serve_metrics(port: int) -> Thread:
+    # GET http://IP:port/metrics, scraping never touches the chat sockets
+    server = ThreadingHTTPServer((IP, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+# chat server metrics, shared by the thread pool and the event loop modes
+tcp_connections_accepted = registry.counter(
+    "lab1hw_tcp_connections_accepted_total", "TCP connections accepted"
+)
+bytes_received = {
+    transport: registry.counter("lab1hw_received_bytes_total", "bytes read from clients", transport=transport)
+    for transport in ("tcp", "udp", "multicast")
+}
+bytes_sent = {
+    transport: registry.counter("lab1hw_sent_bytes_total", "bytes written to clients", transport=transport)
+    for transport in ("tcp", "udp")
+}
+messages_relayed = {
+    transport: registry.counter("lab1hw_relayed_messages_total", "chat messages relayed", transport=transport)
+    for transport in ("tcp", "udp")
+}
+fan_out_duration = {
+    transport: registry.histogram(
+        "lab1hw_fan_out_seconds", "time to hand one message to every recipient of its room", transport=transport
+    )
+    for transport in ("tcp", "udp")
+}
+outbound_dropped = registry.counter(
+    "lab1hw_outbound_dropped_messages_total", "messages dropped from full TCP outbound queues"
+)
+peers_evicted = {
+    transport: registry.counter(
+        "lab1hw_evicted_peers_total", "peers evicted after missing their heartbeats", transport=transport
+    )
+    for transport in ("tcp", "udp")
+}
+udp_dropped = {
+    socket_name: registry.counter(
+        "lab1hw_udp_dropped_datagrams_total", "datagrams the kernel dropped from a full receive buffer",
+        socket=socket_name
+    )
+    for socket_name in ("unicast", "multicast")
+}
+tcp_connections_rejected = {
+    reason: registry.counter(
+        "lab1hw_tcp_connections_rejected_total", "TCP connections closed right after accept", reason=reason
+    )
+    for reason in ("capacity", "rate")
+}
+messages_rate_limited = {
+    scope: registry.counter(
+        "lab1hw_rate_limited_messages_total", "TCP messages dropped by a rate limit", scope=scope
+    )
+    for scope in ("client", "ip", "global")
+}
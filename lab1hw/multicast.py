@@ -0,0 +1,222 @@
+import time
+import random
+import struct
+
+from collections import OrderedDict
+from threading import Thread, Lock
+from typing import Callable, Dict, List
+
+from chunking import CHUNK_HEADER, Buffer, ChunkChannel
+from constants import (
+    MAX_BUF_SIZE, MULTICAST_RETRANSMIT_WINDOW, MULTICAST_REORDER_WINDOW, MULTICAST_NACK_DELAY, MULTICAST_MAX_NACKS,
+    MULTICAST_REPAIR_TIMEOUT, MULTICAST_SESSION_INTERVAL, MULTICAST_SESSION_REPEATS, MULTICAST_SENDER_TIMEOUT
+)
+from metrics import registry
+from udp_batch import Address
+
+# a sequenced message is: zero byte, kind, sender id, sequence number, payload; it always goes through the
+# chunk channel, which chunks every message starting with a zero byte, so plain chat datagrams are unchanged
+SEQUENCE_HEADER: struct.Struct = struct.Struct("!BBII")
+SEQUENCE_DATA = 1
+# a NACK names the sender whose messages are missing, then lists their sequence numbers
+SEQUENCE_NACK = 2
+# for a while after sending, senders announce their last sequence number, so that a lost last message is noticed
+SEQUENCE_SESSION = 3
+SEQUENCE_NUMBER: struct.Struct = struct.Struct("!I")
+
+MAX_NACK_SEQUENCES = (MAX_BUF_SIZE - CHUNK_HEADER.size - SEQUENCE_HEADER.size) // SEQUENCE_NUMBER.size
+# how often gaps are NACKed or given up and sessions announced
+TICK_INTERVAL = 0.02
+
+multicast_events = {
+    event: registry.counter("lab1hw_multicast_events_total", "reliable multicast events", event=event)
+    for event in (
+        "sent", "delivered", "duplicate", "gap", "repaired", "lost", "nack_sent", "retransmitted", "session_sent"
+    )
+}
+
+
+def multicast_stats() -> Dict[str, int]:
+    return {event: counter.value for event, counter in multicast_events.items()}
+
+
+# what a receiver knows about one sender; every sequence number from next up to highest is either
+# waiting in pending for the ones before it, or missing
+class SenderState:
+    def __init__(self, next_sequence: int) -> None:
+        self.next = next_sequence
+        self.highest = next_sequence - 1
+        self.pending: Dict[int, bytes] = {}
+        self.gap_since = 0.0
+        self.nacks = 0
+        self.last_heard = time.monotonic()
+
+    def missing(self) -> List[int]:
+        return [s for s in range(self.next, self.highest + 1) if s not in self.pending][:MAX_NACK_SEQUENCES]
+
+
+# per-sender ordering, duplicate suppression and NACK repair for the multicast group: with reliable on, messages
+# carry the sender's sequence numbers and stay in a retransmit buffer of the last MULTICAST_RETRANSMIT_WINDOW;
+# receivers deliver every sender's messages in order, NACK the gaps to the group and give a gap up after
+# MULTICAST_REPAIR_TIMEOUT; messages without a sequence number are delivered as they come, like before
+class ReliableMulticast:
+    def __init__(self, chunks: ChunkChannel, group: Address, reliable: bool,
+                 deliver: Callable[[Buffer], None]) -> None:
+        self.chunks = chunks
+        self.group = group
+        self.reliable = reliable
+        self.deliver = deliver
+        # deliveries happen under the lock too, so that the receiver and the timer thread keep them in order
+        self.lock = Lock()
+        self.sender_id = random.getrandbits(32)
+        self.next_sequence = 0
+        self.sent: "OrderedDict[int, bytes]" = OrderedDict()
+        # when a message was last retransmitted, NACKs of several receivers for it cost one retransmission
+        self.retransmitted: Dict[int, float] = {}
+        self.sessions = MULTICAST_SESSION_REPEATS
+        self.last_session = 0.0
+        self.senders: Dict[int, SenderState] = {}
+
+    def start(self) -> None:
+        Thread(target=self.tick_forever, daemon=True).start()
+
+    def send(self, message: Buffer) -> None:
+        if not self.reliable:
+            self.chunks.send(message, self.group)
+            return
+        with self.lock:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            data = SEQUENCE_HEADER.pack(0, SEQUENCE_DATA, self.sender_id, sequence) + message
+            self.sent[sequence] = data
+            if len(self.sent) > MULTICAST_RETRANSMIT_WINDOW:
+                old_sequence, _ = self.sent.popitem(last=False)
+                self.retransmitted.pop(old_sequence, None)
+            self.sessions = 0
+        self.chunks.send(data, self.group)
+        multicast_events["sent"].inc()
+
+    def receive(self, datagram: Buffer, address: Address) -> None:
+        if (message := self.chunks.receive(datagram, address)) is None:
+            return
+        if len(message) < SEQUENCE_HEADER.size or message[0] != 0:
+            self.deliver(message)
+            return
+        _, kind, sender_id, sequence = SEQUENCE_HEADER.unpack_from(message)
+        if kind == SEQUENCE_NACK:
+            if sender_id == self.sender_id:
+                self.answer_nack(message)
+            return
+        if sender_id == self.sender_id or kind not in (SEQUENCE_DATA, SEQUENCE_SESSION):
+            return
+
+        with self.lock:
+            if (state := self.senders.get(sender_id)) is None:
+                # a new sender, or one this receiver joined late: its history is not recovered
+                state = self.senders[sender_id] = SenderState(sequence if kind == SEQUENCE_DATA else sequence + 1)
+            state.last_heard = time.monotonic()
+            if kind == SEQUENCE_SESSION:
+                self.heard_of(state, sequence)
+                return
+            if sequence < state.next or sequence in state.pending:
+                multicast_events["duplicate"].inc()
+                return
+            if sequence < state.highest and state.nacks:
+                multicast_events["repaired"].inc()
+            self.heard_of(state, sequence - 1)
+            state.highest = max(state.highest, sequence)
+            # the payload is copied out of the reassembly or receive buffer only if it has to wait
+            state.pending[sequence] = bytes(message[SEQUENCE_HEADER.size:]) if sequence != state.next \
+                else message[SEQUENCE_HEADER.size:]
+            self.deliver_ready(state)
+
+    def heard_of(self, state: SenderState, sequence: int) -> None:
+        # the sender has sent everything up to sequence, a gap opens if some of it did not arrive
+        if sequence > state.highest:
+            if state.highest < state.next:
+                state.gap_since = time.monotonic()
+                state.nacks = 0
+            state.highest = sequence
+            multicast_events["gap"].inc()
+            if state.highest >= state.next + MULTICAST_REORDER_WINDOW:
+                self.skip_to(state, state.highest - MULTICAST_REORDER_WINDOW + 1)
+
+    def deliver_ready(self, state: SenderState) -> None:
+        delivered = False
+        while (message := state.pending.pop(state.next, None)) is not None:
+            state.next += 1
+            delivered = True
+            multicast_events["delivered"].inc()
+            self.deliver(message)
+        if delivered and state.highest >= state.next:
+            # the next gap is given its own time to be repaired
+            state.gap_since = time.monotonic()
+            state.nacks = 0
+
+    def skip_to(self, state: SenderState, sequence: int) -> None:
+        # gives up on whatever is still missing before sequence, the messages waiting behind it go out
+        skipped = sequence - state.next
+        for waiting in sorted(s for s in state.pending if s < sequence):
+            skipped -= 1
+            multicast_events["delivered"].inc()
+            self.deliver(state.pending.pop(waiting))
+        multicast_events["lost"].inc(skipped)
+        state.next = sequence
+        state.gap_since = time.monotonic()
+        state.nacks = 0
+
+    def answer_nack(self, nack: Buffer) -> None:
+        now = time.monotonic()
+        retransmit = []
+        with self.lock:
+            for offset in range(SEQUENCE_HEADER.size, len(nack) - SEQUENCE_NUMBER.size + 1, SEQUENCE_NUMBER.size):
+                sequence, = SEQUENCE_NUMBER.unpack_from(nack, offset)
+                if (data := self.sent.get(sequence)) is None:
+                    continue
+                if now - self.retransmitted.get(sequence, 0.0) < MULTICAST_NACK_DELAY:
+                    continue
+                self.retransmitted[sequence] = now
+                retransmit.append(data)
+        for data in retransmit:
+            try:
+                self.chunks.send(data, self.group)
+            except OSError:
+                return
+            multicast_events["retransmitted"].inc()
+
+    def tick(self) -> None:
+        now = time.monotonic()
+        nacks = []
+        with self.lock:
+            for sender_id, state in list(self.senders.items()):
+                if state.highest < state.next:
+                    if now - state.last_heard > MULTICAST_SENDER_TIMEOUT:
+                        del self.senders[sender_id]
+                elif now - state.gap_since > MULTICAST_REPAIR_TIMEOUT:
+                    self.skip_to(state, min(state.pending, default=state.highest + 1))
+                    self.deliver_ready(state)
+                elif self.reliable and state.nacks < MULTICAST_MAX_NACKS and \
+                        now - state.gap_since > MULTICAST_NACK_DELAY * (state.nacks + 1):
+                    state.nacks += 1
+                    nacks.append(SEQUENCE_HEADER.pack(0, SEQUENCE_NACK, sender_id, 0)
+                                 + b"".join(SEQUENCE_NUMBER.pack(s) for s in state.missing()))
+            session = None
+            if self.reliable and self.sessions < MULTICAST_SESSION_REPEATS and \
+                    now - self.last_session > MULTICAST_SESSION_INTERVAL:
+                self.sessions += 1
+                self.last_session = now
+                session = SEQUENCE_HEADER.pack(0, SEQUENCE_SESSION, self.sender_id, self.next_sequence - 1)
+        try:
+            for nack in nacks:
+                self.chunks.send(nack, self.group)
+                multicast_events["nack_sent"].inc()
+            if session:
+                self.chunks.send(session, self.group)
+                multicast_events["session_sent"].inc()
+        except OSError:
+            pass
+
+    def tick_forever(self) -> None:
+        while True:
+            time.sleep(TICK_INTERVAL)
+            self.tick()
@@ -0,0 +1,74 @@
+from collections import deque
+from threading import Condition
+from typing import Deque, Optional
+
+from constants import OVERFLOW_DROP_OLDEST, OVERFLOW_DISCONNECT, OVERFLOW_BACKPRESSURE
+from metrics import outbound_dropped
+
+
+# bounded queue of encoded messages waiting to be written to a single client
+class OutboundQueue:
+    def __init__(self, max_size: int, overflow_policy: str) -> None:
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.messages: Deque[bytes] = deque()
+        self.condition = Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def full(self) -> bool:
+        return len(self.messages) >= self.max_size
+
+    def put(self, data: bytes, block: bool = True) -> bool:
+        # returns False when the client has to be disconnected
+        with self.condition:
+            if self.closed:
+                return False
+            if self.full():
+                if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    self.messages.popleft()
+                    self.dropped += 1
+                    outbound_dropped.inc()
+                elif self.overflow_policy == OVERFLOW_DISCONNECT:
+                    self.close_locked()
+                    return False
+                elif self.overflow_policy == OVERFLOW_BACKPRESSURE and block:
+                    # the sender waits for the writer side instead of the whole room
+                    self.condition.wait_for(lambda: not self.full() or self.closed)
+                    if self.closed:
+                        return False
+                # a non-blocking backpressure put overshoots, the caller pauses the producer
+            self.messages.append(data)
+            self.condition.notify_all()
+            return True
+
+    def get(self) -> Optional[bytes]:
+        # blocks until there is something to write, returns every queued message as one buffer
+        # so that a single sendall covers the whole backlog; None once the queue is closed
+        with self.condition:
+            self.condition.wait_for(lambda: self.messages or self.closed)
+            if self.closed:
+                return None
+            return self.take_locked()
+
+    def get_nowait(self) -> bytes:
+        with self.condition:
+            return self.take_locked()
+
+    def take_locked(self) -> bytes:
+        data = b"".join(self.messages)
+        self.messages.clear()
+        self.condition.notify_all()
+        return data
+
+    def close(self) -> None:
+        with self.condition:
+            self.close_locked()
+
+    def close_locked(self) -> None:
+        self.closed = True
+        self.messages.clear()
+        self.condition.notify_all()
@@ -0,0 +1,54 @@
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+Member = TypeVar("Member", bound=Hashable)
+Members = TypeVar("Members")
+
+
+def ignore_room(room: str) -> None:
+    pass
+
+
+# per-room membership index, a message only has to reach the members of its sender's room;
+# members_factory builds the per-room container (a set, or a UdpFanOut for UDP peers),
+# on_room_opened/on_room_closed are called when a room gets its first member or loses the last one
+class RoomIndex(Generic[Member, Members]):
+    def __init__(self, members_factory: Callable[[], Members]) -> None:
+        self.members_factory = members_factory
+        self.rooms: Dict[str, Members] = {}
+        self.member_rooms: Dict[Member, str] = {}
+        self.on_room_opened: Callable[[str], None] = ignore_room
+        self.on_room_closed: Callable[[str], None] = ignore_room
+
+    def __contains__(self, member: Member) -> bool:
+        return member in self.member_rooms
+
+    def __len__(self) -> int:
+        return len(self.member_rooms)
+
+    def room_of(self, member: Member) -> Optional[str]:
+        return self.member_rooms.get(member)
+
+    def members(self, room: str) -> Members:
+        if (members := self.rooms.get(room)) is None:
+            return self.members_factory()
+        return members
+
+    def join(self, member: Member, room: str) -> Optional[str]:
+        # returns the room the member has left, if any
+        left_room = self.leave(member)
+        if (members := self.rooms.get(room)) is None:
+            members = self.rooms[room] = self.members_factory()
+            self.on_room_opened(room)
+        members.add(member)
+        self.member_rooms[member] = room
+        return left_room
+
+    def leave(self, member: Member) -> Optional[str]:
+        if (room := self.member_rooms.pop(member, None)) is None:
+            return None
+        members = self.rooms[room]
+        members.discard(member)
+        if not len(members):
+            del self.rooms[room]
+            self.on_room_closed(room)
+        return room
@@ -1,82 +1,359 @@
+import os
 import socket
 import signal
 import sys
+import time
 import struct
+import argparse
+import traceback
 
-from threading import Thread, Lock
-from concurrent.futures import ThreadPoolExecutor
-from typing import Set, Tuple
+from threading import Thread
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Optional, Set
 
-from constants import IP, PORT, MAX_BUF_SIZE, MESSAGE, ENCODING, INIT_MSG
+from constants import (
+    IP, PORT, MAX_BUF_SIZE, SERVING_MODE_THREADS, SERVING_MODE_EVENT_LOOP,
+    OVERFLOW_DROP_OLDEST, OVERFLOW_DISCONNECT, OVERFLOW_BACKPRESSURE, DEFAULT_OUTBOUND_QUEUE_SIZE,
+    RECV_BUF_SIZE, FRAME_INIT, FRAME_CHAT, FRAME_LEAVE, UDP_RECV_BATCH_SIZE, DEFAULT_ROOM, DEFAULT_HISTORY_SIZE,
+    DEFAULT_HISTORY_SLOT_SIZE, DEFAULT_HISTORY_MEMORY, PEER_TIMEOUT, TIMER_WHEEL_RESOLUTION, FRAME_COMPRESSED,
+    INIT_FLAG_COMPRESSION, METRICS_LOOP_TIMEOUT
+)
+from admission import AdmissionControl, TokenBucket
+from compression import decode_compressed_frame, encode_compressed_frame
+from chunking import ChunkChannel
+from event_loop import EventLoopTcpServer
+from framing import Frame, FrameDecoder, is_framed, encode_frame, encode_init_frame, init_flags
+from history import HistoryStore
+from logs import DEFAULT_LOG_SAMPLE, log
+from metrics import (
+    TimedLock, registry, serve_metrics, tcp_connections_accepted, bytes_received, bytes_sent, messages_relayed,
+    fan_out_duration, udp_dropped, peers_evicted
+)
+from outbound import OutboundQueue
+from multicast import ReliableMulticast
+from messages import INIT_MSG_BYTES, parse_join_command, relayed_message, split_message
+from rooms import RoomIndex
+from shards import ShardBus, BUS_TCP_MESSAGE, BUS_UDP_MESSAGE, bind_reuse_port
+from timer_wheel import TimerWheel
+from udp_batch import Address, UdpFanOut, DatagramBatchReceiver
 
 
 def signal_handler(sig, frame):
+    log.flush()
     print("\nServer finished.")
     sys.exit(0)
 
 
-tcp_clients: Set[socket.socket] = set()
-tcp_clients_lock = Lock()
-def handle_single_tcp_client(client: socket.socket) -> None:
-    buf: bytes
-    while buf := client.recv(MAX_BUF_SIZE):
-        if (message := buf.decode(ENCODING)) == INIT_MSG:
-            print("New TCP client has connected.")
-            with tcp_clients_lock:
-                tcp_clients.add(client)
-        else:
-            nick, _, payload = message.partition(":")
-            print(f"TCP message from {nick}: {payload}")
+@dataclass(eq=False)
+class TcpClient:
+    sock: socket.socket
+    outbound_queue: OutboundQueue
+    framed: bool = False
+    # negotiated in the INIT frame
+    compressed: bool = False
+    # the peer's IP address and the client's own message rate limit
+    address: str = ""
+    bucket: Optional[TokenBucket] = None
 
-            print("Sending to other clients...")
-            with tcp_clients_lock:
-                for c in tcp_clients:
-                    if c != client:
-                        c.sendall(bytes(MESSAGE.format(nick=nick, message=payload), ENCODING))
 
+# the lock only guards membership changes, messages go through the per-client outbound queues
+tcp_clients: RoomIndex[TcpClient, Set[TcpClient]] = RoomIndex(set)
+tcp_clients_lock = TimedLock(registry.histogram(
+    "lab1hw_lock_wait_seconds", "time spent waiting for a client index lock", lock="tcp_clients"
+))
+# set when the server runs as one of several shards sharing the port
+shard_bus: Optional[ShardBus] = None
+# guarded by tcp_clients_lock, so that a client's replay and the live messages never overlap
+history = HistoryStore(0, DEFAULT_HISTORY_SLOT_SIZE, 0)
+# when every framed TCP client was last heard from; text protocol clients cannot send heartbeats, so only
+# a failing recv or send removes them
+tcp_peers: TimerWheel[TcpClient] = TimerWheel(0, TIMER_WHEEL_RESOLUTION)
+# whether framed clients asking for compression get it
+compression = False
+# connection and message limits of the TCP listener, all off until the server starts
+admission = AdmissionControl(0, 0, 0, 0, 0)
+def handle_single_tcp_client(client: socket.socket, address: str, outbound_queue_size: int,
+                             overflow_policy: str) -> None:
+    tcp_client = TcpClient(
+        client, OutboundQueue(outbound_queue_size, overflow_policy), address=address,
+        bucket=admission.client_bucket()
+    )
+    writer = Thread(target=drain_outbound_queue, args=(tcp_client,), daemon=True)
+    decoder = FrameDecoder()
+    try:
+        buf = client.recv(MAX_BUF_SIZE)
+        bytes_received["tcp"].inc(len(buf))
+        # the first bytes tell whether the client speaks the framed or the legacy text protocol
+        tcp_client.framed = is_framed(buf)
+        while buf:
+            if not tcp_client.framed:
+                if buf == INIT_MSG_BYTES:
+                    register_tcp_client(tcp_client, writer)
+                else:
+                    relay_tcp_message(tcp_client, buf)
+            else:
+                # every frame counts as a heartbeat, heartbeat frames themselves need no handling
+                tcp_peers.touch(tcp_client)
+                if not handle_frames(tcp_client, writer, decoder.feed(buf)):
+                    break
+            buf = client.recv(RECV_BUF_SIZE if tcp_client.framed else MAX_BUF_SIZE)
+            bytes_received["tcp"].inc(len(buf))
+    except (OSError, ValueError):
+        pass
+
+    tcp_peers.discard(tcp_client)
+    with tcp_clients_lock:
+        tcp_clients.leave(tcp_client)
+    tcp_client.outbound_queue.close()
+    disconnect_tcp_client(client)
+    if writer.is_alive():
+        writer.join()
+    client.close()
+    admission.release()
+
+
+def handle_frames(tcp_client: TcpClient, writer: Thread, frames: List[Frame]) -> bool:
+    # returns False once the client has left
+    for frame_type, payload in frames:
+        if frame_type == FRAME_INIT:
+            register_tcp_client(tcp_client, writer, init_flags(payload))
+        elif frame_type == FRAME_CHAT:
+            relay_tcp_message(tcp_client, payload)
+        elif frame_type == FRAME_COMPRESSED:
+            if not handle_frames(tcp_client, writer, decode_compressed_frame(payload)):
+                return False
+        elif frame_type == FRAME_LEAVE:
+            log.event("TCP client has left.")
+            return False
+    return True
+
+
+def register_tcp_client(tcp_client: TcpClient, writer: Thread, flags: int = 0) -> None:
+    log.event("New TCP client has connected.")
+    tcp_client.compressed = compression and bool(flags & INIT_FLAG_COMPRESSION)
+    with tcp_clients_lock:
+        tcp_clients.join(tcp_client, DEFAULT_ROOM)
+        if tcp_client.framed:
+            # the acknowledgement and the room's history go out with one write, before any newer message
+            ack = encode_init_frame(INIT_FLAG_COMPRESSION if tcp_client.compressed else 0)
+            queue_tcp_message(tcp_client, ack + replay_frames(tcp_client, DEFAULT_ROOM))
+    if not writer.is_alive():
+        writer.start()
+
+
+def relay_tcp_message(sender: TcpClient, message: bytes) -> None:
+    # over its rate a message is dropped, the client stays connected
+    if not admission.allow_message(sender.address, sender.bucket):
+        return
+    if (room := parse_join_command(message)) is not None:
+        with tcp_clients_lock:
+            tcp_clients.join(sender, room)
+            if sender.framed and (replay := replay_frames(sender, room)):
+                queue_tcp_message(sender, replay)
+        log.event(f"TCP client has joined room {room}.")
+        return
+
+    if log.sampled():
+        log.event("TCP message from {}: {}\nSending to other clients...".format(*split_message(message)))
+
+    # the sender's bytes go to every recipient as they are, one frame header for the whole room
+    data = relayed_message(message)
+    start = time.perf_counter()
+    with tcp_clients_lock:
+        room = tcp_clients.room_of(sender) or DEFAULT_ROOM
+        recipients = [c for c in tcp_clients.members(room) if c is not sender]
+        history.append(room, data)
+    deliver_tcp_message(recipients, data)
+    fan_out_duration["tcp"].observe(time.perf_counter() - start)
+    messages_relayed["tcp"].inc()
+    if shard_bus:
+        try:
+            shard_bus.publish(BUS_TCP_MESSAGE, room, data)
+        except OSError as e:
+            # the local members have it already, only the other shards miss the message
+            log.event(f"Dropped TCP message for the other shards: {e}")
+
+
+def replay_frames(tcp_client: TcpClient, room: str) -> bytes:
+    # called under tcp_clients_lock; the whole history is compressed as one batch
+    replay = history.replay(room)
+    return encode_compressed_frame(replay) if tcp_client.compressed else replay
+
+
+def deliver_tcp_message(recipients: List[TcpClient], data: bytes) -> None:
+    frame = encode_frame(FRAME_CHAT, data)
+    # compressed once for all the recipients that asked for it
+    compressed_frame = None
+    for c in recipients:
+        if c.compressed and compressed_frame is None:
+            compressed_frame = encode_compressed_frame(frame)
+        if not c.outbound_queue.put((compressed_frame if c.compressed else frame) if c.framed else data):
+            # overflow policy says disconnect; the client's own handler cleans up
+            disconnect_tcp_client(c.sock)
+
+
+def deliver_tcp_room_message(room: str, data: bytes) -> None:
+    # a message relayed by another shard for its local members' room
     with tcp_clients_lock:
-        tcp_clients.remove(client)
+        recipients = list(tcp_clients.members(room))
+        history.append(room, data)
+    deliver_tcp_message(recipients, data)
+
 
+def queue_tcp_message(tcp_client: TcpClient, data: bytes) -> None:
+    # called under tcp_clients_lock, so it must not wait for room in a full queue
+    if not tcp_client.outbound_queue.put(data, block=False):
+        disconnect_tcp_client(tcp_client.sock)
 
-def receive_tcp_messages(max_num_of_clients: int) -> None:
+
+def drain_outbound_queue(tcp_client: TcpClient) -> None:
+    while (data := tcp_client.outbound_queue.get()) is not None:
+        try:
+            tcp_client.sock.sendall(data)
+        except OSError:
+            break
+        bytes_sent["tcp"].inc(len(data))
+    tcp_client.outbound_queue.close()
+
+
+def disconnect_tcp_client(client: socket.socket) -> None:
+    try:
+        client.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def receive_tcp_messages(max_num_of_clients: int, outbound_queue_size: int, overflow_policy: str,
+                         reuse_port: bool) -> None:
     with ThreadPoolExecutor(max_workers=max_num_of_clients) as executor:
         # create an INET, STREAMing socket
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+            # allow restarting the server while old connections linger in TIME_WAIT
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                bind_reuse_port(server_socket)
             # bind the socket to the localhost and a port
             server_socket.bind((IP, PORT))
             # become a server socket
             server_socket.listen(max_num_of_clients)
             while True:
                 # accept connections from outside
-                client_socket, _ = server_socket.accept()
+                client_socket, (address, _) = server_socket.accept()
+                # relayed frames are already batched by the outbound writer, Nagle would only hold them back
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                tcp_connections_accepted.inc()
+                # a connection over capacity is closed at once instead of waiting in the executor's queue
+                # for a thread to become free
+                if not admission.admit(address):
+                    client_socket.close()
+                    continue
                 # now do something with the client_socket
-                executor.submit(handle_single_tcp_client, client_socket)
+                executor.submit(
+                    handle_single_tcp_client, client_socket, address, outbound_queue_size, overflow_policy
+                )
 
 
-def receive_udp_messages() -> None:
-    udp_clients: Set[Tuple[str, int]] = set()
-    # create an INET, datagram socket
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server_socket:
-        # bind the socket to the localhost and a port
-        server_socket.bind((IP, PORT))
-        while True:
-            buf, address = server_socket.recvfrom(MAX_BUF_SIZE)
-            if (message := buf.decode(ENCODING)) == INIT_MSG:
-                udp_clients.add(address)
-                print("New UDP client connected.")
+# relayed datagrams go out of the bound server socket, batched with sendmmsg where available
+udp_clients: RoomIndex[Address, UdpFanOut] = RoomIndex(UdpFanOut)
+udp_clients_lock = TimedLock(registry.histogram(
+    "lab1hw_lock_wait_seconds", "time spent waiting for a client index lock", lock="udp_clients"
+))
+# UDP has no connection to lose, a peer is gone once it stops sending heartbeats
+udp_peers: TimerWheel[Address] = TimerWheel(0, TIMER_WHEEL_RESOLUTION)
+def handle_udp_datagram(server_socket: socket.socket, udp_chunks: ChunkChannel, buf: memoryview,
+                        address: Address) -> None:
+    # chunks of a longer message are collected until it is complete
+    if (buf := udp_chunks.receive(buf, address)) is None:
+        return
+    # buf is a view of the receive buffer, it is parsed and relayed without a copy
+    if buf == INIT_MSG_BYTES:
+        with udp_clients_lock:
+            udp_clients.join(address, DEFAULT_ROOM)
+        log.event("New UDP client connected.")
 
-            else:
-                nick, _, payload = message.partition(":")
-                print(f"UDP message from {nick}: {payload}")
+    elif (room := parse_join_command(buf)) is not None:
+        with udp_clients_lock:
+            udp_clients.join(address, room)
+        log.event(f"UDP client has joined room {room}.")
+
+    else:
+        if log.sampled():
+            log.event("UDP message from {}: {}\nSending to other clients...".format(*split_message(buf)))
+
+        data = relayed_message(buf)
+        start = time.perf_counter()
+        datagrams = udp_chunks.datagrams(data)
+        with udp_clients_lock:
+            room = udp_clients.room_of(address) or DEFAULT_ROOM
+            members = udp_clients.members(room)
+            for datagram in datagrams:
+                members.send(server_socket, datagram, exclude=address)
+            recipients = len(members) - (address in members)
+        fan_out_duration["udp"].observe(time.perf_counter() - start)
+        messages_relayed["udp"].inc()
+        bytes_sent["udp"].inc(sum(map(len, datagrams)) * recipients)
+        if shard_bus:
+            shard_bus.publish(BUS_UDP_MESSAGE, room, data)
+
+
+def receive_udp_messages(server_socket: socket.socket, udp_batch_size: int, udp_chunks: ChunkChannel) -> None:
+    receiver = DatagramBatchReceiver(server_socket, udp_batch_size, MAX_BUF_SIZE)
+    while True:
+        for buf, address in receiver.receive():
+            bytes_received["udp"].inc(len(buf))
+            udp_peers.touch(address)
+            try:
+                handle_udp_datagram(server_socket, udp_chunks, buf, address)
+            except (OSError, ValueError) as e:
+                # a bad datagram only loses itself, the relay goes on
+                log.event(f"Dropped UDP datagram from {address}: {e}")
+        if drops := receiver.new_drops():
+            udp_dropped["unicast"].inc(drops)
+            log.event(f"Dropped {drops} UDP datagrams, {receiver.drops} in total.")
 
-                print("Sending to other clients...")
-                for c in udp_clients:
-                    if c != address:
-                        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client_socket:
-                            client_socket.sendto(bytes(f"{nick}:{payload}", ENCODING), (c[0], c[1]))
 
+def deliver_udp_room_message(server_socket: socket.socket, udp_chunks: ChunkChannel, room: str, data: bytes) -> None:
+    datagrams = udp_chunks.datagrams(data)
+    with udp_clients_lock:
+        members = udp_clients.members(room)
+        for datagram in datagrams:
+            members.send(server_socket, datagram)
+        recipients = len(members)
+    bytes_sent["udp"].inc(sum(map(len, datagrams)) * recipients)
 
-def receive_udp_multicast_messages(multicast_address: str, multicast_port: int) -> None:
+
+def evict_stale_peers() -> None:
+    while True:
+        time.sleep(TIMER_WHEEL_RESOLUTION)
+        if stale_tcp_clients := tcp_peers.expire():
+            with tcp_clients_lock:
+                for tcp_client in stale_tcp_clients:
+                    tcp_clients.leave(tcp_client)
+            # the clients' own handlers clean up once their recv fails
+            for tcp_client in stale_tcp_clients:
+                disconnect_tcp_client(tcp_client.sock)
+            peers_evicted["tcp"].inc(len(stale_tcp_clients))
+            log.event(f"Evicted {len(stale_tcp_clients)} TCP clients without heartbeats.")
+        if stale_udp_clients := udp_peers.expire():
+            with udp_clients_lock:
+                for address in stale_udp_clients:
+                    udp_clients.leave(address)
+            peers_evicted["udp"].inc(len(stale_udp_clients))
+            log.event(f"Evicted {len(stale_udp_clients)} UDP clients without heartbeats.")
+
+
+def create_udp_server_socket(reuse_port: bool) -> socket.socket:
+    # create an INET, datagram socket
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        bind_reuse_port(server_socket)
+    # bind the socket to the localhost and a port
+    server_socket.bind((IP, PORT))
+    return server_socket
+
+
+def receive_udp_multicast_messages(multicast_address: str, multicast_port: int, udp_batch_size: int) -> None:
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as\
             udp_multicast_socket:
         udp_multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -87,40 +364,300 @@ def receive_udp_multicast_messages(multicast_address: str, multicast_port: int)
 
         udp_multicast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
 
+        # the server only listens, it never NACKs the senders, but logs every sender's messages in order
+        multicast_chunks = ChunkChannel(udp_multicast_socket, False)
+        multicast = ReliableMulticast(
+            multicast_chunks, (multicast_address, multicast_port), False,
+            lambda message: log.message("Multicast message from {}: {}", *split_message(message))
+        )
+        multicast_chunks.start()
+        multicast.start()
+        receiver = DatagramBatchReceiver(udp_multicast_socket, udp_batch_size, MAX_BUF_SIZE)
         while True:
-            buf, _ = udp_multicast_socket.recvfrom(MAX_BUF_SIZE)
-            nick, _, payload = buf.decode(ENCODING).partition(":")
-            print(f"Multicast message from {nick}: {payload}")
-
+            for buf, address in receiver.receive():
+                bytes_received["multicast"].inc(len(buf))
+                multicast.receive(buf, address)
+            if drops := receiver.new_drops():
+                udp_dropped["multicast"].inc(drops)
+                log.event(f"Dropped {drops} multicast datagrams, {receiver.drops} in total.")
 
-def main() -> int:
-    signal.signal(signal.SIGINT, signal_handler)
 
-    if len(sys.argv) != 4:
-        print(
-            f"Usage: python {sys.argv[0]} <max_num_of_clients> <multicast_address> <multicast_port>"
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("max_num_of_clients", type=int)
+    parser.add_argument("multicast_address")
+    parser.add_argument("multicast_port", type=int)
+    parser.add_argument(
+        "--mode", choices=(SERVING_MODE_THREADS, SERVING_MODE_EVENT_LOOP), default=SERVING_MODE_THREADS,
+        help="serve TCP clients from a thread pool or multiplex them all on a single event loop"
+    )
+    parser.add_argument(
+        "--outbound-queue-size", type=int, default=DEFAULT_OUTBOUND_QUEUE_SIZE,
+        help="maximum number of messages waiting to be written to a single TCP client"
+    )
+    parser.add_argument(
+        "--overflow-policy", choices=(OVERFLOW_DROP_OLDEST, OVERFLOW_DISCONNECT, OVERFLOW_BACKPRESSURE),
+        default=OVERFLOW_DROP_OLDEST, help="what to do when a TCP client's outbound queue is full"
+    )
+    parser.add_argument(
+        "--udp-batch-size", type=int, default=UDP_RECV_BATCH_SIZE,
+        help="maximum number of datagrams taken from the kernel per wakeup, 1 disables batching"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=1,
+        help="number of server processes sharing the port, each one is started with its own --shard-id"
+    )
+    parser.add_argument("--shard-id", type=int, default=0)
+    parser.add_argument(
+        "--udp-retransmit", action="store_true",
+        help="NACK missing chunks of long UDP messages and retransmit the chunks clients NACK"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int,
+        help="serve the metrics over HTTP at /metrics on this port, every further shard uses the next port"
+    )
+    parser.add_argument(
+        "--log-sample", type=int, default=DEFAULT_LOG_SAMPLE,
+        help="log one message out of this many, 0 only logs connection events"
+    )
+    parser.add_argument("--log-file", help="append the log to this file instead of writing it to stdout")
+    parser.add_argument(
+        "--history-size", type=int, default=DEFAULT_HISTORY_SIZE,
+        help="messages of every room replayed to framed TCP clients entering it, 0 disables the history"
+    )
+    parser.add_argument(
+        "--history-slot-size", type=int, default=DEFAULT_HISTORY_SLOT_SIZE,
+        help="bytes reserved for every history message, longer messages are not kept"
+    )
+    parser.add_argument(
+        "--history-memory", type=int, default=DEFAULT_HISTORY_MEMORY,
+        help="bytes all room histories together may take, the least recently active rooms lose theirs first"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="fork this many server processes sharing the port with SO_REUSEPORT, one shard each"
+    )
+    parser.add_argument(
+        "--no-compression", dest="compression", action="store_false",
+        help="refuse the zlib compression framed clients may ask for in their INIT frame"
+    )
+    parser.add_argument(
+        "--max-connections", type=int,
+        help="TCP connections served at once, further ones are closed right after accept; defaults to "
+             "max_num_of_clients in the threads mode and no limit in the event loop mode"
+    )
+    parser.add_argument(
+        "--connection-rate", type=float, default=0.0,
+        help="new TCP connections per second allowed from one IP address, 0 for no limit"
+    )
+    parser.add_argument(
+        "--client-rate", type=float, default=0.0,
+        help="TCP messages per second relayed from one client, more are dropped; 0 for no limit"
+    )
+    parser.add_argument(
+        "--ip-rate", type=float, default=0.0,
+        help="TCP messages per second relayed from all the clients of one IP address together, 0 for no limit"
+    )
+    parser.add_argument(
+        "--global-rate", type=float, default=0.0,
+        help="TCP messages per second relayed by the whole server (each shard), 0 for no limit"
+    )
+    parser.add_argument(
+        "--peer-timeout", type=float, default=PEER_TIMEOUT,
+        help="seconds after which framed TCP and UDP clients without heartbeats are evicted, 0 keeps them"
+    )
+    args = parser.parse_args()
+    if not 0 <= args.shard_id < args.shards:
+        parser.error("--shard-id must be between 0 and --shards - 1")
+    if args.workers > 1 and args.shards > 1:
+        parser.error("--workers starts all the shards itself, it cannot be combined with --shards")
+    if args.log_sample < 0:
+        parser.error("--log-sample cannot be negative")
+    if args.history_size < 0 or args.history_slot_size <= 0 or args.history_memory < 0:
+        parser.error(
+            "--history-size and --history-memory cannot be negative, --history-slot-size must be positive"
         )
-        sys.exit(0)
-    max_num_of_clients = int(sys.argv[1])
-    multicast_address, multicast_port = sys.argv[2], int(sys.argv[3])
+    if args.peer_timeout < 0:
+        parser.error("--peer-timeout cannot be negative")
+    if (args.max_connections or 0) < 0 or min(args.connection_rate, args.client_rate, args.ip_rate,
+                                               args.global_rate) < 0:
+        parser.error("--max-connections and the rate limits cannot be negative")
+    if args.workers > 1 and not hasattr(os, "fork"):
+        parser.error("--workers needs os.fork, start every shard with --shards and --shard-id instead")
+    return args
+
+
+def start_shard_bus(shard_id: int, shards: int, udp_server_socket: socket.socket, udp_chunks: ChunkChannel,
+                    event_loop_server: Optional[EventLoopTcpServer]) -> ShardBus:
+    def deliver_shard_message(kind: int, room: str, data: bytes) -> None:
+        if kind == BUS_UDP_MESSAGE:
+            deliver_udp_room_message(udp_server_socket, udp_chunks, room, data)
+        elif event_loop_server:
+            event_loop_server.deliver_threadsafe(room, data)
+        else:
+            deliver_tcp_room_message(room, data)
+
+    bus = ShardBus(shard_id, shards, deliver_shard_message)
+    rooms = event_loop_server.tcp_clients if event_loop_server else tcp_clients
+    for index in (rooms, udp_clients):
+        index.on_room_opened = bus.add_interest
+        index.on_room_closed = bus.remove_interest
+    if event_loop_server:
+        event_loop_server.shard_bus = bus
+    bus.start()
+    return bus
 
-    tcp_client_handler = Thread(
-        target=receive_tcp_messages, args=(max_num_of_clients,), daemon=True
+
+def register_gauges(rooms: RoomIndex, tcp_peers: TimerWheel,
+                    outbound_queue_lengths: Callable[[], List[int]]) -> None:
+    registry.gauge("lab1hw_tcp_clients", "registered TCP clients", lambda: len(rooms))
+    registry.gauge("lab1hw_udp_clients", "registered UDP clients", lambda: len(udp_clients))
+    registry.gauge("lab1hw_tcp_connections", "admitted TCP connections", lambda: admission.connections)
+    registry.gauge("lab1hw_rooms", "rooms with members", lambda: len(rooms.rooms), transport="tcp")
+    registry.gauge("lab1hw_rooms", "rooms with members", lambda: len(udp_clients.rooms), transport="udp")
+    registry.gauge(
+        "lab1hw_outbound_queued_messages", "messages waiting in the TCP outbound queues",
+        lambda: sum(outbound_queue_lengths())
+    )
+    registry.gauge(
+        "lab1hw_outbound_queue_max_length", "longest TCP outbound queue",
+        lambda: max(outbound_queue_lengths(), default=0)
+    )
+    registry.gauge("lab1hw_history_rooms", "rooms keeping a message history", lambda: len(history))
+    registry.gauge("lab1hw_history_bytes", "memory taken by the room histories", lambda: history.memory())
+    registry.gauge("lab1hw_tracked_peers", "peers watched for heartbeats", lambda: len(tcp_peers), transport="tcp")
+    registry.gauge("lab1hw_tracked_peers", "peers watched for heartbeats", lambda: len(udp_peers), transport="udp")
+    registry.gauge("lab1hw_log_queued_lines", "log lines waiting for the writer", lambda: len(log))
+    registry.gauge("lab1hw_log_dropped_lines", "log lines dropped because the log queue was full", lambda: log.dropped)
+
+
+def run_server(args: argparse.Namespace, shard_id: int, shards: int) -> None:
+    global shard_bus, history, tcp_peers, udp_peers, compression, admission
+    max_num_of_clients = args.max_num_of_clients
+    multicast_address, multicast_port = args.multicast_address, args.multicast_port
+    # shards of one server bind the same port, the kernel balances clients between them
+    reuse_port = shards > 1
+    log.start(args.log_sample, args.log_file)
+    history = HistoryStore(args.history_size, args.history_slot_size, args.history_memory)
+    compression = args.compression
+    udp_peers = TimerWheel(args.peer_timeout, TIMER_WHEEL_RESOLUTION)
+    # the thread pool cannot serve more clients than it has threads, the event loop serves every accepted one
+    max_connections = args.max_connections
+    if max_connections is None:
+        max_connections = 0 if args.mode == SERVING_MODE_EVENT_LOOP else max_num_of_clients
+    admission = AdmissionControl(
+        max_connections, args.connection_rate, args.client_rate, args.ip_rate, args.global_rate
     )
-    udp_client_handler = Thread(target=receive_udp_messages, daemon=True)
-    udp_multicast_handler = Thread(
-        target=receive_udp_multicast_messages, args=(multicast_address, multicast_port), daemon=True
+
+    event_loop_server = None
+    if args.mode == SERVING_MODE_EVENT_LOOP:
+        # max_num_of_clients only sizes the listen backlog
+        event_loop_server = EventLoopTcpServer(
+            max_num_of_clients, args.outbound_queue_size, args.overflow_policy, reuse_port, history,
+            args.peer_timeout, args.compression, admission
+        )
+        tcp_client_handler = Thread(target=event_loop_server.serve_forever, daemon=True)
+    else:
+        tcp_peers = TimerWheel(args.peer_timeout, TIMER_WHEEL_RESOLUTION)
+        tcp_client_handler = Thread(
+            target=receive_tcp_messages,
+            args=(max_num_of_clients, args.outbound_queue_size, args.overflow_policy, reuse_port),
+            daemon=True
+        )
+    udp_server_socket = create_udp_server_socket(reuse_port)
+    udp_chunks = ChunkChannel(udp_server_socket, args.udp_retransmit)
+    udp_chunks.start()
+    udp_client_handler = Thread(
+        target=receive_udp_messages, args=(udp_server_socket, args.udp_batch_size, udp_chunks), daemon=True
     )
+    handlers = [tcp_client_handler, udp_client_handler]
+    if args.peer_timeout:
+        handlers.append(Thread(target=evict_stale_peers, daemon=True))
+    # only one shard listens to the multicast group, the others would log every message again
+    if shard_id == 0:
+        handlers.append(Thread(
+            target=receive_udp_multicast_messages,
+            args=(multicast_address, multicast_port, args.udp_batch_size),
+            daemon=True
+        ))
+
+    if shards > 1:
+        shard_bus = start_shard_bus(shard_id, shards, udp_server_socket, udp_chunks, event_loop_server)
 
-    tcp_client_handler.start()
-    udp_client_handler.start()
-    udp_multicast_handler.start()
+    if event_loop_server:
+        # the loop changes its index without a lock, so the loop itself reads the queues; a loop too busy to
+        # answer in time gets the last reading reported rather than failing the whole scrape
+        last_lengths: List[int] = []
+
+        def outbound_queue_lengths() -> List[int]:
+            nonlocal last_lengths
+            try:
+                last_lengths = event_loop_server.call_threadsafe(event_loop_server.outbound_queue_lengths).result(
+                    METRICS_LOOP_TIMEOUT
+                )
+            except FutureTimeoutError:
+                pass
+            return last_lengths
+
+        register_gauges(event_loop_server.tcp_clients, event_loop_server.tcp_peers, outbound_queue_lengths)
+    else:
+        # a snapshot of the clients, taken under the lock joins and leaves hold
+        def outbound_queue_lengths() -> List[int]:
+            with tcp_clients_lock:
+                clients = list(tcp_clients.member_rooms)
+            return [len(c.outbound_queue) for c in clients]
 
-    print("Server ready.")
+        register_gauges(tcp_clients, tcp_peers, outbound_queue_lengths)
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port + shard_id)
+
+    for handler in handlers:
+        handler.start()
+
+    print(f"Server ready (shard {shard_id + 1}/{shards})." if shards > 1 else "Server ready.")
+
+    for handler in handlers:
+        handler.join()
+
+
+def run_workers(args: argparse.Namespace) -> None:
+    # fork before any thread or socket exists, every worker is a full shard of the server
+    workers: List[int] = []
+    for worker_id in range(args.workers):
+        if (pid := os.fork()) == 0:
+            # the parent reports the shutdown, workers just stop
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_server(args, worker_id, args.workers)
+            except Exception:
+                traceback.print_exc()
+                os._exit(1)
+            os._exit(0)
+        workers.append(pid)
+
+    def stop_workers(sig, frame):
+        for worker in workers:
+            try:
+                os.kill(worker, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        signal_handler(sig, frame)
+
+    signal.signal(signal.SIGINT, stop_workers)
+    signal.signal(signal.SIGTERM, stop_workers)
+    for worker in workers:
+        os.waitpid(worker, 0)
+
+
+def main() -> int:
+    signal.signal(signal.SIGINT, signal_handler)
 
-    tcp_client_handler.join()
-    udp_client_handler.join()
-    udp_multicast_handler.join()
+    args = parse_args()
+    if args.workers > 1:
+        run_workers(args)
+    else:
+        run_server(args, args.shard_id, args.shards)
 
     return 0
 
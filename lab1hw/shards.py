@@ -0,0 +1,140 @@
+import os
+import errno
+import socket
+import struct
+import tempfile
+
+from collections import Counter
+from queue import SimpleQueue
+from threading import Thread, Lock
+from typing import Callable, Dict, Set
+
+from constants import PORT, ENCODING, MAX_FRAME_SIZE
+from logs import log
+
+# bus message: kind, sender shard id, room name length, room name, payload
+BUS_HEADER: struct.Struct = struct.Struct("!BHH")
+
+BUS_TCP_MESSAGE = 1
+BUS_UDP_MESSAGE = 2
+BUS_ROOM_JOINED = 3
+BUS_ROOM_LEFT = 4
+BUS_HELLO = 5
+
+Deliver = Callable[[int, str, bytes], None]
+
+
+def shard_socket_path(shard_id: int) -> str:
+    return os.path.join(tempfile.gettempdir(), f"lab1hw-{PORT}-shard-{shard_id}.sock")
+
+
+def bind_reuse_port(sock: socket.socket) -> None:
+    # every shard binds the same IP:PORT, the kernel spreads connections and datagram flows among them
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+
+# local channel between server processes sharing a port; a message published for a room only goes to
+# the shards which have local members in that room, each shard tells its peers when it gains or loses them
+class ShardBus:
+    def __init__(self, shard_id: int, shards: int, deliver: Deliver) -> None:
+        self.shard_id = shard_id
+        self.peers = [shard for shard in range(shards) if shard != shard_id]
+        self.deliver = deliver
+        self.lock = Lock()
+        # how many local transports (TCP, UDP) have members in a room
+        self.local_rooms: Counter = Counter()
+        self.remote_rooms: Dict[str, Set[int]] = {}
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        path = shard_socket_path(shard_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock.bind(path)
+        self.receiver = Thread(target=self.receive, daemon=True)
+        # interest changes happen under the callers' membership locks, so they are sent from a separate thread
+        self.announcements: SimpleQueue = SimpleQueue()
+        self.announcer = Thread(target=self.announce, daemon=True)
+
+    def start(self) -> None:
+        self.receiver.start()
+        self.announcer.start()
+        # shards that are already running answer with the rooms they are interested in
+        for shard in self.peers:
+            self.send(shard, BUS_HELLO, "")
+
+    def add_interest(self, room: str) -> None:
+        with self.lock:
+            self.local_rooms[room] += 1
+            if self.local_rooms[room] == 1:
+                self.announcements.put((BUS_ROOM_JOINED, room))
+
+    def remove_interest(self, room: str) -> None:
+        with self.lock:
+            self.local_rooms[room] -= 1
+            if self.local_rooms[room] <= 0:
+                del self.local_rooms[room]
+                self.announcements.put((BUS_ROOM_LEFT, room))
+
+    def publish(self, kind: int, room: str, payload: bytes) -> None:
+        with self.lock:
+            shards = tuple(self.remote_rooms.get(room, ()))
+        for shard in shards:
+            self.send(shard, kind, room, payload)
+
+    def announce(self) -> None:
+        while True:
+            kind, room = self.announcements.get()
+            try:
+                for shard in self.peers:
+                    self.send(shard, kind, room)
+            except (OSError, ValueError, struct.error) as e:
+                # one announcement that cannot be sent must not end the others
+                log.event(f"Dropped shard bus announcement for room {room}: {e}")
+
+    def send(self, shard: int, kind: int, room: str, payload: bytes = b"") -> None:
+        room_bytes = bytes(room, ENCODING)
+        try:
+            self.sock.sendto(
+                BUS_HEADER.pack(kind, self.shard_id, len(room_bytes)) + room_bytes + payload,
+                shard_socket_path(shard)
+            )
+        except (FileNotFoundError, ConnectionRefusedError):
+            # the peer is not running (yet), it says HELLO when it starts
+            pass
+        except OSError as e:
+            # a message beyond the socket buffer size only reaches the local members
+            if e.errno != errno.EMSGSIZE:
+                raise
+
+    def receive(self) -> None:
+        while True:
+            buf = self.sock.recv(BUS_HEADER.size + MAX_FRAME_SIZE)
+            try:
+                self.handle(buf)
+            except (OSError, ValueError, struct.error) as e:
+                # a truncated or malformed bus message only loses itself
+                log.event(f"Dropped shard bus message: {e}")
+
+    def handle(self, buf: bytes) -> None:
+        kind, shard, room_length = BUS_HEADER.unpack_from(buf)
+        room = buf[BUS_HEADER.size:BUS_HEADER.size + room_length].decode(ENCODING)
+        payload = buf[BUS_HEADER.size + room_length:]
+        if kind == BUS_ROOM_JOINED:
+            with self.lock:
+                self.remote_rooms.setdefault(room, set()).add(shard)
+        elif kind == BUS_ROOM_LEFT:
+            with self.lock:
+                if (shards := self.remote_rooms.get(room)) is not None:
+                    shards.discard(shard)
+                    if not shards:
+                        del self.remote_rooms[room]
+        elif kind == BUS_HELLO:
+            with self.lock:
+                # a (re)started shard has no members yet
+                for room_shards in self.remote_rooms.values():
+                    room_shards.discard(shard)
+                rooms = tuple(self.local_rooms)
+            for local_room in rooms:
+                self.send(shard, BUS_ROOM_JOINED, local_room)
+        else:
+            self.deliver(kind, room, payload)
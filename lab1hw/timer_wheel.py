@@ -0,0 +1,70 @@
+import time
+
+from threading import Lock
+from typing import Dict, Generic, Hashable, List, Optional, Set, TypeVar
+
+Key = TypeVar("Key", bound=Hashable)
+
+
+# last-seen times of peers in a hashed wheel of slots, one slot per resolution seconds: a peer sits in the slot of
+# the time it would expire, touching a known peer only updates its last-seen time and the wheel reschedules it
+# lazily when its slot comes up, so neither touching nor expiring ever looks at the peers that are not due;
+# a timeout of 0 turns the wheel off
+class TimerWheel(Generic[Key]):
+    def __init__(self, timeout: float, resolution: float) -> None:
+        self.timeout = timeout
+        self.resolution = resolution
+        self.slots: List[Set[Key]] = [set() for _ in range(int(timeout / resolution) + 3)]
+        self.last_seen: Dict[Key, float] = {}
+        self.lock = Lock()
+        # the last slot that has been expired
+        self.tick = self.tick_of(time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self.last_seen)
+
+    def tick_of(self, moment: float) -> int:
+        return int(moment / self.resolution)
+
+    def schedule(self, key: Key, deadline: float) -> None:
+        # the slot after the deadline's one, so the peer is surely due when it comes up; a slot that wrapped
+        # around comes up early, which only costs another reschedule
+        tick = max(self.tick_of(deadline) + 1, self.tick + 1)
+        self.slots[tick % len(self.slots)].add(key)
+
+    def touch(self, key: Key, now: Optional[float] = None) -> None:
+        if not self.timeout:
+            return
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if key not in self.last_seen:
+                self.schedule(key, now + self.timeout)
+            self.last_seen[key] = now
+
+    def discard(self, key: Key) -> None:
+        # the key's slot entry is skipped when the slot comes up
+        with self.lock:
+            self.last_seen.pop(key, None)
+
+    def expire(self, now: Optional[float] = None) -> List[Key]:
+        # the peers not seen for timeout seconds, forgotten by the wheel and left to the caller to evict
+        now = time.monotonic() if now is None else now
+        expired: List[Key] = []
+        with self.lock:
+            target = self.tick_of(now)
+            # after a long pause every slot comes up once, not once per missed tick
+            self.tick = max(self.tick, target - len(self.slots))
+            while self.tick < target:
+                self.tick += 1
+                slot = self.slots[self.tick % len(self.slots)]
+                due = list(slot)
+                slot.clear()
+                for key in due:
+                    if (seen := self.last_seen.get(key)) is None:
+                        continue
+                    if seen + self.timeout <= now:
+                        del self.last_seen[key]
+                        expired.append(key)
+                    else:
+                        self.schedule(key, seen + self.timeout)
+        return expired
@@ -0,0 +1,264 @@
+import os
+import sys
+import errno
+import socket
+import ctypes
+import ctypes.util
+import struct
+
+from typing import Dict, List, Optional, Tuple, Union
+
+Address = Tuple[str, int]
+
+# the kernel handles at most UIO_MAXIOV messages per sendmmsg/recvmmsg call
+MAX_BATCH_SIZE = 1024
+# recvmmsg blocks for the first datagram only and then takes whatever else is already queued
+MSG_WAITFORONE = 0x10000
+# Linux socket option which attaches the socket's dropped datagrams counter to every received datagram
+SO_RXQ_OVFL = 40
+DROPS_CMSG_SIZE = struct.calcsize("I")
+# below this many peers the ctypes call costs more than it saves over a plain sendto loop
+SENDMMSG_MIN_PEERS = 16
+
+
+class IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(IoVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class CMsgHdr(ctypes.Structure):
+    _fields_ = [("cmsg_len", ctypes.c_size_t), ("cmsg_level", ctypes.c_int), ("cmsg_type", ctypes.c_int)]
+
+
+def load_libc() -> Optional[ctypes.CDLL]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        libc.sendmmsg.restype = ctypes.c_int
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.recvmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError, TypeError):
+        return None
+    return libc
+
+
+libc = load_libc()
+
+
+def sendmmsg_available() -> bool:
+    return libc is not None
+
+
+def recvmmsg_available() -> bool:
+    return libc is not None
+
+
+def to_sock_addr(address: Address) -> SockAddrIn:
+    sock_addr = SockAddrIn()
+    sock_addr.sin_family = socket.AF_INET
+    sock_addr.sin_port = socket.htons(address[1])
+    sock_addr.sin_addr[:] = socket.inet_aton(socket.gethostbyname(address[0]))
+    return sock_addr
+
+
+# registered UDP peers plus the prebuilt sendmmsg vector that sends one datagram to all of them;
+# the vector is only rebuilt when the membership changes, not for every relayed message
+class UdpFanOut:
+    def __init__(self, use_sendmmsg: bool = True, min_peers: int = SENDMMSG_MIN_PEERS) -> None:
+        self.use_sendmmsg = use_sendmmsg and sendmmsg_available()
+        self.min_peers = min_peers
+        self.addresses: List[Address] = []
+        self.indexes: Dict[Address, int] = {}
+        self.sock_addrs: ctypes.Array = (SockAddrIn * 0)()
+        self.messages: ctypes.Array = (MMsgHdr * 0)()
+        self.iov = IoVec()
+        self.send_errors = 0
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def __contains__(self, address: Address) -> bool:
+        return address in self.indexes
+
+    def __iter__(self):
+        return iter(self.addresses)
+
+    def add(self, address: Address) -> None:
+        if address not in self.indexes:
+            self.indexes[address] = len(self.addresses)
+            self.addresses.append(address)
+            self.rebuild()
+
+    def discard(self, address: Address) -> None:
+        if (index := self.indexes.pop(address, None)) is not None:
+            # move the last peer into the freed slot to keep the vector dense
+            last = self.addresses.pop()
+            if index < len(self.addresses):
+                self.addresses[index] = last
+                self.indexes[last] = index
+            self.rebuild()
+
+    def rebuild(self) -> None:
+        if not self.use_sendmmsg:
+            return
+        self.sock_addrs = (SockAddrIn * len(self.addresses))(*map(to_sock_addr, self.addresses))
+        self.messages = (MMsgHdr * len(self.addresses))()
+        for message, sock_addr in zip(self.messages, self.sock_addrs):
+            message.msg_hdr.msg_name = ctypes.addressof(sock_addr)
+            message.msg_hdr.msg_namelen = ctypes.sizeof(SockAddrIn)
+            message.msg_hdr.msg_iov = ctypes.pointer(self.iov)
+            message.msg_hdr.msg_iovlen = 1
+
+    def send(self, sock: socket.socket, data: Union[bytes, memoryview], exclude: Optional[Address] = None) -> None:
+        # sends data to every registered peer but the excluded one from the given (bound) socket
+        if not self.use_sendmmsg or len(self.addresses) < self.min_peers:
+            for address in self.addresses:
+                if address != exclude:
+                    try:
+                        sock.sendto(data, address)
+                    except OSError:
+                        self.send_errors += 1
+            return
+
+        # every message of the vector points at the same iovec, so the payload is never copied,
+        # not even out of a receive buffer
+        if isinstance(data, memoryview) and not data.readonly and data.contiguous and len(data):
+            payload = (ctypes.c_char * len(data)).from_buffer(data)
+            self.iov.iov_base = ctypes.addressof(payload)
+        else:
+            payload = ctypes.c_char_p(bytes(data))
+            self.iov.iov_base = ctypes.cast(payload, ctypes.c_void_p)
+        self.iov.iov_len = len(data)
+        excluded = self.indexes.get(exclude, len(self.addresses)) if exclude else len(self.addresses)
+        self.sendmmsg(sock.fileno(), 0, excluded)
+        self.sendmmsg(sock.fileno(), excluded + 1, len(self.addresses))
+
+    def sendmmsg(self, fd: int, start: int, end: int) -> None:
+        while start < end:
+            count = min(end - start, MAX_BATCH_SIZE)
+            sent = libc.sendmmsg(fd, ctypes.addressof(self.messages) + start * ctypes.sizeof(MMsgHdr), count, 0)
+            if sent <= 0:
+                # the first datagram of the batch failed, skip it like a failed sendto
+                if ctypes.get_errno() == errno.EINTR:
+                    continue
+                self.send_errors += 1
+                sent = 1
+            start += sent
+
+
+# receives up to batch_size datagrams per wakeup into preallocated buffers; the returned views are only
+# valid until the next receive call
+class DatagramBatchReceiver:
+    def __init__(self, sock: socket.socket, batch_size: int, buf_size: int) -> None:
+        self.sock = sock
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.buf_size = buf_size
+        self.buffer = bytearray(self.batch_size * buf_size)
+        self.view = memoryview(self.buffer)
+        # datagrams the kernel dropped because the receive buffer was full, as of the moment
+        # the newest received datagram was queued
+        self.drops = 0
+        self.reported_drops = 0
+        self.control_size = 0
+        if sys.platform.startswith("linux"):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.control_size = socket.CMSG_SPACE(DROPS_CMSG_SIZE)
+            except OSError:
+                pass
+
+        self.use_recvmmsg = recvmmsg_available() and self.batch_size > 1
+        if self.use_recvmmsg:
+            buffer_address = ctypes.addressof((ctypes.c_char * len(self.buffer)).from_buffer(self.buffer))
+            self.iovs = (IoVec * self.batch_size)()
+            self.sock_addrs = (SockAddrIn * self.batch_size)()
+            self.controls = ctypes.create_string_buffer(max(self.control_size, 1) * self.batch_size)
+            self.messages = (MMsgHdr * self.batch_size)()
+            for i, (message, iov) in enumerate(zip(self.messages, self.iovs)):
+                iov.iov_base = buffer_address + i * buf_size
+                iov.iov_len = buf_size
+                message.msg_hdr.msg_iov = ctypes.pointer(iov)
+                message.msg_hdr.msg_iovlen = 1
+                message.msg_hdr.msg_name = ctypes.addressof(self.sock_addrs[i])
+                if self.control_size:
+                    message.msg_hdr.msg_control = ctypes.addressof(self.controls) + i * self.control_size
+            self.messages_address = ctypes.addressof(self.messages)
+
+    def receive(self) -> List[Tuple[memoryview, Address]]:
+        if self.use_recvmmsg:
+            return self.receive_recvmmsg()
+        return self.receive_single()
+
+    def receive_recvmmsg(self) -> List[Tuple[memoryview, Address]]:
+        for message in self.messages:
+            # the kernel overwrites both lengths on every call
+            message.msg_hdr.msg_namelen = ctypes.sizeof(SockAddrIn)
+            message.msg_hdr.msg_controllen = self.control_size
+        while (received := libc.recvmmsg(
+                self.sock.fileno(), self.messages_address, self.batch_size, MSG_WAITFORONE, None)) < 0:
+            if (err := ctypes.get_errno()) != errno.EINTR:
+                raise OSError(err, os.strerror(err))
+
+        datagrams = []
+        for i in range(received):
+            sock_addr = self.sock_addrs[i]
+            address = (socket.inet_ntoa(bytes(sock_addr.sin_addr)), socket.ntohs(sock_addr.sin_port))
+            start = i * self.buf_size
+            datagrams.append((self.view[start:start + self.messages[i].msg_len], address))
+        if received and self.control_size:
+            # the counter is cumulative, the last datagram of the batch carries the newest value
+            self.update_drops(ctypes.string_at(
+                self.messages[received - 1].msg_hdr.msg_control, self.messages[received - 1].msg_hdr.msg_controllen
+            ))
+        return datagrams
+
+    def receive_single(self) -> List[Tuple[memoryview, Address]]:
+        if self.control_size:
+            size, ancdata, _, address = self.sock.recvmsg_into([self.view[:self.buf_size]], self.control_size)
+            for level, cmsg_type, data in ancdata:
+                if level == socket.SOL_SOCKET and cmsg_type == SO_RXQ_OVFL:
+                    self.drops = struct.unpack("I", data[:DROPS_CMSG_SIZE])[0]
+        else:
+            size, address = self.sock.recvfrom_into(self.view[:self.buf_size])
+        return [(self.view[:size], address)]
+
+    def new_drops(self) -> int:
+        # drops since the previous call
+        new_drops, self.reported_drops = self.drops - self.reported_drops, self.drops
+        return new_drops
+
+    def update_drops(self, control: bytes) -> None:
+        offset = 0
+        while offset + ctypes.sizeof(CMsgHdr) <= len(control):
+            cmsg = CMsgHdr.from_buffer_copy(control, offset)
+            if cmsg.cmsg_len < ctypes.sizeof(CMsgHdr):
+                return
+            if cmsg.cmsg_level == socket.SOL_SOCKET and cmsg.cmsg_type == SO_RXQ_OVFL:
+                self.drops = struct.unpack_from("I", control, offset + ctypes.sizeof(CMsgHdr))[0]
+            offset += socket.CMSG_SPACE(cmsg.cmsg_len - ctypes.sizeof(CMsgHdr))
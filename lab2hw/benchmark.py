@@ -0,0 +1,164 @@
+import math
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+from statistics import fmean
+from datetime import datetime, timedelta
+
+from constants import (DATE_FORMAT, WEATHER_INTERVAL, WEATHER_DATES, WEATHER_UNITS, WEATHER_FEATURES,
+                       HISTORICAL_GRID_STEP)
+from historical_cache import HistoricalWeatherCache
+from weather_stats import parse_columns, summarize
+
+
+def synthetic_weather_data(startdate, years, null_share):
+    # hourly data of whole days shaped like the upstream answer, with a daily and a yearly cycle, noise and some
+    # nulls
+    rng = random.Random(0)
+    start = datetime.strptime(startdate, DATE_FORMAT)
+    hours = int(years * 365.25) * 24
+    dates = [(start + timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M") for h in range(hours)]
+    temperature = [
+        round(8 + 10 * math.sin(h / 8766 * 2 * math.pi) + 5 * math.sin(h / 24 * 2 * math.pi) + rng.gauss(0, 2), 1)
+        for h in range(hours)
+    ]
+    humidity = [
+        round(min(100, max(5, 70 + 20 * math.cos(h / 24 * 2 * math.pi) + rng.gauss(0, 8)))) for h in range(hours)
+    ]
+    for column in (temperature, humidity):
+        for h in rng.sample(range(hours), int(hours * null_share)):
+            column[h] = None
+    return {
+        WEATHER_UNITS: {WEATHER_DATES: "iso8601", WEATHER_FEATURES[0]: "°C", WEATHER_FEATURES[1]: "%"},
+        WEATHER_INTERVAL: {WEATHER_DATES: dates, WEATHER_FEATURES[0]: temperature, WEATHER_FEATURES[1]: humidity}
+    }
+
+
+def reference_statistics(weather_data):
+    # the plain definition: every hour that has a reading, zeros included, with its own date
+    summaries = []
+    dates = weather_data[WEATHER_INTERVAL][WEATHER_DATES]
+    for feature in WEATHER_FEATURES:
+        readings = [(value, date) for value, date in zip(weather_data[WEATHER_INTERVAL][feature], dates)
+                    if value is not None]
+        highest = max(readings, key=lambda reading: reading[0])
+        lowest = min(readings, key=lambda reading: reading[0])
+        summaries.append((fmean(value for value, _ in readings), highest[0], highest[1], lowest[0], lowest[1]))
+    return summaries
+
+
+def list_statistics(weather_data):
+    # what get_complete_weather_data did before: filtered copies and five passes per feature
+    summaries = []
+    dates = list(filter(None, weather_data[WEATHER_INTERVAL][WEATHER_DATES]))
+    for feature in WEATHER_FEATURES:
+        values = list(filter(None, weather_data[WEATHER_INTERVAL][feature]))
+        summaries.append((
+            round(fmean(values), 2),
+            round(max(values), 2), dates[max(range(len(values)), key=values.__getitem__)],
+            round(min(values), 2), dates[min(range(len(values)), key=values.__getitem__)]
+        ))
+    return summaries
+
+
+def upstream_shaped(columns):
+    # what the historical cache handed out before: a date string and a float or None per hour
+    values = [[None if math.isnan(v) else v for v in row.tolist()] for row in columns.values]
+    return {
+        WEATHER_UNITS: columns.units,
+        WEATHER_INTERVAL: {WEATHER_DATES: list(columns.dates), **dict(zip(WEATHER_FEATURES, values))}
+    }
+
+
+def filled_cache(weather_data):
+    # a cache holding every month of the data, so that a request is served without going upstream
+    cache = HistoricalWeatherCache(HISTORICAL_GRID_STEP, 1 << 20)
+    dates = weather_data[WEATHER_INTERVAL][WEATHER_DATES]
+    first = datetime.strptime(dates[0][:10], DATE_FORMAT)
+
+    async def fetch(latitude, longitude, startdate, enddate):
+        begin = (datetime.strptime(startdate, DATE_FORMAT) - first).days * 24
+        end = ((datetime.strptime(enddate, DATE_FORMAT) - first).days + 1) * 24
+        return {
+            WEATHER_UNITS: weather_data[WEATHER_UNITS],
+            WEATHER_INTERVAL: {name: column[begin:end] for name, column in weather_data[WEATHER_INTERVAL].items()}
+        }
+
+    return cache, fetch
+
+
+def agrees(summary, expected):
+    # the cached values are float32, so the numbers may differ in the last rounded digit
+    avg, highest, highest_date, lowest, lowest_date = expected
+    return (
+        all(math.isclose(a, b, abs_tol=0.01) for a, b in ((summary.avg, avg), (summary.max, highest),
+                                                          (summary.min, lowest)))
+        and (summary.max_date, summary.min_date) == (highest_date, lowest_date)
+    )
+
+
+def best_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time the weather statistics over a synthetic hourly series")
+    parser.add_argument("--years", type=float, default=40.0)
+    parser.add_argument("--null-share", type=float, default=0.001, help="share of the readings that are null")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    weather_data = synthetic_weather_data("1985-01-01", args.years, args.null_share)
+    interval = weather_data[WEATHER_INTERVAL]
+    hours = len(interval[WEATHER_DATES])
+    startdate, enddate = interval[WEATHER_DATES][0][:10], interval[WEATHER_DATES][-1][:10]
+    nulls = sum(value is None for feature in WEATHER_FEATURES for value in interval[feature])
+    zeros = sum(value == 0 for feature in WEATHER_FEATURES for value in interval[feature])
+    print(f"{hours} hours, {len(WEATHER_FEATURES)} features, {nulls} nulls, {zeros} zero readings")
+
+    cache, fetch = filled_cache(weather_data)
+
+    def cached_columns():
+        return asyncio.run(cache.get("50.06", "19.94", startdate, enddate, fetch))
+
+    # a null or a zero reading must neither drop an hour nor shift the dates of the ones after it
+    reference = reference_statistics(weather_data)
+    for name, columns in (("upstream answer", parse_columns(weather_data)), ("cached columns", cached_columns())):
+        if not all(map(agrees, summarize(columns), reference)):
+            raise SystemExit(f"{name}: {summarize(columns)} instead of {reference}")
+    rounded = [(round(avg, 2), *extremes) for avg, *extremes in reference]
+    print(f"columns agree with the reference, the filtered lists "
+          f"{'do' if list_statistics(weather_data) == rounded else 'do not'}")
+
+    pipelines = [
+        ("lists", lambda: list_statistics(upstream_shaped(cached_columns()))),
+        ("columns", lambda: summarize(cached_columns())),
+        ("upstream answer", lambda: summarize(parse_columns(weather_data))),
+    ]
+    before = None
+    print(f"{'':>20} {'time':>10} {'peak memory':>14}")
+    for name, pipeline in pipelines:
+        elapsed = best_time(pipeline, args.repeats)
+        peak = peak_memory(pipeline)
+        speedup = f"{before / elapsed:>6.1f}x" if before else ""
+        before = before or elapsed
+        print(f"{name:>20} {elapsed * 1e3:>7.1f} ms {peak / 2 ** 20:>11.1f} MB {speedup}")
+
+
+if __name__ == "__main__":
+    main()
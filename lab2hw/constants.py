@@ -1,15 +1,36 @@
-from typing import Final, List
+import os
+from typing import Final, List, Optional
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 
 
-GEOCODE_API_URL: Final[str] = "https://nominatim.openstreetmap.org/search?q={location}&format=jsonv2&limit=1"
-WEATHER_HISTORICAL_DATA_API_URL: Final[str] = "https://archive-api.open-meteo.com/v1/era5?" \
-                                              "latitude={latitude}&longitude={longitude}" \
-                                              "&start_date={startdate}&end_date={enddate}&{weatherinterval}="
-WEATHER_FORECAST_API_URL: Final[str] = "https://api.open-meteo.com/v1/forecast?" \
-                                       "latitude={latitude}&longitude={longitude}&forecast_days={forecastdays}" \
-                                       "&{weatherinterval}="
+# every upstream URL can be overridden from the environment, e.g. to point the app at stub_upstream.py
+GEOCODE_API_URL: Final[str] = os.environ.get(
+    "GEOCODE_API_URL", "https://nominatim.openstreetmap.org/search?q={location}&format=jsonv2&limit=1"
+)
+WEATHER_HISTORICAL_DATA_API_URL: Final[str] = os.environ.get(
+    "WEATHER_HISTORICAL_DATA_API_URL",
+    "https://archive-api.open-meteo.com/v1/era5?latitude={latitude}&longitude={longitude}"
+    "&start_date={startdate}&end_date={enddate}&{weatherinterval}="
+)
+WEATHER_FORECAST_API_URL: Final[str] = os.environ.get(
+    "WEATHER_FORECAST_API_URL",
+    "https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&forecast_days={forecastdays}"
+    "&{weatherinterval}="
+)
+# geocoding results are cached by normalized location, "Location not found" for a shorter time; set
+# GEOCODE_CACHE_PATH to keep the cache in an SQLite file across restarts
+GEOCODE_CACHE_TTL: Final[float] = 30 * 24 * 3600.0
+GEOCODE_CACHE_NEGATIVE_TTL: Final[float] = 3600.0
+GEOCODE_CACHE_SIZE: Final[int] = 10000
+GEOCODE_CACHE_PATH: Final[Optional[str]] = os.environ.get("GEOCODE_CACHE_PATH")
+# historical data is cached in month tiles of ERA5's 0.25 degree grid, a tile takes about 6 KB
+HISTORICAL_GRID_STEP: Final[float] = 0.25
+HISTORICAL_CACHE_TILES: Final[int] = 8192
+# one HTTP client with a connection pool is shared by all requests
+HTTP_TIMEOUT: Final[float] = 30.0
+HTTP_MAX_CONNECTIONS: Final[int] = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS: Final[int] = 20
 
 DATE_FORMAT: Final[str] = "%Y-%m-%d"
 MIN_DATE: Final[str] = "1985-01-01"
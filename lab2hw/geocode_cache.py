@@ -0,0 +1,103 @@
+import time
+import asyncio
+import sqlite3
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+Coordinates = Tuple[str, str]
+
+
+def normalize_location(location: str) -> str:
+    return " ".join(location.split()).casefold()
+
+
+# geocoding results by normalized location, None for a location that was not found; entries expire after ttl
+# (negative_ttl for not found ones), the least recently used go first beyond max_size, and concurrent lookups
+# of one location share a single upstream request; with a path, entries are written through to SQLite and
+# loaded back on start
+class GeocodeCache:
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int, path: Optional[str] = None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, Tuple[float, Optional[Coordinates]]]" = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.db = self.open_db(path) if path else None
+
+    def open_db(self, path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path)
+        # a write lost in a crash only costs one more lookup, so commits do not wait for the disk
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS geocode "
+            "(location TEXT PRIMARY KEY, expires REAL, latitude TEXT, longitude TEXT)"
+        )
+        now = time.time()
+        db.execute("DELETE FROM geocode WHERE expires <= ?", (now,))
+        db.commit()
+        rows = db.execute(
+            "SELECT location, expires, latitude, longitude FROM geocode ORDER BY expires DESC LIMIT ?",
+            (self.max_size,)
+        ).fetchall()
+        # the latest entries last, as if they were the most recently used
+        for location, expires, latitude, longitude in reversed(rows):
+            self.entries[location] = (expires, (latitude, longitude) if latitude is not None else None)
+        return db
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    def lookup_cached(self, key: str) -> Tuple[bool, Optional[Coordinates]]:
+        if (entry := self.entries.get(key)) is None:
+            return False, None
+        expires, coordinates = entry
+        if expires <= time.time():
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        return True, coordinates
+
+    def put(self, key: str, coordinates: Optional[Coordinates]):
+        expires = time.time() + (self.ttl if coordinates is not None else self.negative_ttl)
+        self.entries[key] = (expires, coordinates)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            evicted, _ = self.entries.popitem(last=False)
+            if self.db:
+                self.db.execute("DELETE FROM geocode WHERE location = ?", (evicted,))
+        if self.db:
+            latitude, longitude = coordinates if coordinates is not None else (None, None)
+            self.db.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)", (key, expires, latitude, longitude)
+            )
+            self.db.commit()
+
+    async def get(self, location: str,
+                  lookup: Callable[[], Awaitable[Optional[Coordinates]]]) -> Optional[Coordinates]:
+        # lookup resolves the location upstream; when it raises, nothing is cached and every waiter gets the error
+        key = normalize_location(location)
+        hit, coordinates = self.lookup_cached(key)
+        if hit:
+            self.hits += 1
+            return coordinates
+        if (task := self.in_flight.get(key)) is None:
+            self.misses += 1
+            task = self.in_flight[key] = asyncio.ensure_future(self.resolve(key, lookup))
+            # the error is retrieved even if every waiter has been cancelled in the meantime
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        else:
+            self.hits += 1
+        # a waiter that is cancelled does not cancel the lookup the others wait for
+        return await asyncio.shield(task)
+
+    async def resolve(self, key: str, lookup: Callable[[], Awaitable[Optional[Coordinates]]]) -> Optional[Coordinates]:
+        try:
+            coordinates = await lookup()
+            self.put(key, coordinates)
+            return coordinates
+        finally:
+            del self.in_flight[key]
@@ -0,0 +1,141 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from constants import DATE_FORMAT, MAX_DATE, WEATHER_INTERVAL, WEATHER_UNITS, WEATHER_FEATURES
+from weather_stats import HourlyDates, WeatherColumns
+
+Cell = Tuple[int, int]
+Month = Tuple[int, int]
+# float32, a row per weather feature and a column per hour from the first hour of the month, NaN where ERA5 has
+# no value
+Tile = np.ndarray
+# fetches the upstream hourly data of a latitude, a longitude and a date range
+Fetch = Callable[[str, str, str, str], Awaitable[dict]]
+
+
+def month_of(day: date) -> Month:
+    return day.year, day.month
+
+
+def first_day(month: Month) -> date:
+    return date(month[0], month[1], 1)
+
+
+def last_day(month: Month) -> date:
+    year, number = month
+    return (date(year + number // 12, number % 12 + 1, 1)) - timedelta(days=1)
+
+
+def months_between(start: date, end: date) -> List[Month]:
+    months = []
+    year, number = month_of(start)
+    while (year, number) <= month_of(end):
+        months.append((year, number))
+        year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+    return months
+
+
+def contiguous_runs(months: List[Month]) -> List[List[Month]]:
+    runs: List[List[Month]] = []
+    for month in months:
+        if runs and first_day(month) - timedelta(days=1) == last_day(runs[-1][-1]):
+            runs[-1].append(month)
+        else:
+            runs.append([month])
+    return runs
+
+
+# the ERA5 archive never changes once published, so its hourly data is kept in month tiles of a grid cell:
+# requests for any point of the cell are served from the tiles and only the months no tile holds yet are
+# fetched, one upstream call per run of consecutive months; a month the archive or the answer does not fully
+# cover is used but not kept, beyond max_tiles the least recently used tiles go first
+class HistoricalWeatherCache:
+    def __init__(self, grid_step: float, max_tiles: int):
+        self.grid_step = grid_step
+        self.max_tiles = max_tiles
+        self.tiles: "OrderedDict[Tuple[Cell, Month], Tile]" = OrderedDict()
+        self.in_flight: Dict[Tuple[Cell, Month], asyncio.Task] = {}
+        self.units: Optional[dict] = None
+        self.upstream_calls = 0
+
+    def cell_of(self, latitude: str, longitude: str) -> Cell:
+        return round(float(latitude) / self.grid_step), round(float(longitude) / self.grid_step)
+
+    def coordinates_of(self, cell: Cell) -> Tuple[str, str]:
+        # every point of a cell is fetched at its centre, so all of them see the same data
+        return f"{cell[0] * self.grid_step:.4f}", f"{cell[1] * self.grid_step:.4f}"
+
+    async def get(self, latitude: str, longitude: str, startdate: str, enddate: str, fetch: Fetch) -> WeatherColumns:
+        # the hourly data from the start of startdate to the end of enddate
+        start = datetime.strptime(startdate, DATE_FORMAT).date()
+        end = datetime.strptime(enddate, DATE_FORMAT).date()
+        cell = self.cell_of(latitude, longitude)
+        months = months_between(start, end)
+        tiles: Dict[Month, Tile] = {}
+        waiting: Dict[asyncio.Task, None] = {}
+        missing = []
+        for month in months:
+            key = (cell, month)
+            if (tile := self.tiles.get(key)) is not None:
+                self.tiles.move_to_end(key)
+                tiles[month] = tile
+            elif (task := self.in_flight.get(key)) is not None:
+                # another request is fetching this month already
+                waiting[task] = None
+            else:
+                missing.append(month)
+        for run in contiguous_runs(missing):
+            task = asyncio.ensure_future(self.fetch_months(cell, run, fetch))
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            for month in run:
+                self.in_flight[(cell, month)] = task
+            waiting[task] = None
+        for fetched in await asyncio.gather(*(asyncio.shield(task) for task in waiting)):
+            tiles.update(fetched)
+        return self.assemble(tiles, start, end)
+
+    async def fetch_months(self, cell: Cell, run: List[Month], fetch: Fetch) -> Dict[Month, Tile]:
+        try:
+            end = min(last_day(run[-1]).strftime(DATE_FORMAT), MAX_DATE)
+            self.upstream_calls += 1
+            data = await fetch(*self.coordinates_of(cell), first_day(run[0]).strftime(DATE_FORMAT), end)
+        finally:
+            for month in run:
+                del self.in_flight[(cell, month)]
+        self.units = self.units or data[WEATHER_UNITS]
+        # JSON nulls become NaN
+        values = np.array([data[WEATHER_INTERVAL][feature] for feature in WEATHER_FEATURES], dtype=np.float32)
+        fetched = {}
+        offset = 0
+        for month in run:
+            hours = ((last_day(month) - first_day(month)).days + 1) * 24
+            # an answer that ends early leaves the rest of the month unknown for this request, the month is
+            # fetched again by the next one
+            tile = np.full((len(WEATHER_FEATURES), hours), np.nan, dtype=np.float32)
+            part = values[:, offset:offset + hours]
+            tile[:, :part.shape[1]] = part
+            offset += hours
+            fetched[month] = tile
+            if part.shape[1] == hours and last_day(month).strftime(DATE_FORMAT) <= MAX_DATE:
+                self.tiles[(cell, month)] = tile
+                if len(self.tiles) > self.max_tiles:
+                    self.tiles.popitem(last=False)
+        return fetched
+
+    def assemble(self, tiles: Dict[Month, Tile], start: date, end: date) -> WeatherColumns:
+        # the hours are copied once, straight from the tiles into one matrix; the dates follow from the index
+        hours = ((end - start).days + 1) * 24
+        values = np.empty((len(WEATHER_FEATURES), hours), dtype=np.float32)
+        offset = 0
+        for month in months_between(start, end):
+            first = max(start, first_day(month))
+            count = ((min(end, last_day(month)) - first).days + 1) * 24
+            begin = (first - first_day(month)).days * 24
+            values[:, offset:offset + count] = tiles[month][:, begin:begin + count]
+            offset += count
+        first_hour = datetime.combine(start, datetime.min.time())
+        return WeatherColumns(values, HourlyDates(first_hour, hours), self.units or {})
@@ -1,9 +1,10 @@
+import asyncio
 import secrets
-from statistics import fmean
 from typing import Annotated
 from datetime import datetime
+from contextlib import asynccontextmanager
 
-import requests
+import httpx
 
 from fastapi import FastAPI, Request, Form, HTTPException, Depends, status
 from fastapi.responses import HTMLResponse
@@ -12,9 +13,34 @@ from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 from constants import (GEOCODE_API_URL, WEATHER_HISTORICAL_DATA_API_URL, WEATHER_FORECAST_API_URL,
                        DATE_FORMAT, MIN_DATE, MAX_DATE, MIN_FORECAST_DAYS, MAX_FORECAST_DAYS,
-                       WEATHER_INTERVAL, WEATHER_DATES, WEATHER_UNITS, WEATHER_FEATURES, Weather)
+                       WEATHER_INTERVAL, WEATHER_FEATURES, HTTP_TIMEOUT,
+                       HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, GEOCODE_CACHE_TTL,
+                       GEOCODE_CACHE_NEGATIVE_TTL, GEOCODE_CACHE_SIZE, GEOCODE_CACHE_PATH, HISTORICAL_GRID_STEP,
+                       HISTORICAL_CACHE_TILES, Weather)
+from geocode_cache import GeocodeCache
+from historical_cache import HistoricalWeatherCache
+from weather_stats import parse_columns, summarize
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the upstream connections are kept alive and reused by every request instead of opened for each call
+    async with httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+        )
+    ) as http_client:
+        app.state.http_client = http_client
+        app.state.geocode_cache = GeocodeCache(
+            GEOCODE_CACHE_TTL, GEOCODE_CACHE_NEGATIVE_TTL, GEOCODE_CACHE_SIZE, GEOCODE_CACHE_PATH
+        )
+        app.state.historical_cache = HistoricalWeatherCache(HISTORICAL_GRID_STEP, HISTORICAL_CACHE_TILES)
+        yield
+        app.state.geocode_cache.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 security = HTTPBasic()
 
@@ -58,7 +84,10 @@ async def submit_form(request: Request, location: Annotated[str, Form()], startd
                       enddate: Annotated[str, Form()], forecastdays: Annotated[str, Form()]):
     try:
         validate_data(startdate, enddate, forecastdays)
-        weather_data = get_complete_weather_data(location, startdate, enddate, forecastdays)
+        weather_data = await get_complete_weather_data(
+            request.app.state.http_client, request.app.state.geocode_cache, request.app.state.historical_cache,
+            location, startdate, enddate, forecastdays
+        )
         return templates.TemplateResponse(
             "weather-data.html",
             {
@@ -124,82 +153,100 @@ def validate_data(startdate, enddate, forecastdays):
         )
 
 
-def get_location(request_url):
-    location_request = requests.get(request_url)
+async def fetch(http_client, request_url):
+    try:
+        return await http_client.get(request_url)
+    except httpx.RequestError as exception:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Upstream service unavailable: {exception!r}"
+        )
+
+
+async def lookup_location(http_client, request_url):
+    location_request = await fetch(http_client, request_url)
     location_data = location_request.json()
     try:
         location_request.raise_for_status()
-    except requests.HTTPError:
+    except httpx.HTTPStatusError:
         raise HTTPException(status_code=location_data["status"], detail=location_data["message"])
 
     if not location_data:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Location not found")
+        return None
 
     return location_data[0]["lat"], location_data[0]["lon"]
 
 
-def get_weather_data(request_url):
-    weather_request = requests.get(request_url + ",".join(WEATHER_FEATURES))
+async def get_location(http_client, geocode_cache, location):
+    # upstream errors are not cached, an unknown location is
+    coordinates = await geocode_cache.get(
+        location, lambda: lookup_location(http_client, GEOCODE_API_URL.format(location=location))
+    )
+    if coordinates is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Location not found")
+
+    return coordinates
+
+
+async def get_weather_data(http_client, request_url):
+    weather_request = await fetch(http_client, request_url + ",".join(WEATHER_FEATURES))
     weather_data = weather_request.json()
     try:
         weather_request.raise_for_status()
-    except requests.HTTPError:
-        HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=weather_data["reason"])
+    except httpx.HTTPStatusError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=weather_data["reason"])
 
     return weather_data
 
 
-def get_complete_weather_data(location, startdate, enddate, forecastdays):
-    latitude, longitude = get_location(GEOCODE_API_URL.format(location=location))
-    weather_historical_data = get_weather_data(WEATHER_HISTORICAL_DATA_API_URL.format(
-        latitude=latitude, longitude=longitude, startdate=startdate, enddate=enddate, weatherinterval=WEATHER_INTERVAL)
-    )
-    weather_forecast_data = get_weather_data(WEATHER_FORECAST_API_URL.format(
-        latitude=latitude, longitude=longitude, forecastdays=forecastdays, weatherinterval=WEATHER_INTERVAL)
-    )
-    historical_temperature = list(filter(None, weather_historical_data[WEATHER_INTERVAL][WEATHER_FEATURES[0]]))
-    historical_humidity = list(filter(None, weather_historical_data[WEATHER_INTERVAL][WEATHER_FEATURES[1]]))
-    historical_dates = list(filter(None, weather_historical_data[WEATHER_INTERVAL][WEATHER_DATES]))
+async def get_complete_weather_data(http_client, geocode_cache, historical_cache, location, startdate, enddate,
+                                    forecastdays):
+    latitude, longitude = await get_location(http_client, geocode_cache, location)
+
+    def fetch_historical(latitude, longitude, startdate, enddate):
+        return get_weather_data(http_client, WEATHER_HISTORICAL_DATA_API_URL.format(
+            latitude=latitude, longitude=longitude, startdate=startdate, enddate=enddate,
+            weatherinterval=WEATHER_INTERVAL)
+        )
 
-    forecast_temperature = list(filter(None, weather_forecast_data[WEATHER_INTERVAL][WEATHER_FEATURES[0]]))
-    forecast_humidity = list(filter(None, weather_forecast_data[WEATHER_INTERVAL][WEATHER_FEATURES[1]]))
-    forecast_dates = list(filter(None, weather_forecast_data[WEATHER_INTERVAL][WEATHER_DATES]))
+    # both need only the coordinates, so they run side by side and take as long as the slower one; the historical
+    # data only goes upstream for the months the cache does not hold
+    historical_columns, weather_forecast_data = await asyncio.gather(
+        historical_cache.get(latitude, longitude, startdate, enddate, fetch_historical),
+        get_weather_data(http_client, WEATHER_FORECAST_API_URL.format(
+            latitude=latitude, longitude=longitude, forecastdays=forecastdays, weatherinterval=WEATHER_INTERVAL)
+        )
+    )
     try:
+        # every feature of a dataset is aggregated at once, on index-aligned columns with the nulls masked
+        historical_temperature, historical_humidity = summarize(historical_columns)
+        forecast_temperature, forecast_humidity = summarize(parse_columns(weather_forecast_data))
         return Weather(
-            historical_avg_temp=round(fmean(historical_temperature), 2),
-            historical_max_temp=round(max(historical_temperature), 2),
-            historical_max_temp_date=historical_dates[
-                max(range(len(historical_temperature)), key=historical_temperature.__getitem__)],
-            historical_min_temp=round(min(historical_temperature), 2),
-            historical_min_temp_date=historical_dates[
-                min(range(len(historical_temperature)), key=historical_temperature.__getitem__)],
-
-            historical_avg_humidity=round(fmean(historical_humidity), 2),
-            historical_max_humidity=round(max(historical_humidity), 2),
-            historical_max_humidity_date=historical_dates[
-                max(range(len(historical_humidity)), key=historical_humidity.__getitem__)],
-            historical_min_humidity=round(min(historical_humidity), 2),
-            historical_min_humidity_date=historical_dates[
-                min(range(len(historical_humidity)), key=historical_humidity.__getitem__)],
-
-            forecast_avg_temp=round(fmean(forecast_temperature), 2),
-            forecast_max_temp=round(max(forecast_temperature), 2),
-            forecast_max_temp_date=forecast_dates[
-                max(range(len(forecast_temperature)), key=forecast_temperature.__getitem__)],
-            forecast_min_temp=round(min(forecast_temperature), 2),
-            forecast_min_temp_date=forecast_dates[
-                min(range(len(forecast_temperature)), key=forecast_temperature.__getitem__)],
-
-            forecast_avg_humidity=round(fmean(forecast_humidity), 2),
-            forecast_max_humidity=round(max(forecast_humidity), 2),
-            forecast_max_humidity_date=forecast_dates[
-                max(range(len(forecast_humidity)), key=forecast_humidity.__getitem__)],
-            forecast_min_humidity=round(min(forecast_humidity), 2),
-            forecast_min_humidity_date=forecast_dates[
-                min(range(len(forecast_humidity)), key=forecast_humidity.__getitem__)],
-
-            temp_unit=weather_historical_data[WEATHER_UNITS][WEATHER_FEATURES[0]],
-            humidity_unit=weather_historical_data[WEATHER_UNITS][WEATHER_FEATURES[1]]
+            historical_avg_temp=historical_temperature.avg,
+            historical_max_temp=historical_temperature.max,
+            historical_max_temp_date=historical_temperature.max_date,
+            historical_min_temp=historical_temperature.min,
+            historical_min_temp_date=historical_temperature.min_date,
+
+            historical_avg_humidity=historical_humidity.avg,
+            historical_max_humidity=historical_humidity.max,
+            historical_max_humidity_date=historical_humidity.max_date,
+            historical_min_humidity=historical_humidity.min,
+            historical_min_humidity_date=historical_humidity.min_date,
+
+            forecast_avg_temp=forecast_temperature.avg,
+            forecast_max_temp=forecast_temperature.max,
+            forecast_max_temp_date=forecast_temperature.max_date,
+            forecast_min_temp=forecast_temperature.min,
+            forecast_min_temp_date=forecast_temperature.min_date,
+
+            forecast_avg_humidity=forecast_humidity.avg,
+            forecast_max_humidity=forecast_humidity.max,
+            forecast_max_humidity_date=forecast_humidity.max_date,
+            forecast_min_humidity=forecast_humidity.min,
+            forecast_min_humidity_date=forecast_humidity.min_date,
+
+            temp_unit=historical_columns.units[WEATHER_FEATURES[0]],
+            humidity_unit=historical_columns.units[WEATHER_FEATURES[1]]
         )
     except (ValueError, IndexError):
         raise HTTPException(
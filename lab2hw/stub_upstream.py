@@ -0,0 +1,78 @@
+import json
+import math
+import time
+import argparse
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from constants import DATE_FORMAT, WEATHER_INTERVAL, WEATHER_DATES, WEATHER_UNITS, WEATHER_FEATURES
+
+# stands in for the geocoding, archive and forecast APIs with made-up but well-formed answers, each one after
+# a fixed delay, so the app can be tested and timed without the network:
+#   python stub_upstream.py --delay 0.5
+#   then start the app with the three URLs it prints in the environment
+UNITS = {WEATHER_FEATURES[0]: "°C", WEATHER_FEATURES[1]: "%"}
+
+
+def hourly_data(start: datetime, hours: int):
+    times = [start + timedelta(hours=h) for h in range(hours)]
+    return {
+        WEATHER_UNITS: {WEATHER_DATES: "iso8601", **UNITS},
+        WEATHER_INTERVAL: {
+            WEATHER_DATES: [t.strftime("%Y-%m-%dT%H:%M") for t in times],
+            WEATHER_FEATURES[0]: [round(10 + 8 * math.sin(t.hour / 24 * 2 * math.pi), 1) for t in times],
+            WEATHER_FEATURES[1]: [round(70 + 20 * math.cos(t.hour / 24 * 2 * math.pi)) for t in times],
+        }
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        time.sleep(self.delay)
+        if url.path == "/search":
+            body = [{"lat": "50.06", "lon": "19.94", "display_name": query.get("q", "")}]
+        elif url.path == "/v1/era5":
+            start = datetime.strptime(query["start_date"], DATE_FORMAT)
+            end = datetime.strptime(query["end_date"], DATE_FORMAT)
+            body = hourly_data(start, ((end - start).days + 1) * 24)
+        elif url.path == "/v1/forecast":
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            body = hourly_data(today, int(query["forecast_days"]) * 24)
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local stand-in for the upstream weather APIs")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds every response is held back")
+    args = parser.parse_args()
+
+    StubHandler.delay = args.delay
+    base = f"http://127.0.0.1:{args.port}"
+    print(f"GEOCODE_API_URL='{base}/search?q={{location}}&format=jsonv2&limit=1'")
+    print(f"WEATHER_HISTORICAL_DATA_API_URL='{base}/v1/era5?latitude={{latitude}}&longitude={{longitude}}"
+          f"&start_date={{startdate}}&end_date={{enddate}}&{{weatherinterval}}='")
+    print(f"WEATHER_FORECAST_API_URL='{base}/v1/forecast?latitude={{latitude}}&longitude={{longitude}}"
+          f"&forecast_days={{forecastdays}}&{{weatherinterval}}='", flush=True)
+    ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
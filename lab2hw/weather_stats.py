@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Sequence
+
+import numpy as np
+
+from constants import WEATHER_INTERVAL, WEATHER_DATES, WEATHER_UNITS, WEATHER_FEATURES
+
+HOUR_FORMAT = "%Y-%m-%dT%H:%M"
+
+
+@dataclass
+class FeatureSummary:
+    avg: float
+    max: float
+    max_date: str
+    min: float
+    min_date: str
+
+
+# the dates of consecutive hours, formatted like the upstream "time" column only when one is looked up
+class HourlyDates(Sequence):
+    def __init__(self, first_hour: datetime, count: int):
+        self.first_hour = first_hour
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not -self.count <= index < self.count:
+            raise IndexError("hour out of range")
+        return (self.first_hour + timedelta(hours=int(index) % self.count)).strftime(HOUR_FORMAT)
+
+
+# a dataset as index-aligned columns: one row of values per WEATHER_FEATURES entry, NaN where a reading is
+# missing, and dates[i] the hour of column i; nothing is ever filtered out, so an index means the same hour in
+# every row and in dates
+@dataclass
+class WeatherColumns:
+    values: np.ndarray
+    dates: Sequence[str]
+    units: dict
+
+
+def parse_columns(weather_data) -> WeatherColumns:
+    # an upstream answer, JSON nulls become NaN
+    interval = weather_data[WEATHER_INTERVAL]
+    return WeatherColumns(
+        np.array([interval[feature] for feature in WEATHER_FEATURES], dtype=np.float64),
+        interval[WEATHER_DATES], weather_data[WEATHER_UNITS]
+    )
+
+
+def aggregate(matrix: np.ndarray):
+    # mean, max, argmax, min and argmin of every row at once, leaving out the NaNs; the first of equal extremes
+    # wins, like with max(range(len(values)), key=values.__getitem__)
+    valid = ~np.isnan(matrix)
+    counts = valid.sum(axis=1)
+    if not counts.all():
+        raise ValueError("A weather feature has no values")
+    means = np.where(valid, matrix, 0.0).sum(axis=1, dtype=np.float64) / counts
+    argmax = np.where(valid, matrix, -np.inf).argmax(axis=1)
+    argmin = np.where(valid, matrix, np.inf).argmin(axis=1)
+    rows = np.arange(len(matrix))
+    return means, matrix[rows, argmax], argmax, matrix[rows, argmin], argmin
+
+
+def summarize(columns: WeatherColumns) -> List[FeatureSummary]:
+    # one summary per WEATHER_FEATURES entry; raises ValueError for a feature without values
+    if columns.values.shape[1] != len(columns.dates):
+        raise ValueError("Weather features and dates differ in length")
+    means, maxima, argmax, minima, argmin = aggregate(columns.values)
+    return [
+        FeatureSummary(
+            avg=round(float(means[i]), 2),
+            max=round(float(maxima[i]), 2),
+            max_date=columns.dates[argmax[i]],
+            min=round(float(minima[i]), 2),
+            min_date=columns.dates[argmin[i]]
+        )
+        for i in range(len(WEATHER_FEATURES))
+    ]